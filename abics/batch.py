@@ -0,0 +1,262 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+'''
+Run many simulations in parallel
+    python -m abics.batch Configurations/activities --bodies bodies.json --out results --workers 4
+Inputs are activity files, directories of activity files or a manifest (json) listing the cases, e.g.
+    {"cases":[{"name":"hot","activities":"hot.json","mesh":"male.obj","height":1.8,"weight":80}]}
+The bodies file is a list of body parameter sets, e.g. [{"name":"f30","gender":"female","age":30}, ...],
+each input is simulated for every set. Each case is saved to <out>/<name>.npz (see abics.run.saveResults)
+and summary.csv lists the final state of all cases.
+'''
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from support.SimulationCore import Simulator
+from bodymodels.LoadOBJHumanModel import HumanModel
+from abics.run import loadActivities, loadHumanModel, checkRadiationFluxes, runSimulation, saveResults
+
+bodyParameterNames = ['gender','height','weight','age','CardiacIndex','AgingCoeffientForBlood','SexBasedMetabolicRatio']
+simulationParameterNames = ['full','substeps','integrator','stride']
+summaryColumns = ['name','status','activities','mesh','gender','height','weight','age','simulatedTime',
+                  'meanSkinTemperature','meanCoreTemperature','rectalTemperature','maxRectalTemperature','pmv','ppd',
+                  'stopTime','stopReason','elapsed','results','message']
+
+#Meshes loaded by this worker process, cases on the same mesh only differ in the body parameters
+meshCache = dict()
+
+
+def isActivityFile(filename):
+    '''
+    True for activity definitions, directories also hold the clothing and radiation files they refer to
+    '''
+    if os.path.splitext(filename)[1].lower() in ['.csv','.npz']:
+        return True
+    try:
+        with open(filename,'r') as ser:
+            definitions = json.load(ser)
+    except ValueError:
+        return False
+    return isinstance(definitions,dict) and any(isinstance(v,dict) and 'id' in v for v in definitions.values())
+
+
+def loadManifest(filename):
+    '''
+    Cases of a manifest file, file names are resolved against the manifest's directory
+    '''
+    with open(filename,'r') as ser:
+        manifest = json.load(ser)
+    cases = manifest['cases'] if isinstance(manifest,dict) else manifest
+    directory = os.path.dirname(os.path.abspath(filename))
+    for case in cases:
+        for key in ['activities','mesh']:
+            if case.get(key) is not None:
+                case[key] = os.path.join(directory,case[key])
+    return cases
+
+
+def collectCases(inputs,bodies=None,mesh=None,defaults=None):
+    '''
+    List of cases (dicts with name, activities, mesh and body/simulation parameters)
+    inputs - activity files, directories of activity files and manifests
+    bodies - list of body parameter sets, every input case is run for each of them
+    mesh - used by cases that do not name a mesh
+    defaults - simulation parameters (full, substeps, integrator, stride) for cases that do not set them
+    '''
+    cases = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for filename in sorted(glob.glob(os.path.join(item,'*.json'))):
+                if isActivityFile(filename):
+                    cases.append({'activities':filename})
+        elif item.lower().endswith('.json') and not isActivityFile(item):
+            cases.extend(loadManifest(item))
+        else:
+            cases.append({'activities':item})
+    if bodies:
+        bodyCases = []
+        for case in cases:
+            for i,body in enumerate(bodies):
+                bcase = dict(case)
+                bcase.update(body)
+                bcase['name'] = '%s_%s'%(caseName(case),body.get('name',i))
+                bodyCases.append(bcase)
+        cases = bodyCases
+    names = set()
+    for case in cases:
+        if case.get('mesh') is None:
+            case['mesh'] = mesh
+        if not defaults is None:
+            for k,v in defaults.items():
+                case.setdefault(k,v)
+        #Case names are used as result file names
+        name = caseName(case)
+        uname,i = name,1
+        while uname in names:
+            uname = '%s_%d'%(name,i)
+            i +=1
+        case['name'] = uname
+        names.add(uname)
+    return cases
+
+
+def caseName(case):
+    if case.get('name') is not None:
+        return str(case['name'])
+    return os.path.splitext(os.path.basename(case['activities']))[0]
+
+
+def runCase(case,outputDirectory):
+    '''
+    Simulate a case and save its results, returns its summary row
+    Run in the worker processes, failures are reported in the summary
+    '''
+    start = time.time()
+    summary = {'name':case['name'],'activities':case['activities'],'mesh':case.get('mesh')}
+    for k in bodyParameterNames[:4]:
+        summary[k] = case.get(k)
+    try:
+        bodyParameters = dict([(k,case[k]) for k in bodyParameterNames if case.get(k) is not None])
+        mesh = case.get('mesh')
+        projected = not case.get('full',False)
+        if not mesh is None:
+            mesh = os.path.abspath(mesh)
+            if not mesh in meshCache:
+                meshCache[mesh] = HumanModel(mesh,2/3.0,True)
+            humanModel = loadHumanModel(meshCache[mesh],projected,**bodyParameters)
+        else:
+            humanModel = loadHumanModel(None,**bodyParameters)
+        recording = None
+        if case.get('stride',1) > 1:
+            recording = {'stride':case['stride']}
+        simulator = Simulator()
+        simulator.setup(loadActivities(case['activities']),humanModel,not mesh is None and projected,case.get('substeps',10),\
+                        case.get('integrator','bdf'),recording=recording)
+        if simulator.setupError is not None:
+            raise RuntimeError(str(simulator.setupError))
+        checkRadiationFluxes(simulator)
+        runSimulation(simulator)
+        simulationData = simulator.getSimulationResults()
+        filename = os.path.join(outputDirectory,'%s.npz'%case['name'])
+        saveResults(simulationData,filename,compressed=True)
+        summary['status'] = 'completed'
+        summary['results'] = filename
+        summary['simulatedTime'] = simulationData.timeValue[-1]
+        for k in ['meanSkinTemperature','meanCoreTemperature','rectalTemperature','pmv','ppd']:
+            summary[k] = getattr(simulationData,k)[-1]
+        summary['maxRectalTemperature'] = np.max(simulationData.rectalTemperature)
+        summary['stopTime'] = simulationData.stopTime
+        summary['stopReason'] = simulationData.stopReason
+    except Exception as e:
+        logging.error('Case %s failed'%case['name'])
+        traceback.print_exc(file=sys.stderr)
+        summary['status'] = 'failed'
+        summary['message'] = str(e)
+    summary['elapsed'] = time.time() - start
+    return summary
+
+
+def runBatch(cases,outputDirectory,workers=None,verbose=False):
+    '''
+    Run the cases over a pool of worker processes (one per cpu by default), returns the summaries in the order of cases
+    '''
+    if not os.path.exists(outputDirectory):
+        os.makedirs(outputDirectory)
+    summaries = [None]*len(cases)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = dict()
+        for i,case in enumerate(cases):
+            futures[pool.submit(runCase,case,outputDirectory)] = i
+        for future in as_completed(futures):
+            i = futures[future]
+            summaries[i] = future.result()
+            if verbose:
+                print('%s %s in %.1fs'%(cases[i]['name'],summaries[i]['status'],summaries[i]['elapsed']),file=sys.stderr)
+    return summaries
+
+
+def saveSummary(summaries,filename):
+    with open(filename,'w',newline='') as ser:
+        writer = csv.DictWriter(ser,fieldnames=summaryColumns,restval='')
+        writer.writeheader()
+        for summary in summaries:
+            writer.writerow(dict([(k,'' if v is None else v) for k,v in summary.items()]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run thermoregulation simulations in parallel without the user interface')
+    parser.add_argument('inputs', nargs='+', help='Activity files, directories of activity files or manifests (json)')
+    parser.add_argument('-o','--out', required=True, help='Directory for the results and summary.csv')
+    parser.add_argument('-b','--bodies', default=None, help='Body parameter sets (json list), each input is run for every set')
+    parser.add_argument('-m','--mesh', default=None, help='Body mesh (obj) for cases that do not name one, the standard 16 segment body if omitted')
+    parser.add_argument('-w','--workers', type=int, default=None, help='Number of worker processes, one per cpu by default')
+    parser.add_argument('--full', action='store_true', help='Simulate every face of the mesh instead of projecting to the 16 segment model')
+    parser.add_argument('--substeps', type=int, default=10, help='Samples per activity')
+    parser.add_argument('--integrator', default='bdf', help='Time integration backend (bdf, radau, implicit-euler; lsoda and vode assemble dense jacobians and only suit the 16 segment model)')
+    parser.add_argument('--stride', type=int, default=1, help='Store the per face fields every stride samples')
+    parser.add_argument('-v','--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    
+    bodies = None
+    if not args.bodies is None:
+        with open(args.bodies,'r') as ser:
+            bodies = json.load(ser)
+    defaults = {'full':args.full,'substeps':args.substeps,'integrator':args.integrator,'stride':args.stride}
+    cases = collectCases(args.inputs,bodies,args.mesh,defaults)
+    if len(cases) == 0:
+        logging.error('No activity files found')
+        return 1
+    summaries = runBatch(cases,args.out,args.workers,args.verbose)
+    saveSummary(summaries,os.path.join(args.out,'summary.csv'))
+    failed = sum(1 for s in summaries if s['status']!='completed')
+    if failed > 0:
+        logging.error('%d of %d cases failed'%(failed,len(cases)))
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+'''
+Headless simulation runner, does not require Qt or Zinc
+    python -m abics.run activities.json mesh.obj --out results.npz
+activities - activity file as saved by the activity wizard (json) or a weather/occupancy schedule (csv/npz, see support.Schedules)
+mesh - obj mesh of the body, when omitted the standard 16 segment body is simulated
+'''
+import argparse
+import copy
+import json
+import logging
+import os
+import signal
+import sys
+import time
+import numpy as np
+from support.SimulationCore import Simulator
+from support.Schedules import ActivitySchedule
+from bodymodels.LoadOBJHumanModel import HumanModel
+from bodymodels.StandardT65Setup import Tanabe17segmentModel, PersonalizedTanabe17SegmentModel
+
+
+def loadActivities(filename):
+    '''
+    Returns the activities of filename in the form expected by Simulator.setup
+    '''
+    if os.path.splitext(filename)[1].lower() in ['.csv','.npz']:
+        return ActivitySchedule.fromFile(filename)
+    with open(filename,'r') as ser:
+        definitions = json.load(ser)
+    activities = dict()
+    activities['activityname'] = definitions.get('activityname',os.path.basename(filename))
+    for activity in definitions.values():
+        if isinstance(activity,dict):
+            activity['id'] = int(activity['id'])
+            #Relative file names are resolved against the activity file
+            activity['definitionDirectory'] = os.path.dirname(os.path.abspath(filename))
+            activities[activity['id']] = activity
+    return activities
+
+
+def loadHumanModel(meshFile=None,projected=True,gender='male',height=1.72,weight=74.43,age=35,**kwargs):
+    '''
+    Body model for the simulation, set up as in the user interface
+    meshFile - obj file or a HumanModel loaded from one (it is copied, not changed)
+    kwargs - CardiacIndex, AgingCoeffientForBlood, SexBasedMetabolicRatio
+    '''
+    if meshFile is None:
+        if len(kwargs) == 0 and gender=='male' and height==1.72 and weight==74.43 and age==35:
+            humanModel = Tanabe17segmentModel()
+            humanModel.personalizeParameters()
+            return humanModel
+        return PersonalizedTanabe17SegmentModel(gender,height,weight,age,**kwargs)
+    if isinstance(meshFile,HumanModel):
+        humanModel = copy.deepcopy(meshFile)
+    else:
+        humanModel = HumanModel(meshFile,2/3.0,True)
+    if projected:
+        #Projected simulations use the surface area of the standard model
+        humanModel.totalSurfaceArea = humanModel.basemodelSurfaceArea
+    humanModel.personalizeParameters(gender,height,weight,age,**kwargs)
+    return humanModel
+
+
+def checkRadiationFluxes(simulator):
+    '''
+    Raise a ValueError if a radiation file of the simulator's activities does not fit the simulated body
+    Per face fluxes can only be applied to a projected simulation on the mesh they were computed for
+    '''
+    numFaces = simulator.trModel.getNumberOfDofs()
+    radiationIndex = simulator.radiationIndex
+    for rix in np.unique(radiationIndex[radiationIndex >= 0]):
+        numFluxes = simulator.radiationData[rix].getNumIndicies()
+        if numFluxes != 16 and numFluxes != numFaces:
+            filename = simulator.activitySchedule.radiationFiles[rix]
+            if simulator.projectedSimulation:
+                raise ValueError('Radiation flux file %s has fluxes for %d faces, the mesh has %d faces'%(filename,numFluxes,numFaces))
+            raise ValueError('Radiation flux file %s has per face fluxes (%d), these require a projected simulation on the mesh they were computed for'%(filename,numFluxes))
+
+
+def runSimulation(simulator,checkpointFile=None,checkpointInterval=60.0,verbose=False):
+    '''
+    Run the remaining activities of simulator, returns False if it was stopped (see Simulator.stop) before completion,
+    a stop takes effect after the current sub step
+    checkpointFile - the state is saved to it when stopped and after the sub step that exceeds checkpointInterval seconds
+                     since the last checkpoint
+    '''
+    maxSteps = simulator.timeValues.shape[0]
+    lastCheckpoint = [time.time()]
+    
+    def checkpointSubStep():
+        if not checkpointFile is None and time.time() - lastCheckpoint[0] > checkpointInterval:
+            simulator.saveCheckpoint(checkpointFile)
+            lastCheckpoint[0] = time.time()
+            
+    while simulator.currentTimeIndex < maxSteps:
+        if simulator.stopProcessing:
+            if not checkpointFile is None:
+                simulator.saveCheckpoint(checkpointFile)
+            return False
+        completed = simulator.run(checkpointSubStep)
+        if simulator.setupError is not None:
+            raise RuntimeError('Activity %d failed: %s'%(simulator.currentTimeIndex,str(simulator.setupError)))
+        if not completed:
+            #Interrupted within the activity, the checkpoint is written above
+            continue
+        simulator.currentTimeIndex += 1
+        if verbose:
+            print('Completed activity %d of %d'%(simulator.currentTimeIndex,maxSteps),file=sys.stderr)
+        if simulator.isStopped():
+            break
+    return True
+
+
+def saveResults(simulationData,filename,compressed=False):
+    '''
+    Write the results to an npz file, one array per series and recorded field
+    Files ending with .abr are written as result files instead (see SimulationData.save), which are read lazily
+    '''
+    if filename.lower().endswith('.abr'):
+        simulationData.save(filename)
+        return
+    results = dict()
+    for name in simulationData.seriesNames:
+        results[name] = np.asarray(getattr(simulationData,name))
+    results['sensation'] = np.array(['' if s is None else s for s in simulationData.sensation])
+    results['fieldTimeValue'] = np.asarray(simulationData.getFieldTimeValues())
+    for name in simulationData.fieldNames:
+        if simulationData.getRecordingLevel(name) == 'face':
+            results[name] = np.asarray(getattr(simulationData,name))
+    for name in ['skinTemperature','coreTemperature']:
+        if not simulationData.getRecordingLevel(name) is None:
+            results['segment%s%s'%(name[0].upper(),name[1:])] = simulationData.getSegmentField(name)
+    if not simulationData.stopTime is None:
+        results['stopTime'] = np.array(simulationData.stopTime)
+        results['stopReason'] = np.array(simulationData.stopReason)
+    if compressed:
+        np.savez_compressed(filename,**results)
+    else:
+        np.savez(filename,**results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a thermoregulation simulation without the user interface')
+    parser.add_argument('activities', help='Activity file (json) or weather/occupancy schedule (csv, npz)')
+    parser.add_argument('mesh', nargs='?', default=None, help='Body mesh (obj), the standard 16 segment body if omitted')
+    parser.add_argument('-o','--out', required=True, help='Results file (npz, or abr for a result file)')
+    parser.add_argument('--full', action='store_true', help='Simulate every face of the mesh instead of projecting to the 16 segment model')
+    parser.add_argument('--substeps', type=int, default=10, help='Samples per activity')
+    parser.add_argument('--integrator', default='bdf', help='Time integration backend (bdf, radau, implicit-euler; lsoda and vode assemble dense jacobians and only suit the 16 segment model)')
+    parser.add_argument('--gender', default='male', choices=['male','female'])
+    parser.add_argument('--height', type=float, default=1.72, help='Height in m')
+    parser.add_argument('--weight', type=float, default=74.43, help='Weight in kg')
+    parser.add_argument('--age', type=float, default=35)
+    parser.add_argument('--stride', type=int, default=1, help='Store the per face fields every stride samples')
+    parser.add_argument('--storage', default=None, help='Directory for disk backed results of large meshes')
+    parser.add_argument('--checkpoint', default=None, help='Checkpoint file, the simulation continues from it if it exists')
+    parser.add_argument('--checkpoint-interval', type=float, default=60.0, help='Seconds between checkpoints')
+    parser.add_argument('-v','--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    
+    if not args.checkpoint is None and os.path.exists(args.checkpoint):
+        simulator = Simulator.loadCheckpoint(args.checkpoint)
+        if args.verbose:
+            print('Continuing from activity %d sub step %d'%(simulator.currentTimeIndex,simulator.subStepIndex),file=sys.stderr)
+    else:
+        age = int(args.age) if args.age == int(args.age) else args.age
+        humanModel = loadHumanModel(args.mesh,not args.full,args.gender,args.height,args.weight,age)
+        recording = None
+        if args.stride > 1:
+            recording = {'stride':args.stride}
+        simulator = Simulator()
+        try:
+            simulator.setup(loadActivities(args.activities),humanModel,not args.mesh is None and not args.full,args.substeps,\
+                            args.integrator,storageDirectory=args.storage,recording=recording)
+            checkRadiationFluxes(simulator)
+        except ValueError as e:
+            #Missing files and radiation fluxes that do not fit the body
+            logging.error(str(e))
+            return 1
+        if simulator.setupError is not None:
+            raise RuntimeError(str(simulator.setupError))
+    
+    #Schedulers send SIGTERM before pre-empting a job, stop after the current sub step and keep a checkpoint
+    def stopSimulation(signum,frame):
+        simulator.stop()
+    signal.signal(signal.SIGTERM,stopSimulation)
+    
+    if not runSimulation(simulator,args.checkpoint,args.checkpoint_interval,args.verbose):
+        logging.error('Simulation stopped at activity %d sub step %d%s'%(simulator.currentTimeIndex,simulator.subStepIndex,'' if args.checkpoint is None else ', continue with the same --checkpoint'))
+        return 2
+    saveResults(simulator.getSimulationResults(),args.out)
+    if not args.checkpoint is None and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
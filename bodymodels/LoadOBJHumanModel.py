@@ -36,17 +36,17 @@
  '''
 from __future__ import unicode_literals,print_function
 
-from opencmiss.zinc.context import Context
-from opencmiss.zinc.element import Element, Elementbasis
-from opencmiss.zinc.node import Node
-from opencmiss.zinc.field import Field
 import numpy as np
 from bodymodels.npdatamanager import PersonalizedTanabe16SegmentBodyData
+from bodymodels.SegmentLabels import labelsFromDofIndexes
 import os
 
 
 zincDebug = False
 cubicHermite = False
+#Zinc field and the SimulationData field it shows
+zincFieldNames = [('Tskin','skinTemperature'),('Tcore','coreTemperature'),('SkinWettedness','skinWettedness'),
+                  ('ThermalResistance','thermalResistance'),('EvaporativeResistance','evaporativeResistance')]
 
     
          
@@ -305,7 +305,7 @@ class HumanModel(AbstractHumanModel):
         ctr = 0
         cymax = 0 
         for nd,vals in self.nodeGroup.items():
-            bt = np.asarray(vals).min()
+            bt = min(vals)
             if filterFaces and bt==headValue:
                 headNodes.append(nd)
             if bt==chestValue or bt==abdomainValue:
@@ -317,7 +317,7 @@ class HumanModel(AbstractHumanModel):
         
         cz /= ctr
         for nd,vals in self.nodeGroup.items():
-            bt = np.asarray(vals).min()
+            bt = min(vals)
             if bt==chestValue or bt==abdomainValue:
                 z = self.nodes[nd][2] - cz
                 if z < 0:
@@ -333,25 +333,27 @@ class HumanModel(AbstractHumanModel):
             faceNormal = teethCoord-headCentroid
             faceNormal /= np.linalg.norm(faceNormal)
             #Determine "face" faces
+            headNodeSet = set(headNodes)
             self.faceDofs = np.zeros((fctr,1),dtype=bool)
             for fc,fn in self.faceNormals.items():
-                faceN = np.array([self.nodeNormals[i] for i in fn])
-                match = np.dot(faceN,faceNormal)
-                faceside = np.min(match)>0
-                for fnode in self.faces[fc]:
-                    faceside = faceside and fnode in headNodes
-                self.faceDofs[fc] = faceside
+                #Only faces of the head can be on the face side
+                if all(fnode in headNodeSet for fnode in self.faces[fc]):
+                    faceN = np.array([self.nodeNormals[i] for i in fn])
+                    match = np.dot(faceN,faceNormal)
+                    self.faceDofs[fc] = np.min(match)>0
         
         totalSurfaceArea = 0
+        #Lowest group of each node, a face belongs to the lowest group of its nodes
+        nodeGroupMin = dict((nd,min(vals)) for nd,vals in self.nodeGroup.items())
         for fid,nds in self.faces.items():
             if len(nds)==4:
-                pg = np.min([np.min(self.nodeGroup[nds[0]]),np.min(self.nodeGroup[nds[1]]),np.min(self.nodeGroup[nds[2]]),np.min(self.nodeGroup[nds[3]])])
+                pg = min(nodeGroupMin[nds[0]],nodeGroupMin[nds[1]],nodeGroupMin[nds[2]],nodeGroupMin[nds[3]])
                 le = np.linalg.norm(np.asarray(self.nodes[nds[0]])-np.asarray(self.nodes[nds[1]]))
                 br = np.linalg.norm(np.asarray(self.nodes[nds[0]])-np.asarray(self.nodes[nds[2]]))
                 self.faceAreas[fid] = le*br
                 totalSurfaceArea += le*br
             else:
-                pg = np.min([np.min(self.nodeGroup[nds[0]]),np.min(self.nodeGroup[nds[1]]),np.min(self.nodeGroup[nds[2]])])
+                pg = min(nodeGroupMin[nds[0]],nodeGroupMin[nds[1]],nodeGroupMin[nds[2]])
                 a = np.linalg.norm(np.asarray(self.nodes[nds[0]])-np.asarray(self.nodes[nds[1]]))
                 b = np.linalg.norm(np.asarray(self.nodes[nds[0]])-np.asarray(self.nodes[nds[2]]))
                 c = np.linalg.norm(np.asarray(self.nodes[nds[1]])-np.asarray(self.nodes[nds[2]]))
@@ -384,6 +386,7 @@ class HumanModel(AbstractHumanModel):
             
         for fd,gp in self.facegroup.items():
             self.dofIndexes[gp][fd] = True
+        self.segmentLabels = labelsFromDofIndexes(self.dofIndexes,self.numberOfFaces)
             
         #Find width of nodes
         self.anatomyWidths = dict()
@@ -497,11 +500,18 @@ class HumanModel(AbstractHumanModel):
         
     
     def generateMesh(self,context=None,fieldData=None,zeroCenter=False):
+        '''
+        The mesh holds a single field sample rather than a time sequence of all samples, the sample that is
+        shown is assigned with assignTimeSlice (e.g. as the time slider moves)
+        fieldData - if given its first field sample is shown
+        '''
+        #Zinc is only required to create meshes, the geometry and parameters can be used without it
+        from opencmiss.zinc.context import Context
+        from opencmiss.zinc.element import Element, Elementbasis
+        from opencmiss.zinc.node import Node
+        from opencmiss.zinc.field import Field
         if context is None:
             context = Context('Cartography')
-        maxTimeValue=1
-        if not fieldData is None:
-            maxTimeValue = fieldData.numberOfTimeSamples
         if zincDebug:
             logger = context.getLogger()
         #Clear the region if it already exists
@@ -519,19 +529,14 @@ class HumanModel(AbstractHumanModel):
         coordinateField.setName('coordinates')
         coordinateField.setTypeCoordinate(True)
                 
-        skinTemperature = fieldModule.createFieldFiniteElement(1)
-        skinTemperature.setName('Tskin')
-        coreTemperature = fieldModule.createFieldFiniteElement(1)
-        coreTemperature.setName('Tcore')
-        skinWettedNess = fieldModule.createFieldFiniteElement(1)
-        skinWettedNess.setName('SkinWettedness')
-        thermalResistance= fieldModule.createFieldFiniteElement(1)
-        thermalResistance.setName('ThermalResistance')
-        evaporativeResistance = fieldModule.createFieldFiniteElement(1)
-        evaporativeResistance.setName('EvaporativeResistance')
-        
-        #above fields may vary with time
-        tlist = list(range(maxTimeValue))
+        #The values of all fields at a face are assigned in one call, the named fields are its components
+        fieldValues = fieldModule.createFieldFiniteElement(len(zincFieldNames))
+        fieldValues.setName('fieldValues')
+        for i,(name,_) in enumerate(zincFieldNames):
+            component = fieldModule.createFieldComponent(fieldValues,i+1)
+            component.setName(name)
+            component.setManaged(True)
+        dataFields = [fieldValues]
         
         # Find a special node set named 'cmiss_nodes'
         nodeset = fieldModule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
@@ -565,17 +570,8 @@ class HumanModel(AbstractHumanModel):
         #Create a set of nodes for each element to hold element time values
         nodeTemplate = nodeset.createNodetemplate()
 
-        timeSequence = fieldModule.getMatchingTimesequence(tlist)
-        nodeTemplate.defineField(skinTemperature)
-        nodeTemplate.defineField(coreTemperature)
-        nodeTemplate.defineField(skinWettedNess)
-        nodeTemplate.defineField(thermalResistance)
-        nodeTemplate.defineField(evaporativeResistance)
-        nodeTemplate.setTimesequence(skinTemperature,timeSequence)
-        nodeTemplate.setTimesequence(coreTemperature,timeSequence)
-        nodeTemplate.setTimesequence(skinWettedNess,timeSequence)
-        nodeTemplate.setTimesequence(thermalResistance,timeSequence)
-        nodeTemplate.setTimesequence(evaporativeResistance,timeSequence)
+        for field in dataFields:
+            nodeTemplate.defineField(field)
         
 
         mesh = fieldModule.findMeshByDimension(2)
@@ -594,20 +590,14 @@ class HumanModel(AbstractHumanModel):
         quadElementTemplate = mesh.createElementtemplate()
         quadElementTemplate.setElementShapeType(Element.SHAPE_TYPE_SQUARE)        
         quadElementTemplate.defineField(coordinateField, -1,qeft)
-        quadElementTemplate.defineField(skinTemperature, -1,ceft)
-        quadElementTemplate.defineField(coreTemperature, -1,ceft)
-        quadElementTemplate.defineField(skinWettedNess, -1,ceft)
-        quadElementTemplate.defineField(thermalResistance, -1,ceft)
-        quadElementTemplate.defineField(evaporativeResistance,-1, ceft) 
+        for field in dataFields:
+            quadElementTemplate.defineField(field, -1,ceft)
 
         triElementTemplate  = mesh.createElementtemplate()
         triElementTemplate.setElementShapeType(Element.SHAPE_TYPE_TRIANGLE)
         triElementTemplate.defineField(coordinateField, -1,teft)
-        triElementTemplate.defineField(skinTemperature, -1,ceft)
-        triElementTemplate.defineField(coreTemperature, -1,ceft)
-        triElementTemplate.defineField(skinWettedNess, -1,ceft)
-        triElementTemplate.defineField(thermalResistance, -1,ceft)
-        triElementTemplate.defineField(evaporativeResistance, -1,ceft)
+        for field in dataFields:
+            triElementTemplate.defineField(field, -1,ceft)
         dataNodes = dict()
         for fid,nodes in self.faces.items():
             nNumbers = [n+numFaces for n in nodes]
@@ -625,15 +615,7 @@ class HumanModel(AbstractHumanModel):
             element.setNodesByIdentifier(ceft, [node.getIdentifier()])
         
         if not fieldData is None:
-            for nd,node in dataNodes.items():
-                fieldCache.setNode(node)
-                for i in range(maxTimeValue):
-                    fieldCache.setTime(i)
-                    skinTemperature.assignReal(fieldCache,fieldData.skinTemperature[nd,i])
-                    coreTemperature.assignReal(fieldCache,fieldData.coreTemperature[nd,i])
-                    skinWettedNess.assignReal(fieldCache,fieldData.skinWettedness[nd,i])
-                    thermalResistance.assignReal(fieldCache,fieldData.thermalResistance[nd,i])
-                    evaporativeResistance.assignReal(fieldCache,fieldData.evaporativeResistance[nd,i])
+            self.assignTimeSlice(context,fieldData,0)
                     
         if cubicHermite:
             smooth = fieldModule.createFieldsmoothing()
@@ -650,4 +632,22 @@ class HumanModel(AbstractHumanModel):
                 for i in range(1, loggerMessageCount + 1):
                     print(logger.getMessageTypeAtIndex(i), logger.getMessageTextAtIndex(i))
                 logger.removeAllMessages()
-                
\ No newline at end of file
+                
+
+    def assignTimeSlice(self,context,fieldData,timeIndex):
+        '''
+        Show field sample timeIndex of fieldData on a mesh created by generateMesh
+        Only this sample is read from fieldData, the values of a face are assigned in one call
+        '''
+        from opencmiss.zinc.field import Field
+        region = context.getDefaultRegion().findChildByName('manequin')
+        fieldModule = region.getFieldmodule()
+        fieldCache = fieldModule.createFieldcache()
+        nodeset = fieldModule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+        fieldValues = fieldModule.findFieldByName('fieldValues')
+        values = np.column_stack([fieldData.getFaceField(attribute,timeIndex,timeIndex+1)[:,0] for _,attribute in zincFieldNames])
+        fieldModule.beginChange()
+        for fid in self.faces.keys():
+            fieldCache.setNode(nodeset.findNodeByIdentifier(fid+1))
+            fieldValues.assignReal(fieldCache,values[fid].tolist())
+        fieldModule.endChange()
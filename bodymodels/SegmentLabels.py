@@ -0,0 +1,131 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+
+import numpy as np
+from scipy import sparse
+
+numberOfSegments = 16
+
+def labelsFromDofIndexes(dofIndexes,numberOfFaces):
+    '''
+    Build the face to segment label array from a dict of per segment boolean masks
+    Faces that do not belong to any segment are labelled -1
+    '''
+    labels = -np.ones(numberOfFaces,dtype=np.int8)
+    for i,indexes in dofIndexes.items():
+        labels[indexes] = i
+    return labels
+
+def getSegmentLabels(humanModel):
+    '''
+    Returns the int8 face to segment label array of the human model
+    Models created before the labels were introduced only carry dofIndexes, these are converted once and cached
+    '''
+    labels = getattr(humanModel,'segmentLabels',None)
+    if labels is None:
+        labels = labelsFromDofIndexes(humanModel.dofIndexes,humanModel.numberOfFaces)
+        humanModel.segmentLabels = labels
+    return labels
+
+
+class SegmentAggregator(object):
+    '''
+    Gathers face values into segment values and scatters segment values onto faces
+    Every reduction is a single pass over the faces using a sparse numberOfSegments x numberOfFaces operator
+    '''
+
+    def __init__(self,labels,numberOfSegments=numberOfSegments):
+        self.labels = np.asarray(labels,dtype=np.int8)
+        self.numberOfSegments = numberOfSegments
+        self.numberOfFaces = self.labels.shape[0]
+        assigned = self.labels >= 0
+        self.faces = np.flatnonzero(assigned)
+        self.faceSegments = self.labels[assigned].astype(np.intp)
+        self.counts = np.bincount(self.faceSegments,minlength=numberOfSegments)
+        self.operator = sparse.csr_matrix((np.ones(self.faces.shape[0]),(self.faceSegments,self.faces)),\
+                                          shape=(numberOfSegments,self.numberOfFaces))
+        #Unassigned faces point to an extra zero row when scattering
+        self.scatterIndexes = np.where(assigned,self.labels,numberOfSegments).astype(np.intp)
+        segments,firstFace = np.unique(self.faceSegments,return_index=True)
+        self.firstFaces = np.zeros(numberOfSegments,dtype=np.intp)
+        self.firstFaces[segments] = self.faces[firstFace]
+
+    @classmethod
+    def fromHumanModel(cls,humanModel):
+        return cls(getSegmentLabels(humanModel))
+
+    def getFaces(self,segment):
+        return np.flatnonzero(self.labels==segment)
+
+    def sum(self,values,weights=None):
+        '''
+        Segment sums of face values, values may be (numberOfFaces,) or (numberOfFaces,k)
+        '''
+        values = np.asarray(values)
+        if weights is not None:
+            values = values*(weights if values.ndim==1 else weights[:,np.newaxis])
+        if values.ndim==1:
+            return np.bincount(self.faceSegments,weights=values[self.faces],minlength=self.numberOfSegments)
+        return self.operator.dot(values)
+
+    def mean(self,values,weights=None):
+        '''
+        Segment means of face values, weighted by weights (e.g. face areas) if provided
+        '''
+        if weights is None:
+            total = self.counts
+        else:
+            total = np.bincount(self.faceSegments,weights=np.asarray(weights)[self.faces],minlength=self.numberOfSegments)
+        result = self.sum(values,weights)
+        if result.ndim==1:
+            return result/total
+        return result/total[:,np.newaxis]
+
+    def first(self,values):
+        '''
+        Value at the first face of each segment
+        '''
+        return np.take(values,self.firstFaces,axis=0)
+
+    def scatter(self,segmentValues,out=None):
+        '''
+        Broadcast segment values onto the faces, unassigned faces receive zero
+        '''
+        segmentValues = np.asarray(segmentValues)[:self.numberOfSegments]
+        padded = np.concatenate([segmentValues,np.zeros((1,)+segmentValues.shape[1:],dtype=segmentValues.dtype)])
+        return np.take(padded,self.scatterIndexes,axis=0,out=out)
@@ -58,6 +58,7 @@ class Tanabe17segmentModel(object):
         for i in range(16):
             self.dofIndexes[i] = np.zeros(self.numberOfFaces,dtype='bool')
             self.dofIndexes[i][i] = True
+        self.segmentLabels = np.arange(self.numberOfFaces,dtype=np.int8)
             
     def getQb(self):
         return 0.778
@@ -0,0 +1,263 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import os
+import numpy as np
+
+
+class ChunkedTimeSeries(object):
+    '''
+    Disk backed (nDofs, numberOfTimeSamples) array used in place of a dense array for large simulations
+    The samples are stored in .npy files of chunkSize samples each (time major so that a sample is contiguous),
+    memory mapped when accessed. Chunk files are created as samples are written, unwritten samples read as 0
+    Supports indexing as [dofs,timeIndex] and [dofs,times], assignment of a sample [dofs,timeIndex] = values,
+    min/max and iterateChunks for reductions that proceed chunk by chunk
+    Pickling only stores the location of the chunks, so the data can be passed between processes cheaply
+    '''
+    
+    def __init__(self,directory,name,nDofs,numberOfTimeSamples,chunkSize=256,dtype=np.float64):
+        self.directory = directory
+        self.name = name
+        self.nDofs = nDofs
+        self.numberOfTimeSamples = numberOfTimeSamples
+        self.chunkSize = chunkSize
+        self.dtype = np.dtype(dtype)
+        self.chunks = dict()
+        
+    @property
+    def shape(self):
+        return (self.nDofs,self.numberOfTimeSamples)
+    
+    @property
+    def ndim(self):
+        return 2
+    
+    def getNumberOfChunks(self):
+        return (self.numberOfTimeSamples + self.chunkSize - 1)//self.chunkSize
+    
+    def getChunkFileName(self,c):
+        return os.path.join(self.directory,'%s_%06d.npy'%(self.name,c))
+    
+    def getChunk(self,c,writable=False):
+        '''
+        Returns the (samples, nDofs) memory map of chunk c, created if writable and not on disk yet
+        If the chunk has not been written a zero array is returned
+        '''
+        numberOfSamples = min(self.chunkSize,self.numberOfTimeSamples - c*self.chunkSize)
+        if c in self.chunks:
+            chunk,mode = self.chunks[c]
+            if not writable or mode == 'r+':
+                return chunk[:numberOfSamples]
+        filename = self.getChunkFileName(c)
+        if os.path.exists(filename):
+            mode = 'r+' if writable else 'r'
+            chunk = np.lib.format.open_memmap(filename,mode=mode)
+        elif writable:
+            mode = 'r+'
+            chunk = np.lib.format.open_memmap(filename,mode='w+',dtype=self.dtype,shape=(self.chunkSize,self.nDofs))
+        else:
+            return np.zeros((numberOfSamples,self.nDofs),dtype=self.dtype)
+        self.chunks[c] = (chunk,mode)
+        return chunk[:numberOfSamples]
+    
+    def iterateChunks(self):
+        '''
+        Yields the data as consecutive (nDofs, samples) blocks, one per chunk
+        '''
+        for c in range(self.getNumberOfChunks()):
+            yield self.getChunk(c).T
+    
+    def checkTimeIndex(self,t):
+        if t < 0:
+            t += self.numberOfTimeSamples
+        if t < 0 or t >= self.numberOfTimeSamples:
+            raise IndexError('Time index %d is out of bounds for %d samples'%(t,self.numberOfTimeSamples))
+        return t
+            
+    def __getitem__(self,key):
+        if not isinstance(key,tuple):
+            key = (key,slice(None))
+        dofKey,timeKey = key
+        if isinstance(timeKey,(int,np.integer)):
+            c,offset = divmod(self.checkTimeIndex(timeKey),self.chunkSize)
+            return self.getChunk(c)[offset][dofKey]
+        times = np.arange(self.numberOfTimeSamples)[timeKey]
+        result = np.empty((self.nDofs,times.shape[0]),dtype=self.dtype)
+        chunkIndexes = times//self.chunkSize
+        for c in np.unique(chunkIndexes):
+            selected = chunkIndexes == c
+            result[:,selected] = self.getChunk(c)[times[selected] - c*self.chunkSize].T
+        return result[dofKey]
+    
+    def __setitem__(self,key,value):
+        dofKey,timeKey = key
+        if not isinstance(timeKey,(int,np.integer)):
+            raise TypeError('Chunked time series are written one time sample at a time')
+        c,offset = divmod(self.checkTimeIndex(timeKey),self.chunkSize)
+        self.getChunk(c,True)[offset,dofKey] = value
+    
+    def __array__(self,dtype=None,copy=None):
+        result = self[:,:]
+        if dtype is not None:
+            result = result.astype(dtype)
+        return result
+        
+    def max(self):
+        return max(chunk.max() for chunk in self.iterateChunks())
+    
+    def min(self):
+        return min(chunk.min() for chunk in self.iterateChunks())
+    
+    def flush(self):
+        for chunk,mode in self.chunks.values():
+            if mode == 'r+':
+                chunk.flush()
+    
+    def truncate(self,numberOfTimeSamples):
+        '''
+        Discard the samples from numberOfTimeSamples on, the chunk files that are no longer used are removed
+        '''
+        self.flush()
+        numberOfChunks = self.getNumberOfChunks()
+        self.numberOfTimeSamples = numberOfTimeSamples
+        for c in range(self.getNumberOfChunks(),numberOfChunks):
+            self.chunks.pop(c,None)
+            filename = self.getChunkFileName(c)
+            if os.path.exists(filename):
+                os.remove(filename)
+        
+    def __getstate__(self):
+        self.flush()
+        state = self.__dict__.copy()
+        state['chunks'] = dict()
+        return state
+    
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+
+
+class PiecewiseConstantTimeSeries(object):
+    '''
+    In memory (nDofs, numberOfTimeSamples) array for fields that rarely change, such as the clothing resistances
+    that are constant within an activity. A sample equal to the one written before it is stored as a reference
+    to it, so only the distinct values are kept. Unwritten samples read as 0
+    Supports the same access as ChunkedTimeSeries
+    '''
+    
+    def __init__(self,nDofs,numberOfTimeSamples,dtype=np.float64,chunkSize=256):
+        self.nDofs = nDofs
+        self.numberOfTimeSamples = numberOfTimeSamples
+        self.dtype = np.dtype(dtype)
+        self.chunkSize = chunkSize
+        self.values = []
+        self.sampleIndexes = np.full(numberOfTimeSamples,-1,dtype=np.int32)
+    
+    @property
+    def shape(self):
+        return (self.nDofs,self.numberOfTimeSamples)
+    
+    @property
+    def ndim(self):
+        return 2
+    
+    def getNumberOfDistinctSamples(self):
+        return len(self.values)
+    
+    def __getitem__(self,key):
+        if not isinstance(key,tuple):
+            key = (key,slice(None))
+        dofKey,timeKey = key
+        if isinstance(timeKey,(int,np.integer)):
+            ix = self.sampleIndexes[timeKey]
+            if ix < 0:
+                return np.zeros(self.nDofs,dtype=self.dtype)[dofKey]
+            return self.values[ix][dofKey]
+        #The last column stands for the unwritten samples
+        columns = np.column_stack(self.values + [np.zeros(self.nDofs,dtype=self.dtype)])
+        return columns[dofKey][...,self.sampleIndexes[timeKey]]
+    
+    def __setitem__(self,key,value):
+        dofKey,timeKey = key
+        if not isinstance(timeKey,(int,np.integer)) or dofKey != slice(None):
+            raise TypeError('Piecewise constant time series are written one complete time sample at a time')
+        value = np.asarray(value,dtype=self.dtype)
+        if len(self.values) == 0 or not np.array_equal(self.values[-1],value):
+            self.values.append(value.copy())
+        self.sampleIndexes[timeKey] = len(self.values) - 1
+    
+    def getSamples(self,start,stop):
+        '''
+        Returns the distinct values used by samples start..stop-1 and the index of each sample into them (-1 if unwritten)
+        '''
+        indexes = self.sampleIndexes[start:stop]
+        used = np.unique(indexes[indexes >= 0])
+        localIndexes = np.where(indexes >= 0,np.searchsorted(used,indexes),-1)
+        return [self.values[i] for i in used],localIndexes
+    
+    def setSamples(self,start,samples):
+        '''
+        Write samples from start on, samples as returned by getSamples
+        '''
+        values,indexes = samples
+        for i,ix in enumerate(indexes):
+            if ix >= 0:
+                self[:,start+i] = values[ix]
+    
+    def iterateChunks(self):
+        for start in range(0,self.numberOfTimeSamples,self.chunkSize):
+            yield self[:,start:start+self.chunkSize]
+    
+    def __array__(self,dtype=None,copy=None):
+        result = self[:,:]
+        if dtype is not None:
+            result = result.astype(dtype)
+        return result
+    
+    def max(self):
+        if np.any(self.sampleIndexes < 0):
+            return max([0.0] + [v.max() for v in self.values])
+        return max(v.max() for v in self.values)
+    
+    def min(self):
+        if np.any(self.sampleIndexes < 0):
+            return min([0.0] + [v.min() for v in self.values])
+        return min(v.min() for v in self.values)
+    
+    def truncate(self,numberOfTimeSamples):
+        self.numberOfTimeSamples = numberOfTimeSamples
+        self.sampleIndexes = self.sampleIndexes[:numberOfTimeSamples]
+        del self.values[self.sampleIndexes.max()+1 if numberOfTimeSamples > 0 else 0:]
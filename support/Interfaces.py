@@ -36,6 +36,9 @@
  '''
 from __future__ import unicode_literals,print_function
 import json
+import os
+import threading
+from collections import OrderedDict
 from support.EffectiveResistances import ResistanceCalculator
 import numpy as np
 
@@ -45,6 +48,9 @@ class ClothingResistanceModel(object):
     '''
 
     anatomyKeys = ['Head','Chest','Back','Pelvis','L-shoulder','R-shoulder','L-arm','R-arm','L-hand','R-hand','L-thigh','R-thigh','L-leg','R-leg','L-foot','R-foot']
+    #Number of velocities of air for which the resistances are kept
+    maxResistances = 64
+    resistances = None
 
     def __init__(self,):
         '''
@@ -55,13 +61,25 @@ class ClothingResistanceModel(object):
     
     def loadClothingModelFromFile(self,clothingModelFile):
         self.model = self.rc.loadClothingModel(clothingModelFile)
-        self.thermalResistances = self.rc.getThermalResistances(self.model,self.velocityOfAir)
-        self.evaporativeResistances = self.rc.getEvaporativeResistances(self.model,self.velocityOfAir)        
+        self.resistances = OrderedDict()
+        self.setVelocityOfAir(self.velocityOfAir)
     
     def setVelocityOfAir(self,voa):
+        '''
+        Resistances are computed once for each velocity of air, activities often share the velocity
+        '''
         self.velocityOfAir = voa
-        self.thermalResistances = self.rc.getThermalResistances(self.model,self.velocityOfAir)
-        self.evaporativeResistances = self.rc.getEvaporativeResistances(self.model,self.velocityOfAir) 
+        if self.resistances is None:
+            self.resistances = OrderedDict()
+        key = float(voa)
+        if key in self.resistances:
+            self.resistances.move_to_end(key)
+        else:
+            self.resistances[key] = (self.rc.getThermalResistances(self.model,self.velocityOfAir),
+                                     self.rc.getEvaporativeResistances(self.model,self.velocityOfAir))
+            if len(self.resistances) > self.maxResistances:
+                self.resistances.popitem(last=False)
+        self.thermalResistances,self.evaporativeResistances = self.resistances[key]
 
     def getHeatTransferCoefficient(self,anatomyIndex16Segment):
         return self.thermalResistances[self.anatomyKeys[anatomyIndex16Segment]]
@@ -109,4 +127,65 @@ class RadiationModel(object):
         return self.radiationData[self.anatomyKeys[anatomyIndex16Segment]]
     
     def getFluxes(self):
-        return self.radiationData
\ No newline at end of file
+        return self.radiationData
+
+
+class ModelCache(object):
+    '''
+    Process wide least recently used cache of models loaded from files
+    Models are keyed by absolute path and modification time, an edited file is loaded again
+    The models are shared, users should not change them other than through their setters (e.g. setVelocityOfAir)
+    '''
+    
+    def __init__(self,loader,maxSize=32):
+        '''
+        loader - function that returns the model of a file
+        '''
+        self.loader = loader
+        self.maxSize = maxSize
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        
+    def get(self,filename):
+        filename = os.path.abspath(filename)
+        key = (filename,os.path.getmtime(filename))
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key]
+        model = self.loader(filename)
+        with self.lock:
+            self.models[key] = model
+            while len(self.models) > self.maxSize:
+                self.models.popitem(last=False)
+        return model
+    
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+
+
+def _loadClothingModel(filename):
+    cm = ClothingResistanceModel()
+    cm.loadClothingModelFromFile(filename)
+    return cm
+
+def _loadRadiationModel(filename):
+    rm = RadiationModel()
+    rm.loadRadiationDataFromFile(filename)
+    return rm
+
+clothingModelCache = ModelCache(_loadClothingModel)
+radiationModelCache = ModelCache(_loadRadiationModel)
+
+def loadClothingModel(filename):
+    '''
+    ClothingResistanceModel of filename, shared with other users of the file
+    '''
+    return clothingModelCache.get(filename)
+
+def loadRadiationModel(filename):
+    '''
+    RadiationModel of filename, shared with other users of the file
+    '''
+    return radiationModelCache.get(filename)
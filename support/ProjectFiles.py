@@ -0,0 +1,90 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import pickle
+import numpy as np
+from support.ResultFiles import ResultFile, ResultFileWriter, isResultFile
+from support.SimulationCore import SimulationData
+
+#Project files hold the mesh, body parameters, activities and the simulation results in one result file
+#(see support.ResultFiles), the results are read as they are used. Projects saved as pickles are still loaded
+
+
+def saveProjectFile(filename,meshData,humanBodyParameters,simulationData,activities,computeUsingProjection,numberOfSubSteps,projectMetaData):
+    '''
+    meshData - contents of the obj file (bytes or str), or None
+    simulationData - SimulationData or None if the project has not been simulated
+    activities - dict of activity id to definition, and activityname
+    '''
+    writer = ResultFileWriter(filename)
+    project = dict()
+    if not meshData is None:
+        if not isinstance(meshData,bytes):
+            meshData = meshData.encode('utf-8')
+        writer.addArray('project/mesh',np.frombuffer(meshData,dtype=np.uint8))
+    project['humanBodyParameters'] = humanBodyParameters
+    #Activities are keyed by integer ids, json would turn them into strings
+    project['activities'] = [[k,v] for k,v in activities.items()]
+    project['computeUsingProjection'] = computeUsingProjection
+    project['numberOfSubSteps'] = numberOfSubSteps
+    project['projectMetaData'] = projectMetaData
+    attributes = {'project':project}
+    if not simulationData is None:
+        attributes['simulationData'] = simulationData.writeTo(writer)
+    writer.close(attributes)
+
+
+def loadProjectFile(filename):
+    '''
+    Returns [meshData,humanBodyParameters,simulationData,activities,computeUsingProjection,numberOfSubSteps,projectMetaData]
+    as given to saveProjectFile, meshData as bytes
+    Raises UnicodeDecodeError for pickled projects saved with python 2
+    '''
+    if not isResultFile(filename):
+        with open(filename,'rb') as ser:
+            return pickle.load(ser)
+    resultFile = ResultFile(filename)
+    project = resultFile.attributes['project']
+    meshData = None
+    if resultFile.hasArray('project/mesh'):
+        meshData = resultFile.getArray('project/mesh').tobytes()
+    simulationData = None
+    if 'simulationData' in resultFile.attributes:
+        simulationData = SimulationData.readFrom(resultFile)
+    activities = dict((k,v) for k,v in project['activities'])
+    return [meshData,project['humanBodyParameters'],simulationData,activities,project['computeUsingProjection'],
+            project['numberOfSubSteps'],project['projectMetaData']]
@@ -0,0 +1,204 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import json
+import os
+import struct
+import numpy as np
+
+#Versioned binary container for simulation results
+#    preamble - magic, format version, offset and length of the header
+#    blocks   - raw little endian arrays, each aligned to blockAlignment bytes
+#    header   - utf-8 json with the attributes and the offset, shape and dtype of each array
+#The header is written after the blocks so that large fields can be written a chunk at a time
+#Arrays are read as memory maps, only the parts that are accessed are read from disk
+resultFileMagic = b'ABICSRES'
+resultFileVersion = 1
+preambleFormat = '<8sIIQQ'
+preambleSize = struct.calcsize(preambleFormat)
+blockAlignment = 64
+
+
+def jsonDefault(value):
+    #numpy scalars and arrays in attributes, e.g. values edited in the user interface
+    if isinstance(value,np.generic):
+        return value.item()
+    if isinstance(value,np.ndarray):
+        return value.tolist()
+    raise TypeError('%s cannot be stored in a result file header'%type(value).__name__)
+
+
+def isResultFile(filename):
+    '''
+    True if filename is a result container (rather than e.g. a pickle from earlier versions)
+    '''
+    with open(filename,'rb') as ser:
+        return ser.read(len(resultFileMagic)) == resultFileMagic
+
+
+class ResultFileWriter(object):
+    '''
+    Writes arrays and json attributes to a result container
+    target - file name or a binary file object (e.g. io.BytesIO)
+    A file is written to a temporary name and only replaces an existing file on close
+    '''
+    
+    def __init__(self,target):
+        if isinstance(target,str):
+            self.filename = target
+            self.ser = open(target+'.tmp','wb')
+        else:
+            self.filename = None
+            self.ser = target
+        self.start = self.ser.tell()
+        self.arrays = dict()
+        self.ser.write(b'\0'*preambleSize)
+        
+    def align(self):
+        padding = -(self.ser.tell() - self.start) % blockAlignment
+        self.ser.write(b'\0'*padding)
+        return self.ser.tell() - self.start
+    
+    def addArray(self,name,array):
+        array = np.asarray(array)
+        dtype = array.dtype.newbyteorder('<') if array.dtype.byteorder == '>' else array.dtype
+        offset = self.align()
+        self.ser.write(np.ascontiguousarray(array,dtype=dtype).tobytes())
+        self.arrays[name] = {'offset':offset,'shape':list(array.shape),'dtype':dtype.str}
+        
+    def addTimeSeries(self,name,field,chunkSize=256):
+        '''
+        Store an (nDofs, samples) field time major, so that a time sample or range is contiguous
+        Disk backed fields (see support.ChunkedStorage) are copied a chunk at a time
+        '''
+        nDofs,numberOfSamples = field.shape
+        if hasattr(field,'iterateChunks'):
+            blocks = field.iterateChunks()
+        else:
+            blocks = (field[:,i:i+chunkSize] for i in range(0,numberOfSamples,chunkSize))
+        offset = self.align()
+        dtype = None
+        for block in blocks:
+            block = np.asarray(block)
+            if dtype is None:
+                dtype = block.dtype.newbyteorder('<') if block.dtype.byteorder == '>' else block.dtype
+            self.ser.write(np.ascontiguousarray(block.T,dtype=dtype).tobytes())
+        if dtype is None:
+            dtype = np.dtype(np.float64)
+        self.arrays[name] = {'offset':offset,'shape':[numberOfSamples,nDofs],'dtype':dtype.str,'layout':'timeMajor'}
+        
+    def close(self,attributes=None):
+        '''
+        Write the header, attributes should be json serialisable
+        '''
+        header = json.dumps({'attributes':attributes if attributes is not None else dict(),'arrays':self.arrays},default=jsonDefault).encode('utf-8')
+        offset = self.align()
+        self.ser.write(header)
+        end = self.ser.tell()
+        self.ser.seek(self.start)
+        self.ser.write(struct.pack(preambleFormat,resultFileMagic,resultFileVersion,0,offset,len(header)))
+        self.ser.seek(end)
+        if not self.filename is None:
+            self.ser.close()
+            os.replace(self.filename+'.tmp',self.filename)
+
+
+class ResultFile(object):
+    '''
+    Reads a result container
+    source - file name or the bytes of a container
+    Arrays of files are returned as read only memory maps, time major fields (see ResultFileWriter.addTimeSeries)
+    as their transposed (nDofs, samples) view
+    '''
+    
+    def __init__(self,source):
+        if isinstance(source,(bytes,bytearray,memoryview)):
+            self.filename = None
+            self.buffer = source
+            preamble = bytes(source[:preambleSize])
+        else:
+            self.filename = source
+            self.buffer = None
+            with open(source,'rb') as ser:
+                preamble = ser.read(preambleSize)
+        if len(preamble) < preambleSize:
+            raise ValueError('Not a simulation result file')
+        magic,version,_,offset,length = struct.unpack(preambleFormat,preamble)
+        if magic != resultFileMagic:
+            raise ValueError('Not a simulation result file')
+        if version > resultFileVersion:
+            raise ValueError('Result file version %d is not supported, upgrade to read it'%version)
+        self.version = version
+        if self.buffer is None:
+            with open(source,'rb') as ser:
+                ser.seek(offset)
+                header = ser.read(length)
+        else:
+            header = bytes(self.buffer[offset:offset+length])
+        header = json.loads(header.decode('utf-8'))
+        self.attributes = header['attributes']
+        self.arrays = header['arrays']
+        
+    def hasArray(self,name):
+        return name in self.arrays
+    
+    def getArrayNames(self,prefix=''):
+        return [name for name in self.arrays if name.startswith(prefix)]
+    
+    def getArray(self,name):
+        '''
+        Returns array name without reading it, (nDofs, samples) for time series
+        '''
+        definition = self.arrays[name]
+        shape = tuple(definition['shape'])
+        dtype = np.dtype(definition['dtype'])
+        if int(np.prod(shape)) == 0:
+            array = np.zeros(shape,dtype=dtype)
+        elif self.buffer is None:
+            array = np.memmap(self.filename,dtype=dtype,mode='r',offset=definition['offset'],shape=shape)
+        else:
+            array = np.frombuffer(self.buffer,dtype=dtype,count=int(np.prod(shape)),offset=definition['offset']).reshape(shape)
+        if definition.get('layout') == 'timeMajor':
+            return array.T
+        return array
+    
+    def getTimeSeries(self,name,start=0,stop=None):
+        '''
+        Returns samples start..stop-1 of time series name as an (nDofs, samples) array, only these samples are read
+        '''
+        return np.array(self.getArray(name)[:,start:stop])
+
@@ -0,0 +1,299 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import logging
+import os
+import numpy as np
+from support.Interfaces import loadClothingModel, loadRadiationModel
+from thermoregulation.BoundaryConditions import BoundaryConditionSchedule
+
+#One row per activity in simulator units, clothing and radiation are indexes into the schedule's file lists (-1 for none)
+scheduleDtype = np.dtype([('duration',np.float64),('Tab',np.float64),('rh',np.float64),('velocityOfAir',np.float64),
+                          ('metabolicActivity',np.float64),('clothing',np.int32),('radiation',np.int32),('steadyState',np.bool_)])
+
+#Column names accepted in weather/occupancy files
+columnAliases = {'Ta':'Tab','airTemperature':'Tab','RH':'rh','relativeHumidity':'rh','voa':'velocityOfAir','airVelocity':'velocityOfAir',
+                 'met':'metabolicActivity','clothingId':'clothing','clothingFile':'clothing','radiationId':'radiation',
+                 'radiationFluxFile':'radiation'}
+
+timeUnits = {'seconds':1.0,'minutes':60.0,'hours':3600.0}
+
+
+def resolveFile(filename,definitionDirectory=None,searchByName=False):
+    '''
+    Absolute path of filename, relative names are also looked up in definitionDirectory
+    searchByName - look for a file of the same name in definitionDirectory as a last resort, activity files saved
+                   by the user interface refer to files relative to its working directory
+    '''
+    #Files saved on windows use \\ as separator
+    if os.sep != '\\':
+        filename = filename.replace('\\',os.sep)
+    cfile = os.path.abspath(filename)
+    if not definitionDirectory is None and not os.path.exists(cfile):
+        cfile = os.path.abspath(os.path.join(definitionDirectory,filename))
+        if searchByName and not os.path.exists(cfile) and len(filename) > 0:
+            bfile = os.path.abspath(os.path.join(definitionDirectory,os.path.basename(filename)))
+            if os.path.exists(bfile):
+                cfile = bfile
+    return cfile
+
+
+class ActivitySchedule(object):
+    '''
+    Compact sequence of activities to be simulated
+    entries - structured array of scheduleDtype, durations in seconds and rh as a fraction
+    clothingFiles, radiationFiles - absolute file names referenced by the clothing and radiation columns,
+                                    each file is loaded once however many entries refer to it
+    boundaryConditions - dict of entry index to BoundaryConditionSchedule for entries that vary within the activity
+    '''
+    
+    def __init__(self,entries,clothingFiles,radiationFiles,boundaryConditions=None,name=None):
+        self.entries = np.asarray(entries,dtype=scheduleDtype)
+        self.clothingFiles = list(clothingFiles)
+        self.radiationFiles = list(radiationFiles)
+        self.boundaryConditions = dict() if boundaryConditions is None else boundaryConditions
+        self.name = name
+        if self.entries.shape[0] > 0:
+            if self.entries['clothing'].min() < 0 or self.entries['clothing'].max() >= len(self.clothingFiles):
+                raise ValueError('Schedule refers to clothing models that are not defined')
+            if self.entries['radiation'].max() >= len(self.radiationFiles):
+                raise ValueError('Schedule refers to radiation models that are not defined')
+        self.clothingModels = None
+        self.radiationModels = None
+        
+    @classmethod
+    def fromActivities(cls,activities):
+        '''
+        Create a schedule from the activity definitions used by the activity editors, a dict of activity dicts
+        in the order of simulation (non dict values such as the activity name are skipped)
+        '''
+        activityList = [act for act in activities.values() if isinstance(act,dict)]
+        entries = np.zeros(len(activityList),dtype=scheduleDtype)
+        clothingFiles = FileIndex()
+        radiationFiles = FileIndex()
+        boundaryConditions = dict()
+        #Activities usually share a few clothing and radiation files, each is looked up once
+        resolvedFiles = dict()
+        def resolveActivityFile(filename,definitionDirectory,searchByName=False):
+            key = (filename,definitionDirectory,searchByName)
+            if not key in resolvedFiles:
+                cfile = resolveFile(filename,definitionDirectory,searchByName)
+                resolvedFiles[key] = (cfile,os.path.isfile(cfile))
+            return resolvedFiles[key]
+        for i,act in enumerate(activityList):
+            #Activities may replay logged conditions, {'time':[minutes],'Tab':[...],'rh':[...],...}
+            #constant values that are not given are taken from the start of the series
+            schedule = None
+            if 'timeSeries' in act:
+                schedule = BoundaryConditionSchedule.fromActivitySeries(act['timeSeries'])
+                boundaryConditions[i] = schedule
+            def activityValue(key):
+                if key in act or schedule is None or not schedule.hasSeries(key):
+                    return act[key]
+                if key == 'rh':
+                    return schedule.getInitialValue(key)*100.0
+                return schedule.getInitialValue(key)
+            entry = entries[i]
+            entry['duration'] = act['duration']*60.0 #Convert from minutes to seconds
+            entry['rh'] = activityValue('rh')/100.0 #Convert from %
+            entry['Tab'] = activityValue('Tab')
+            entry['velocityOfAir'] = activityValue('velocityOfAir')
+            entry['metabolicActivity'] = activityValue('metabolicActivity')
+            #Activities may only require the equilibrium state
+            entry['steadyState'] = act.get('steadyState',False)
+            definitionDirectory = act.get('definitionDirectory',None)
+            cfile,found = resolveActivityFile(act['clothingFile'],definitionDirectory,True)
+            if not found:
+                estr = 'Clothing Data file %s does not exist!'%act['clothingFile']
+                logging.critical(estr)
+                raise ValueError(estr)
+            entry['clothing'] = clothingFiles.getIndex(cfile)
+            #An empty radiation file name means no radiation flux, files that cannot be found are skipped
+            entry['radiation'] = -1
+            if len(act['radiationFluxFile'].strip()) > 0:
+                cfile,found = resolveActivityFile(act['radiationFluxFile'],definitionDirectory,True)
+                if found:
+                    entry['radiation'] = radiationFiles.getIndex(cfile)
+                else:
+                    logging.warning('Radiation flux file %s does not exist, activity %d is simulated without radiation flux'%(act['radiationFluxFile'],i))
+        return cls(entries,clothingFiles.files,radiationFiles.files,boundaryConditions,activities.get('activityname',None))
+    
+    @classmethod
+    def fromFile(cls,filename,clothingFiles=None,radiationFiles=None,definitionDirectory=None,timeUnit='minutes'):
+        '''
+        Create a schedule from a weather and occupancy file, one row per interval of constant conditions
+        filename - csv file with a header row or npz file with one array per column
+        Columns: time (start of the row, in timeUnit) or duration (in timeUnit), Tab (C), rh (%), velocityOfAir (m/s),
+                 metabolicActivity (met), clothing, radiation and optionally steadyState
+        clothing/radiation columns either hold file names or indexes into the clothingFiles/radiationFiles lists
+        (radiation index -1 or an empty name for no radiation flux). An npz file may also store these lists
+        as clothingFiles/radiationFiles arrays
+        Relative file names are resolved against definitionDirectory, by default the directory of filename
+        '''
+        if definitionDirectory is None:
+            definitionDirectory = os.path.dirname(os.path.abspath(filename))
+        if filename.lower().endswith('.npz'):
+            with np.load(filename,allow_pickle=False) as data:
+                columns = dict((k,data[k]) for k in data.files)
+            if clothingFiles is None and 'clothingFiles' in columns:
+                clothingFiles = columns['clothingFiles'].tolist()
+            if radiationFiles is None and 'radiationFiles' in columns:
+                radiationFiles = columns['radiationFiles'].tolist()
+        else:
+            data = np.genfromtxt(filename,delimiter=',',names=True,dtype=None,encoding='utf-8',autostrip=True,deletechars='')
+            columns = dict((k,np.atleast_1d(data[k])) for k in data.dtype.names)
+        return cls.fromColumns(columns,clothingFiles,radiationFiles,definitionDirectory,timeUnit)
+    
+    @classmethod
+    def fromColumns(cls,columns,clothingFiles=None,radiationFiles=None,definitionDirectory=None,timeUnit='minutes'):
+        '''
+        Create a schedule from a dict of column arrays, see fromFile for the columns
+        '''
+        columns = dict((columnAliases.get(k,k),v) for k,v in columns.items())
+        if timeUnit not in timeUnits:
+            raise ValueError('Unknown time unit %s, supported units are %s'%(timeUnit,', '.join(timeUnits.keys())))
+        scale = timeUnits[timeUnit]
+        if 'duration' in columns:
+            durations = np.asarray(columns['duration'],dtype=np.float64)
+        elif 'time' in columns:
+            times = np.asarray(columns['time'],dtype=np.float64)
+            if times.shape[0] < 2:
+                raise ValueError('A duration column is required for schedules with a single row')
+            durations = np.empty(times.shape[0])
+            durations[:-1] = np.diff(times)
+            #The last row lasts as long as the one before it
+            durations[-1] = durations[-2]
+        else:
+            raise ValueError('Schedule should have a time or duration column')
+        if np.any(durations <= 0):
+            raise ValueError('Schedule times should be increasing')
+        entries = np.zeros(durations.shape[0],dtype=scheduleDtype)
+        entries['duration'] = durations*scale
+        for name in ['Tab','rh','velocityOfAir','metabolicActivity']:
+            if not name in columns:
+                raise ValueError('Schedule does not have a %s column'%name)
+            entries[name] = columns[name]
+        entries['rh'] /= 100.0 #Convert from %
+        if 'steadyState' in columns:
+            entries['steadyState'] = np.asarray(columns['steadyState']).astype(np.bool_)
+        if not 'clothing' in columns:
+            raise ValueError('Schedule does not have a clothing column')
+        entries['clothing'],clothingFiles = cls.resolveColumn(columns['clothing'],clothingFiles,definitionDirectory)
+        if 'radiation' in columns:
+            entries['radiation'],radiationFiles = cls.resolveColumn(columns['radiation'],radiationFiles,definitionDirectory)
+        else:
+            entries['radiation'] = -1
+            radiationFiles = []
+        for cfile in clothingFiles:
+            if not os.path.exists(cfile):
+                estr = 'Clothing Data file %s does not exist!'%cfile
+                logging.critical(estr)
+                raise ValueError(estr)
+        #Missing radiation files are treated as no radiation flux
+        missing = np.array([not os.path.isfile(cfile) for cfile in radiationFiles],dtype=np.bool_)
+        if np.any(missing):
+            used = entries['radiation'] >= 0
+            for cfile in np.array(radiationFiles)[missing]:
+                logging.warning('Radiation flux file %s does not exist, it is not applied'%cfile)
+            entries['radiation'][used & missing[np.maximum(entries['radiation'],0)]] = -1
+        return cls(entries,clothingFiles,radiationFiles)
+    
+    @staticmethod
+    def resolveColumn(values,files,definitionDirectory):
+        '''
+        Returns the file indexes of a clothing/radiation column and the deduplicated absolute file names
+        '''
+        values = np.asarray(values)
+        if values.dtype.kind in 'iuf':
+            if files is None:
+                raise ValueError('File indexes given without the list of files they refer to')
+            return values.astype(np.int32),[resolveFile(f,definitionDirectory) for f in files]
+        names,indexes = np.unique(values.astype(np.str_),return_inverse=True)
+        fileIndex = FileIndex()
+        nameIndexes = np.array([fileIndex.getIndex(resolveFile(n,definitionDirectory)) if len(n) > 0 else -1 for n in names],dtype=np.int32)
+        return nameIndexes[indexes.reshape(-1)],fileIndex.files
+    
+    def getNumberOfEntries(self):
+        return self.entries.shape[0]
+    
+    def getDurations(self):
+        return self.entries['duration']
+    
+    def getClothingModels(self):
+        '''
+        Clothing models for each clothing file, loaded on first use
+        The models are shared with other schedules of the process that use the same file (see support.Interfaces.ModelCache)
+        '''
+        if self.clothingModels is None:
+            self.clothingModels = [loadClothingModel(cfile) for cfile in self.clothingFiles]
+        return self.clothingModels
+    
+    def getRadiationModels(self):
+        '''
+        Radiation models for each radiation file, loaded on first use
+        '''
+        if self.radiationModels is None:
+            self.radiationModels = [loadRadiationModel(cfile) for cfile in self.radiationFiles]
+        return self.radiationModels
+    
+    def getClothingModel(self,i):
+        return self.getClothingModels()[self.entries['clothing'][i]]
+    
+    def getRadiationModel(self,i):
+        ix = self.entries['radiation'][i]
+        if ix < 0:
+            return None
+        return self.getRadiationModels()[ix]
+    
+    def getBoundaryConditionSchedule(self,i):
+        return self.boundaryConditions.get(i,None)
+
+
+class FileIndex(object):
+    '''
+    Assigns consecutive indexes to absolute file names, a file seen before keeps its index
+    '''
+    
+    def __init__(self):
+        self.files = []
+        self.indexes = dict()
+        
+    def getIndex(self,filename):
+        if not filename in self.indexes:
+            self.indexes[filename] = len(self.files)
+            self.files.append(filename)
+        return self.indexes[filename]
@@ -0,0 +1,107 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import sys
+import numpy as np
+from multiprocessing import shared_memory
+
+
+def attachSharedMemory(name):
+    '''
+    Attach to an existing block without making this process responsible for removing it
+    '''
+    if sys.version_info >= (3,13):
+        return shared_memory.SharedMemory(name=name,track=False)
+    #Earlier versions register attached blocks too, processes started by multiprocessing share the resource
+    #tracker of their parent so the registration is the one made by the creator
+    return shared_memory.SharedMemory(name=name)
+
+
+class SharedBuffers(object):
+    '''
+    Numpy arrays allocated in named shared memory blocks, so that a simulation process can write results that
+    the parent process reads in place
+    Pickling (e.g. when passed to a spawned process) stores the block names, the receiving side attaches to them
+    The creating instance owns the blocks, unlink removes their names once no other process needs to attach,
+    the arrays stay valid in the processes that have them mapped
+    '''
+    
+    def __init__(self):
+        self.blocks = dict()
+        self.arrays = dict()
+        self.owner = True
+        self.linked = True
+    
+    def allocate(self,key,shape,dtype=np.float64):
+        '''
+        Returns a zero initialised array of shape in a new block
+        '''
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape))*dtype.itemsize,1)
+        block = shared_memory.SharedMemory(create=True,size=size)
+        array = np.ndarray(shape,dtype=dtype,buffer=block.buf)
+        array.fill(0)
+        self.blocks[key] = (block,shape,dtype.str)
+        self.arrays[key] = array
+        return array
+    
+    def getArray(self,key):
+        return self.arrays[key]
+    
+    def hasArray(self,key):
+        return key in self.arrays
+    
+    def unlink(self):
+        if self.owner and self.linked:
+            for block,_,_ in self.blocks.values():
+                block.unlink()
+        self.linked = False
+    
+    def __getstate__(self):
+        if not self.linked:
+            raise ValueError('Shared buffers have been unlinked and cannot be attached to')
+        return {'blocks':dict((key,(block.name,shape,dtype)) for key,(block,shape,dtype) in self.blocks.items())}
+    
+    def __setstate__(self,state):
+        self.blocks = dict()
+        self.arrays = dict()
+        self.owner = False
+        self.linked = True
+        for key,(name,shape,dtype) in state['blocks'].items():
+            block = attachSharedMemory(name)
+            self.blocks[key] = (block,shape,dtype)
+            self.arrays[key] = np.ndarray(shape,dtype=np.dtype(dtype),buffer=block.buf)
@@ -0,0 +1,815 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import logging
+import traceback,sys
+import numpy as np
+import os
+import copy
+import pickle
+import tempfile
+import io
+from thermoregulation.Tanabe65MN import Tanabe65MNProjectedToStandard16,\
+    Tanabe65MNModel
+from support.Interfaces import ClothingResistanceModel, RadiationModel
+from support.Schedules import ActivitySchedule
+from support.ChunkedStorage import ChunkedTimeSeries, PiecewiseConstantTimeSeries
+from support.SharedBuffers import SharedBuffers
+from support.ResultFiles import ResultFile, ResultFileWriter
+from bodymodels.SegmentLabels import SegmentAggregator, labelsFromDofIndexes
+
+class SimulationData(object):
+    '''
+    Time samples of a simulation, the per face fields are (nDofs, number of field samples) arrays
+    If storageDirectory is given the per face fields are ChunkedTimeSeries stored in that directory
+    recording - dict selecting how each of the fieldNames is stored, 'face' (default), 'segment' (area weighted
+                segment means, see getSegmentField) or None (not stored), and 'stride', the fields are
+                stored every stride samples (see getFieldTimeValues)
+    The whole body means, rectal temperature and comfort levels are stored at every sample
+    sharedMemory - allocate the arrays in named shared memory (see support.SharedBuffers) so that a simulation
+                   process writes them in place, getSamples then only passes what is not shared
+    '''
+    fieldNames = ['skinTemperature','coreTemperature','skinWettedness','thermalResistance','evaporativeResistance']
+    seriesNames = ['timeValue','pmv','ppd','meanSkinTemperature','meanCoreTemperature','rectalTemperature',
+                   'meanThermalResistance','meanEvaporativeResistance']
+    #Fields that only change with the activity, samples equal to the previous one are not stored again
+    constantFieldNames = ['thermalResistance','evaporativeResistance']
+    recordingLevels = ['face','segment',None]
+    storageDirectory = None
+    recording = None
+    recordingStride = 1
+    segmentFields = dict()
+    sharedBuffers = None
+    
+    def __init__(self,tanabeModel,numberOfTimeSamples,storageDirectory=None,chunkSize=256,recording=None,sharedMemory=False):
+        self.segmentLabels = tanabeModel.getSegmentLabels()
+        self.segmentAggregator = SegmentAggregator(self.segmentLabels)
+        self.bodySurfaceArea=tanabeModel.getBodySurfaceArea()
+        self.nDofs = tanabeModel.getNumberOfDofs()
+        self.numberOfTimeSamples = numberOfTimeSamples
+        timeSamples = self.numberOfTimeSamples
+        self.sharedBuffers = SharedBuffers() if sharedMemory else None
+        for name in self.seriesNames:
+            setattr(self,name,self.allocate(name,(timeSamples,)))
+        self.sensation = [None]*timeSamples
+        self.storageDirectory = storageDirectory
+        self.recording = self.getRecordingLevels(recording)
+        self.recordingStride = 1
+        if not recording is None:
+            self.recordingStride = int(recording.get('stride',1))
+            if self.recordingStride < 1:
+                raise ValueError('Recording stride should be at least 1')
+        fieldSamples = self.getNumberOfFieldSamples()
+        self.segmentFields = dict()
+        for name in self.fieldNames:
+            field = None
+            if self.recording[name] == 'face':
+                if name in self.constantFieldNames:
+                    field = PiecewiseConstantTimeSeries(self.nDofs,fieldSamples)
+                elif storageDirectory is None:
+                    field = self.allocate(name,(self.nDofs,fieldSamples))
+                else:
+                    field = ChunkedTimeSeries(storageDirectory,name,self.nDofs,fieldSamples,chunkSize)
+            elif self.recording[name] == 'segment':
+                self.segmentFields[name] = self.allocate(name,(self.segmentAggregator.numberOfSegments,fieldSamples))
+            setattr(self,name,field)
+        self.stopTime = None
+        self.stopReason = None
+
+    def allocate(self,name,shape):
+        if self.sharedBuffers is None:
+            return np.zeros(shape)
+        return self.sharedBuffers.allocate(name,shape)
+
+    def isShared(self,name):
+        return not self.sharedBuffers is None and self.sharedBuffers.linked and self.sharedBuffers.hasArray(name)
+
+    def releaseSharedMemory(self):
+        '''
+        Remove the names of the shared memory blocks once no other process needs to attach to them,
+        the arrays remain valid and are pickled by value from then on
+        '''
+        if not self.sharedBuffers is None:
+            self.sharedBuffers.unlink()
+
+    def copyWithoutSharedMemory(self):
+        '''
+        Returns a copy whose shared arrays are replaced by ordinary arrays, so that it is pickled by value
+        Disk backed fields are flushed and refer to the same chunk files
+        '''
+        data = copy.copy(self)
+        data.sharedBuffers = None
+        for name in self.seriesNames:
+            setattr(data,name,np.array(getattr(self,name)))
+        data.sensation = list(self.sensation)
+        for name in self.fieldNames:
+            field = getattr(self,name)
+            if isinstance(field,np.ndarray):
+                setattr(data,name,np.array(field))
+            elif isinstance(field,ChunkedTimeSeries):
+                field.flush()
+            elif isinstance(field,PiecewiseConstantTimeSeries):
+                setattr(data,name,copy.deepcopy(field))
+        data.segmentFields = dict((name,np.array(field)) for name,field in self.segmentFields.items())
+        return data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if not self.sharedBuffers is None:
+            if not self.sharedBuffers.linked:
+                state['sharedBuffers'] = None
+            else:
+                #Shared arrays are restored from the buffers
+                segmentFields = dict(self.segmentFields)
+                for name in list(state.keys()):
+                    if self.sharedBuffers.hasArray(name) and not name in segmentFields:
+                        state[name] = None
+                for name in segmentFields:
+                    segmentFields[name] = None
+                state['segmentFields'] = segmentFields
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if not self.sharedBuffers is None:
+            fieldSamples = self.getNumberOfFieldSamples()
+            for name in self.seriesNames:
+                setattr(self,name,self.sharedBuffers.getArray(name)[:self.numberOfTimeSamples])
+            for name in self.fieldNames:
+                if self.sharedBuffers.hasArray(name) and not name in self.segmentFields:
+                    setattr(self,name,self.sharedBuffers.getArray(name)[:,:fieldSamples])
+            for name in self.segmentFields:
+                self.segmentFields[name] = self.sharedBuffers.getArray(name)[:,:fieldSamples]
+
+    def truncate(self,numberOfTimeSamples):
+        '''
+        Discard the samples from numberOfTimeSamples on, used when a simulation ends early
+        '''
+        self.numberOfTimeSamples = numberOfTimeSamples
+        for name in self.seriesNames:
+            setattr(self,name,getattr(self,name)[:numberOfTimeSamples])
+        self.sensation = self.sensation[:numberOfTimeSamples]
+        fieldSamples = self.getNumberOfFieldSamples()
+        for name in self.fieldNames:
+            field = getattr(self,name)
+            if field is None:
+                continue
+            if isinstance(field,np.ndarray):
+                setattr(self,name,field[:,:fieldSamples])
+            else:
+                field.truncate(fieldSamples)
+        for name,field in self.segmentFields.items():
+            self.segmentFields[name] = field[:,:fieldSamples]
+
+    def getSamples(self,start,stop):
+        '''
+        Returns samples start..stop-1 as a dict for setSamples, used to pass the results from the simulation process
+        Disk backed fields are flushed rather than included, the receiving side reads them from the chunk files,
+        shared memory arrays are not included either as they are written in place
+        '''
+        delta = {'start':start,'stop':stop,'numberOfTimeSamples':self.numberOfTimeSamples,
+                 'stopTime':self.stopTime,'stopReason':self.stopReason}
+        for name in self.seriesNames:
+            if not self.isShared(name):
+                delta[name] = getattr(self,name)[start:stop]
+        delta['sensation'] = self.sensation[start:stop]
+        stride = self.recordingStride
+        fieldStart = (start + stride - 1)//stride
+        fieldStop = (stop + stride - 1)//stride
+        fields = dict()
+        for name in self.fieldNames:
+            field = getattr(self,name)
+            if self.isShared(name):
+                continue
+            if isinstance(field,np.ndarray):
+                fields[name] = field[:,fieldStart:fieldStop]
+            elif isinstance(field,PiecewiseConstantTimeSeries):
+                fields[name] = field.getSamples(fieldStart,fieldStop)
+            elif isinstance(field,ChunkedTimeSeries):
+                field.flush()
+        for name,field in self.segmentFields.items():
+            if not self.isShared(name):
+                fields[name] = field[:,fieldStart:fieldStop]
+        delta['fieldStart'] = fieldStart
+        delta['fields'] = fields
+        return delta
+
+    def setSamples(self,delta):
+        '''
+        Store the samples from getSamples of a copy of this data
+        '''
+        start,stop = delta['start'],delta['stop']
+        for name in self.seriesNames:
+            if name in delta:
+                getattr(self,name)[start:stop] = delta[name]
+        self.sensation[start:stop] = delta['sensation']
+        fieldStart = delta['fieldStart']
+        for name,values in delta['fields'].items():
+            if name in self.segmentFields:
+                self.segmentFields[name][:,fieldStart:fieldStart+values.shape[1]] = values
+                continue
+            field = getattr(self,name)
+            if isinstance(field,PiecewiseConstantTimeSeries):
+                field.setSamples(fieldStart,values)
+            else:
+                field[:,fieldStart:fieldStart+values.shape[1]] = values
+        if not delta['stopTime'] is None:
+            self.stopTime = delta['stopTime']
+            self.stopReason = delta['stopReason']
+            self.truncate(delta['numberOfTimeSamples'])
+
+    def getRecordingLevels(self,recording):
+        levels = dict((name,'face') for name in self.fieldNames)
+        if not recording is None:
+            for name,level in recording.items():
+                if name == 'stride':
+                    continue
+                if not name in levels:
+                    raise ValueError('Unknown field %s, recorded fields are %s'%(name,', '.join(self.fieldNames)))
+                if not level in self.recordingLevels:
+                    raise ValueError('Unknown recording level %s for %s, supported levels are face, segment and None'%(level,name))
+                levels[name] = level
+        return levels
+
+    def getRecordingLevel(self,name):
+        if self.recording is None:
+            #Data saved before recording levels were introduced
+            return 'face'
+        return self.recording[name]
+
+    def getNumberOfFieldSamples(self,numberOfTimeSamples=None):
+        '''
+        Number of field samples stored for the first numberOfTimeSamples samples (all samples if None)
+        '''
+        if numberOfTimeSamples is None:
+            numberOfTimeSamples = self.numberOfTimeSamples
+        return (numberOfTimeSamples + self.recordingStride - 1)//self.recordingStride
+
+    def getFieldTimeValues(self):
+        '''
+        Times of the samples of the per face and segment fields
+        '''
+        return self.timeValue[::self.recordingStride]
+
+    def getFieldsToRecord(self,timeIndex):
+        '''
+        Names of the fields stored at sample timeIndex
+        '''
+        if timeIndex % self.recordingStride != 0:
+            return []
+        return [name for name in self.fieldNames if not self.recording[name] is None]
+
+    def recordField(self,name,timeIndex,values):
+        '''
+        Store the face values of field name at sample timeIndex (see getFieldsToRecord)
+        '''
+        fieldIndex = timeIndex//self.recordingStride
+        if self.recording[name] == 'segment':
+            self.segmentFields[name][:,fieldIndex] = self.segmentAggregator.mean(values,self.bodySurfaceArea)
+        else:
+            getattr(self,name)[:,fieldIndex] = values
+
+    def getSegmentAggregator(self):
+        if not hasattr(self,'segmentAggregator'):
+            #Data saved before segment labels were introduced only has the dof masks
+            self.segmentLabels = labelsFromDofIndexes(self.dofIndexes,self.nDofs)
+            self.segmentAggregator = SegmentAggregator(self.segmentLabels)
+        return self.segmentAggregator
+
+    def reduceOverTime(self,values,function):
+        '''
+        Apply function to (nDofs, samples) blocks of values and join the results along time,
+        disk backed fields are processed one chunk at a time
+        '''
+        if isinstance(values,np.ndarray):
+            return function(values)
+        return np.concatenate([function(block) for block in values.iterateChunks()],axis=-1)
+
+    def getSegmentField(self,name,numberOfFieldSamples=None):
+        '''
+        Area weighted segment means of field name, (numberOfSegments, number of field samples)
+        numberOfFieldSamples - only use the first field samples, e.g. those completed so far
+        '''
+        level = self.getRecordingLevel(name)
+        if level == 'segment':
+            return self.segmentFields[name][:,:numberOfFieldSamples]
+        if level is None:
+            raise ValueError('%s was not recorded'%name)
+        aggregator = self.getSegmentAggregator()
+        values = getattr(self,name)
+        if not numberOfFieldSamples is None:
+            values = values[:,:numberOfFieldSamples]
+        return self.reduceOverTime(values,lambda block: aggregator.mean(block,self.bodySurfaceArea))
+
+    def getFaceField(self,name,start=0,stop=None):
+        '''
+        Face values of field samples start..stop-1 of field name, (nDofs, samples), only these samples are read
+        Fields recorded per segment are spread over the faces of each segment, fields that were not recorded are 0
+        '''
+        level = self.getRecordingLevel(name)
+        if level == 'face':
+            return np.asarray(getattr(self,name)[:,start:stop])
+        if level == 'segment':
+            return self.getSegmentAggregator().scatter(self.segmentFields[name][:,start:stop])
+        stop = self.getNumberOfFieldSamples() if stop is None else min(stop,self.getNumberOfFieldSamples())
+        return np.zeros((self.nDofs,max(stop-start,0)))
+
+    def getMeanSegmentCoreTemperatures(self,numberOfFieldSamples=None):
+        return self.getSegmentField('coreTemperature',numberOfFieldSamples)
+
+    def getMeanSegmentSkinTemperatures(self,numberOfFieldSamples=None):
+        return self.getSegmentField('skinTemperature',numberOfFieldSamples)
+
+    def getMeanSegmentCoreTemperature(self,i):
+        return self.getMeanSegmentCoreTemperatures()[i]
+    
+    def getMeanSegmentSkinTemperature(self,i):
+        return self.getMeanSegmentSkinTemperatures()[i]
+
+    def writeTo(self,writer,prefix='simulation/'):
+        '''
+        Add the arrays to a ResultFileWriter (see support.ResultFiles), returns the attributes for readFrom
+        '''
+        for name in self.seriesNames:
+            writer.addArray(prefix+name,getattr(self,name))
+        writer.addArray(prefix+'segmentLabels',self.getSegmentAggregator().labels)
+        writer.addArray(prefix+'bodySurfaceArea',self.bodySurfaceArea)
+        for name in self.fieldNames:
+            field = getattr(self,name,None)
+            if self.getRecordingLevel(name) != 'face' or field is None:
+                continue
+            if isinstance(field,PiecewiseConstantTimeSeries):
+                values = np.array(field.values) if len(field.values) > 0 else np.zeros((0,field.nDofs))
+                writer.addArray(prefix+name+'/values',values)
+                writer.addArray(prefix+name+'/sampleIndexes',field.sampleIndexes)
+            else:
+                writer.addTimeSeries(prefix+name,field)
+        for name,field in self.segmentFields.items():
+            writer.addArray(prefix+'segment/'+name,field)
+        stopTime = None if self.stopTime is None else float(self.stopTime)
+        return {'prefix':prefix,'numberOfTimeSamples':int(self.numberOfTimeSamples),'nDofs':int(self.nDofs),
+                'recording':self.recording,'recordingStride':int(self.recordingStride),'sensation':list(self.sensation),
+                'stopTime':stopTime,'stopReason':self.stopReason}
+
+    def save(self,filename):
+        '''
+        Write the results to a result file, see load
+        '''
+        writer = ResultFileWriter(filename)
+        writer.close({'simulationData':self.writeTo(writer)})
+
+    def toBytes(self):
+        '''
+        Returns the result file contents as bytes, e.g. to store or send the results, see fromBytes
+        '''
+        ser = io.BytesIO()
+        writer = ResultFileWriter(ser)
+        writer.close({'simulationData':self.writeTo(writer)})
+        return ser.getvalue()
+
+    @staticmethod
+    def readFrom(resultFile,attributes=None):
+        '''
+        Returns the SimulationData of a ResultFile, the arrays are memory mapped and read when accessed
+        attributes - as returned by writeTo, resultFile.attributes['simulationData'] by default
+        '''
+        if attributes is None:
+            attributes = resultFile.attributes['simulationData']
+        prefix = attributes['prefix']
+        data = SimulationData.__new__(SimulationData)
+        data.numberOfTimeSamples = attributes['numberOfTimeSamples']
+        data.nDofs = attributes['nDofs']
+        data.recording = attributes['recording']
+        data.recordingStride = attributes['recordingStride']
+        data.sensation = list(attributes['sensation'])
+        data.stopTime = attributes['stopTime']
+        data.stopReason = attributes['stopReason']
+        for name in data.seriesNames:
+            setattr(data,name,resultFile.getArray(prefix+name))
+        data.segmentLabels = np.array(resultFile.getArray(prefix+'segmentLabels'))
+        data.segmentAggregator = SegmentAggregator(data.segmentLabels)
+        data.bodySurfaceArea = np.array(resultFile.getArray(prefix+'bodySurfaceArea'))
+        fieldSamples = data.getNumberOfFieldSamples()
+        for name in data.fieldNames:
+            field = None
+            if resultFile.hasArray(prefix+name):
+                field = resultFile.getArray(prefix+name)
+            elif resultFile.hasArray(prefix+name+'/values'):
+                field = PiecewiseConstantTimeSeries(data.nDofs,fieldSamples)
+                field.values = list(resultFile.getArray(prefix+name+'/values'))
+                field.sampleIndexes = np.array(resultFile.getArray(prefix+name+'/sampleIndexes'))
+            setattr(data,name,field)
+        data.segmentFields = dict()
+        for aname in resultFile.getArrayNames(prefix+'segment/'):
+            data.segmentFields[aname[len(prefix+'segment/'):]] = resultFile.getArray(aname)
+        return data
+
+    @staticmethod
+    def load(filename):
+        '''
+        Read results saved with save, only the fields that are used are read from disk
+        '''
+        return SimulationData.readFrom(ResultFile(filename))
+
+    @staticmethod
+    def fromBytes(contents):
+        return SimulationData.readFrom(ResultFile(contents))
+
+    
+class Simulator(object):
+    '''
+    Instance that runs simulations based on Activity and target human mesh data
+    '''
+
+    numberOfSubSteps = 10
+    setupError = None
+    integrator = 'bdf'
+    integratorOptions = None
+    stopConditions = None
+    storageDirectory = None
+    recording = None
+    sharedMemory = False
+    pauseProcessing = False
+    stopProcessing = False
+    #Sub step of the current activity to be simulated next, non zero while an activity is interrupted
+    subStepIndex = 0
+    activitySteadyState = False
+    steadyStateStopValues = None
+    #Version of the checkpoint format written by getCheckpoint
+    checkpointVersion = 1
+    def __init__(self):
+        super(Simulator,self).__init__()
+        
+    def setup(self, activities,humanModel,projectedSimulation=True,numberOfSubSteps=10,integrator='bdf',integratorOptions=None,stopConditions=None,storageDirectory=None,recording=None,sharedMemory=False):
+        '''
+        activities - list of activities with clothing, velocity Of Air, radiation Data
+                     or an ActivitySchedule (e.g. ActivitySchedule.fromFile for weather/occupancy files)
+        humanModel - target human model based on which simulations should be setup
+        projectedSimulation - Use the standard 16 segment anatomy model
+        numberOfSubSteps - number of sub steps to be simulated per duration (number of samples along time)
+        integrator - name of the time integration backend ('bdf','radau','implicit-euler', or 'lsoda' and 'vode' for the
+                     16 segment model only as they assemble dense jacobians)
+        integratorOptions - dict of backend settings (rtol, atol, ...)
+        stopConditions - list of StopCondition instances or definitions (e.g. {'type':'rectalTemperature','threshold':39.0},
+                         see thermoregulation.StopConditions). The simulation ends when the first condition is crossed,
+                         the results are truncated at the crossing and record its time and reason
+        storageDirectory - if given, the per face results are stored in memory mapped chunks in a new sub directory
+                           of storageDirectory rather than in memory (see support.ChunkedStorage)
+        recording - dict selecting the stored per face fields and their time stride, e.g.
+                    {'skinTemperature':'face','coreTemperature':'segment','skinWettedness':None,'stride':10}
+                    (see SimulationData), by default all fields are stored per face at every sample
+        sharedMemory - allocate the results in named shared memory, used when the simulation runs in another process
+        '''        
+        self.numberOfSubSteps = numberOfSubSteps
+        self.integrator = integrator
+        self.integratorOptions = integratorOptions
+        self.stopConditions = stopConditions
+        self.storageDirectory = storageDirectory
+        self.recording = recording
+        self.sharedMemory = sharedMemory
+        self.activities = activities
+        self.humanModel = humanModel
+        self.projectedSimulation = projectedSimulation
+        self.currentTimeIndex = 0
+        self.subStepIndex = 0
+        self.setupActivities()
+        
+    def setupActivities(self):
+        if isinstance(self.activities,ActivitySchedule):
+            self.activitySchedule = self.activities
+        else:
+            self.activitySchedule = ActivitySchedule.fromActivities(self.activities)
+        entries = self.activitySchedule.entries
+        self.numActivities = entries.shape[0]
+        self.timeValues = entries['duration']
+        self.temps = entries['Tab']
+        self.mets = entries['metabolicActivity']
+        self.rh = entries['rh']
+        self.voa = entries['velocityOfAir']
+        self.steadyState = entries['steadyState']
+        #Each clothing/radiation file is loaded once, entries refer to the models by index
+        self.clothingData = self.activitySchedule.getClothingModels()
+        self.radiationData = self.activitySchedule.getRadiationModels()
+        self.clothingIndex = entries['clothing']
+        self.radiationIndex = entries['radiation']
+            
+        if self.projectedSimulation:
+            self.trModel = Tanabe65MNProjectedToStandard16(self.humanModel)
+        else:
+            self.trModel = Tanabe65MNModel(self.humanModel)
+        if self.integratorOptions is None:
+            self.trModel.setIntegrator(self.integrator)
+        else:
+            self.trModel.setIntegrator(self.integrator,**self.integratorOptions)
+        self.trModel.setStopConditions(self.stopConditions)
+    
+        dataDirectory = None
+        if not self.storageDirectory is None:
+            if not os.path.exists(self.storageDirectory):
+                os.makedirs(self.storageDirectory)
+            dataDirectory = tempfile.mkdtemp(prefix='simulation',dir=self.storageDirectory)
+        self.simulationData = SimulationData(self.trModel,self.numActivities*self.numberOfSubSteps,dataDirectory,recording=self.recording,sharedMemory=self.sharedMemory)        
+    
+    def getCurrentStatus(self,includeData=True):
+        '''
+        Progress and results of the simulation, without the SimulationData if includeData is False
+        '''
+        result = dict()
+        result['type'] = 'simulationdata'
+        result['data'] = self.simulationData if includeData else None
+        result['numberoftimesamples'] = self.simulationData.pmv.shape[0]
+        result['currenttimeindex'] = self.currentTimeIndex
+        result['timevalues'] = self.timeValues
+        result['integratorstatistics'] = self.trModel.getIntegratorStatistics()
+        result['stoptime'] = self.simulationData.stopTime
+        result['stopreason'] = self.simulationData.stopReason
+        return result
+    
+    def getSimulationResults(self):
+        return self.simulationData
+    
+    def getNumberOfTimeSamples(self):
+        return self.simulationData.pmv.shape[0]
+    
+    def pause(self):
+        '''
+        Request the loop running the activities (e.g. simulationProcess) to wait after the current sub step
+        '''
+        self.pauseProcessing = True
+    
+    def resume(self):
+        self.pauseProcessing = False
+    
+    def stop(self):
+        '''
+        Request the loop running the activities to end after the current sub step, the results of the completed
+        samples are kept and the simulation can be continued from a checkpoint
+        '''
+        self.stopProcessing = True
+    
+    def getCheckpoint(self):
+        '''
+        Returns the state of the simulation after the completed samples as bytes, see fromCheckpoint
+        The model state (temperatures, cbcTemp, simulation time), currentTimeIndex, subStepIndex and the SimulationData
+        are kept. Within an activity the integrator history is kept as well (see ThermoregulationIntegrator.isResumable),
+        so continuing from a checkpoint gives the same results as an uninterrupted run
+        Disk backed results (storageDirectory) are referred to, not copied, the directory should remain accessible
+        '''
+        simulator = copy.copy(self)
+        simulator.simulationData = self.simulationData.copyWithoutSharedMemory()
+        simulator.sharedMemory = False
+        simulator.pauseProcessing = False
+        simulator.stopProcessing = False
+        return pickle.dumps({'version':self.checkpointVersion,'simulator':simulator},protocol=pickle.HIGHEST_PROTOCOL)
+    
+    def saveCheckpoint(self,filename):
+        '''
+        Write getCheckpoint to filename, the previous checkpoint is only replaced once the new one is complete
+        '''
+        checkpoint = self.getCheckpoint()
+        with open(filename+'.tmp','wb') as ser:
+            ser.write(checkpoint)
+        os.replace(filename+'.tmp',filename)
+    
+    @staticmethod
+    def fromCheckpoint(checkpoint):
+        '''
+        Returns a Simulator that continues from the checkpoint (bytes from getCheckpoint)
+        '''
+        state = pickle.loads(checkpoint)
+        if not isinstance(state,dict) or state.get('version') != Simulator.checkpointVersion:
+            raise ValueError('Unsupported simulation checkpoint')
+        return state['simulator']
+    
+    @staticmethod
+    def loadCheckpoint(filename):
+        with open(filename,'rb') as ser:
+            return Simulator.fromCheckpoint(ser.read())
+            
+    def getSolvedTimeIndex(self):
+        return self.currentTimeIndex
+    
+    def getNumberOfCompletedSamples(self):
+        '''
+        Number of samples simulated so far
+        '''
+        if self.isStopped():
+            return self.simulationData.numberOfTimeSamples
+        return min(self.currentTimeIndex*self.numberOfSubSteps+self.subStepIndex,self.simulationData.numberOfTimeSamples)
+    
+    def isStopped(self):
+        '''
+        True if a stop condition ended the simulation
+        '''
+        return self.simulationData.stopTime is not None
+        
+    def setupActivity(self):
+        '''
+        Set the boundary conditions of the current activity, a steady state activity is solved for its equilibrium
+        '''
+        #cm = ClothingResistanceModel()
+        #cm.loadClothingModelFromFile(self.clothingData[self.currentTimeIndex])
+        cm = self.clothingData[self.clothingIndex[self.currentTimeIndex]]
+        cm.setVelocityOfAir(self.voa[self.currentTimeIndex])           
+        self.trModel.setClothingModel(cm)
+        if self.radiationIndex[self.currentTimeIndex] >= 0:
+            #rm = RadiationModel()
+            #rm.loadRadiationDataFromFile(self.radiationData[self.currentTimeIndex])
+            rm = self.radiationData[self.radiationIndex[self.currentTimeIndex]]
+            self.trModel.setRadiationFlux(rm)
+        self.trModel.setTa(self.temps[self.currentTimeIndex])
+        self.trModel.setRelativeHumidity(self.rh[self.currentTimeIndex])
+        if self.currentTimeIndex==0:
+            temp = self.trModel.getInitialConditions()
+            self.trModel.setInitialConditions(temp)
+        self.trModel.setMet(self.mets[self.currentTimeIndex])
+        self.trModel.getW()
+        self.trModel.setBoundaryConditionSchedule(self.activitySchedule.getBoundaryConditionSchedule(self.currentTimeIndex))
+        
+        self.activitySteadyState = self.steadyState[self.currentTimeIndex]
+        self.steadyStateStopValues = None
+        if self.activitySteadyState:
+            #Stop conditions are checked for crossings between the current state and the equilibrium
+            if len(self.trModel.getStopConditions()) > 0:
+                self.steadyStateStopValues = self.trModel.evaluateStopConditions(self.trModel.simulationTime,self.trModel.getState())
+            try:
+                self.trModel.solveSteadyState()
+            except RuntimeError as re:
+                logging.warning("%s, integrating the activity instead"%str(re))
+                self.activitySteadyState = False
+        
+    def run(self,subStepCallback=None):
+        '''
+        Simulate the remaining sub steps of the current activity, returns True once the activity is complete
+        A pause or stop request (see pause and stop) ends the call after the current sub step, the next call
+        continues the activity from there. subStepCallback() is called after every sub step, e.g. to process commands
+        '''
+        self.setupError=None
+        try:
+            t = self.timeValues[self.currentTimeIndex]
+            if self.subStepIndex == 0:
+                self.setupActivity()
+            
+            tms = t/self.numberOfSubSteps
+            steadyState = self.activitySteadyState
+            for i in range(self.subStepIndex,self.numberOfSubSteps):
+                startTime = self.trModel.simulationTime
+                if steadyState:
+                    #The equilibrium is held over the activity, the model time follows the samples
+                    self.trModel.advanceTime(tms)
+                    if i == 0 and self.steadyStateStopValues is not None:
+                        self.trModel.checkStopConditionCrossing(self.steadyStateStopValues)
+                else:
+                    self.trModel.solve(tms)
+                elapsed = self.trModel.simulationTime - startTime
+                pmv,ppd,sens = self.trModel.ZhangPMVPPD()
+                tidx = self.currentTimeIndex*self.numberOfSubSteps+i
+                self.simulationData.timeValue[tidx] = self.simulationData.timeValue[tidx-1] + elapsed # 
+                self.simulationData.pmv[tidx] = pmv  
+                self.simulationData.ppd[tidx] = ppd
+                self.simulationData.sensation[tidx] = sens
+                self.simulationData.meanCoreTemperature[tidx] = self.trModel.getMeanCoreTemperature()
+                self.simulationData.meanSkinTemperature[tidx] = self.trModel.getMeanSkinTemperature()
+                self.simulationData.rectalTemperature[tidx]   = self.trModel.getRectalTemperature()
+                self.simulationData.meanThermalResistance[tidx] = self.trModel.getMeanThermalResistance()
+                self.simulationData.meanEvaporativeResistance[tidx] = self.trModel.getMeanEvaporativelResistance()
+                
+                sTemp = self.trModel.getTemperature()
+                fieldValues = {'skinTemperature':lambda: sTemp[:,3],
+                               'coreTemperature':lambda: sTemp[:,0],
+                               'skinWettedness':self.trModel.getSkinWettedness,
+                               'evaporativeResistance':self.trModel.getEffectiveEvaporativeResistance,
+                               'thermalResistance':self.trModel.getEffectiveThermalResistance}
+                for name in self.simulationData.getFieldsToRecord(tidx):
+                    self.simulationData.recordField(name,tidx,fieldValues[name]())
+                if self.trModel.isStopped():
+                    #Keep the samples up to the crossing
+                    self.simulationData.stopTime = self.simulationData.timeValue[tidx]
+                    self.simulationData.stopReason = self.trModel.stopReason
+                    self.simulationData.truncate(tidx+1)
+                    logging.info("Simulation stopped at %g s: %s"%(self.simulationData.stopTime,self.simulationData.stopReason))
+                    break
+                self.subStepIndex = i+1
+                if subStepCallback is not None:
+                    subStepCallback()
+                if (self.pauseProcessing or self.stopProcessing) and self.subStepIndex < self.numberOfSubSteps:
+                    return False
+            self.subStepIndex = 0
+            return True
+        except IndexError as ie:
+            self.setupError = ie
+            logging.error("Current time index is incorrect")
+            traceback.print_exc(file=sys.stdout)
+        except Exception as e:
+            self.setupError = e
+            traceback.print_exc(file=sys.stdout)
+        return False
+
+
+def simulationProcess(simulator,parentQ,childQ):
+    '''
+    Runs simulator, the samples of each completed sub step are sent to childQ as {'type':'samples','delta':...}
+    (see SimulationData.getSamples) followed by small status messages, the receiver assembles the results
+    Commands read from parentQ between sub steps
+    {'comm':'pause','checkpoint':filename} - wait for resume or stop, the checkpoint (optional) is written first
+    {'comm':'resume'}
+    {'comm':'stop','checkpoint':filename} - end the simulation, the checkpoint (optional) can be used to continue it later
+    {'comm':'status'}
+    '''
+    #A simulator restored from a checkpoint has samples that the receiver already has
+    sentSamples = [simulator.getNumberOfCompletedSamples()]
+    
+    def sendSamples():
+        completed = simulator.getNumberOfCompletedSamples()
+        if completed > sentSamples[0] or simulator.isStopped():
+            childQ.put_nowait({'type':'samples','delta':simulator.simulationData.getSamples(sentSamples[0],completed)})
+            sentSamples[0] = completed
+            
+    def processCommand(res):
+        if not isinstance(res,dict) or not 'comm' in res:
+            return
+        if res['comm'] in ['pause','stop'] and res.get('checkpoint') is not None:
+            simulator.saveCheckpoint(res['checkpoint'])
+        if res['comm']=='stop':
+            simulator.stop()
+        elif res['comm']=='pause':
+            simulator.pause()
+            childQ.put_nowait({'type':'status','paused':True,'checkpoint':res.get('checkpoint')})
+        elif res['comm']=='resume':
+            simulator.resume()
+            childQ.put_nowait({'type':'status','paused':False})
+        elif res['comm']=='status':
+            childQ.put_nowait(simulator.getCurrentStatus(False))
+            
+    def processCommands():
+        while not parentQ.empty():
+            processCommand(parentQ.get_nowait())
+    
+    def subStepCompleted():
+        sendSamples()
+        processCommands()
+
+    maxSteps = simulator.timeValues.shape[0]
+    stepFactor = 100.0/float(maxSteps)
+    if stepFactor>1:
+        stepFactor = 1.0/float(maxSteps)
+    childQ.put_nowait({'type':'status','progress':0.25})
+    try:
+        while simulator.currentTimeIndex < maxSteps:
+            processCommands()
+            while simulator.pauseProcessing and not simulator.stopProcessing:
+                processCommand(parentQ.get())
+            if simulator.stopProcessing:
+                break
+            #run returns after the sub step during which a pause or stop was requested
+            completed = simulator.run(subStepCompleted)
+            if simulator.setupError is not None:
+                childQ.put_nowait({'type':'status','error':str(simulator.setupError),'simulationResults':simulator.getCurrentStatus(False)})
+                break
+            if completed:
+                #print(simulator.currentTimeIndex,stepFactor,0.25+0.75*simulator.currentTimeIndex*stepFactor)
+                simulator.currentTimeIndex +=1
+                childQ.put_nowait({'type':'status','progress':0.25+0.75*(simulator.currentTimeIndex-1)*stepFactor})
+            if simulator.isStopped():
+                break
+        childQ.put_nowait(simulator.getCurrentStatus(False))    
+    except Exception as e:
+        childQ.put_nowait({'type':'status','error':str(e),'simulationResults':simulator.getCurrentStatus(False)})
+    finally:
+        sendSamples()
+        childQ.put_nowait({'type':'status','completed':True,'simulationResults':simulator.getCurrentStatus(False)})
+        childQ.close()
@@ -34,7 +34,6 @@
  
   "2019"
  '''
- 
 from __future__ import unicode_literals,print_function
 import sip
 API_NAMES = ["QDate", "QDateTime", "QString", "QTextStream", "QTime", "QUrl", "QVariant"]
@@ -43,307 +42,103 @@ for name in API_NAMES:
     sip.setapi(name, API_VERSION)
 
 import logging
-import traceback,sys
 from PyQt5 import QtCore
 from PyQt5.Qt import pyqtSignal
-import numpy as np
-import os
-from thermoregulation.Tanabe65MN import Tanabe65MNProjectedToStandard16,\
-    Tanabe65MNModel
-from support.Interfaces import ClothingResistanceModel, RadiationModel
-
-
-class SimulationData(object):
-    
-    def __init__(self,tanabeModel,numberOfTimeSamples):
-        self.dofIndexes= tanabeModel.getDofIndexes()
-        self.bodySurfaceArea=tanabeModel.getBodySurfaceArea()
-        self.nDofs = tanabeModel.getNumberOfDofs()
-        self.numberOfTimeSamples = numberOfTimeSamples
-        timeSamples = self.numberOfTimeSamples
-        self.timeValue = np.zeros(timeSamples)
-        self.pmv = np.zeros(timeSamples)
-        self.ppd = np.zeros(timeSamples)
-        self.sensation = [None]*timeSamples
-        self.meanSkinTemperature = np.zeros(timeSamples)
-        self.meanCoreTemperature = np.zeros(timeSamples)
-        self.rectalTemperature   = np.zeros(timeSamples)
-        self.meanThermalResistance= np.zeros(timeSamples)
-        self.meanEvaporativeResistance= np.zeros(timeSamples)
-        self.skinTemperature = np.zeros((self.nDofs,timeSamples))
-        self.coreTemperature = np.zeros((self.nDofs,timeSamples))
-        self.skinWettedness = np.zeros((self.nDofs,timeSamples))
-        self.thermalResistance= np.zeros((self.nDofs,timeSamples))
-        self.evaporativeResistance= np.zeros((self.nDofs,timeSamples))
-
-    def getMeanSegmentCoreTemperature(self,i):
-        indexes = self.dofIndexes[i]
-        psa = self.bodySurfaceArea[indexes]
-        tcr = self.coreTemperature[indexes,:]*psa[:, np.newaxis]
-        return np.sum(tcr,axis=0)/np.sum(psa)
-    
-    def getMeanSegmentSkinTemperature(self,i):
-        indexes = self.dofIndexes[i]
-        psa = self.bodySurfaceArea[indexes]
-        tcr = self.skinTemperature[indexes,:]*psa[:, np.newaxis]
-        return np.sum(tcr,axis=0)/np.sum(psa)
-
-    
-class Simulator(object):
-    '''
-    Instance that runs simulations based on Activity and target human mesh data
-    '''
-
-    numberOfSubSteps = 10
-    setupError = None
-    def __init__(self):
-        super(Simulator,self).__init__()
-        
-    def setup(self, activities,humanModel,projectedSimulation=True,numberOfSubSteps=10):
-        '''
-        activities - list of activities with clothing, velocity Of Air, radiation Data
-        humanModel - target human model based on which simulations should be setup
-        projectedSimulation - Use the standard 16 segment anatomy model
-        numberOfSubSteps - number of sub steps to be simulated per duration (number of samples along time)
-        '''        
-        self.numberOfSubSteps = numberOfSubSteps
-        self.activities = activities
-        self.humanModel = humanModel
-        self.projectedSimulation = projectedSimulation
-        self.currentTimeIndex = 0
-        self.setupActivities()
-        
-    def setupActivities(self):
-        self.numActivities = len(self.activities)-1
-        self.timeValues = np.zeros(self.numActivities)
-        self.temps = np.zeros(self.numActivities)
-        self.mets = np.zeros(self.numActivities)
-        self.rh = np.zeros(self.numActivities)
-        self.voa = np.zeros(self.numActivities)
-        self.clothingData = []
-        self.radiationData  = []
-        i = 0
-        for act in self.activities.values():
-            if isinstance(act,dict):
-                self.timeValues[i] = act['duration']
-                self.rh[i] = act['rh']/100.0 #Convert from %
-                self.temps[i] = act['Tab']
-                self.voa[i] = act['velocityOfAir']
-                self.mets[i] = act['metabolicActivity']
-                cfile =  os.path.abspath(act['clothingFile'])
-                if 'definitionDirectory' in act:
-                    bdir = act['definitionDirectory']
-                    if not os.path.exists(cfile):
-                        cfile = os.path.abspath(os.path.join(bdir,act['clothingFile']))
-                        
-                if os.path.exists(cfile):
-                    #self.clothingData.append(cfile)
-                    cm = ClothingResistanceModel()
-                    cm.loadClothingModelFromFile(cfile)
-                    self.clothingData.append(cm)
-                else:
-                    estr = 'Clothing Data file %s does not exist!'%act['clothingFile']
-                    logging.critical(estr)
-                    raise ValueError(estr)
-                cfile =  os.path.abspath(act['radiationFluxFile'])
-                if 'definitionDirectory' in act:
-                    bdir = act['definitionDirectory']
-                    if not os.path.exists(cfile):
-                        cfile = os.path.abspath(os.path.join(bdir,act['radiationFluxFile']))                
-                if os.path.exists(cfile) and os.path.isfile(cfile):
-                    #self.radiationData.append(cfile)
-                    rm = RadiationModel()
-                    rm.loadRadiationDataFromFile(cfile)                
-                    self.radiationData.append(rm)
-                else:
-                    self.radiationData.append(None)
-                i +=1
-            
-        self.timeValues = self.timeValues*60.0 #Convert from minutes to seconds
-        if self.projectedSimulation:
-            self.trModel = Tanabe65MNProjectedToStandard16(self.humanModel)
-        else:
-            self.trModel = Tanabe65MNModel(self.humanModel)
-    
-        self.simulationData = SimulationData(self.trModel,self.numActivities*self.numberOfSubSteps)        
-    
-    def getCurrentStatus(self):
-        result = dict()
-        result['type'] = 'simulationdata'
-        result['data'] = self.simulationData
-        result['numberoftimesamples'] = self.simulationData.pmv.shape[0]
-        result['currenttimeindex'] = self.currentTimeIndex
-        result['timevalues'] = self.timeValues
-        return result
-    
-    def getSimulationResults(self):
-        return self.simulationData
-    
-    def getNumberOfTimeSamples(self):
-        return self.simulationData.pmv.shape[0]
-    
-    def pause(self):
-        self.pauseProcessing = True
-    
-    def stop(self):
-        self.currentTimeIndex = 0
-        self.timeValue.fill(0.0)
-            
-    def getSolvedTimeIndex(self):
-        return self.currentTimeIndex
-        
-    def run(self):
-        self.setupError=None
-        try:
-            t = self.timeValues[self.currentTimeIndex]
-            #cm = ClothingResistanceModel()
-            #cm.loadClothingModelFromFile(self.clothingData[self.currentTimeIndex])
-            cm = self.clothingData[self.currentTimeIndex]
-            cm.setVelocityOfAir(self.voa[self.currentTimeIndex])           
-            self.trModel.setClothingModel(cm)
-            if not self.radiationData[self.currentTimeIndex] is None:
-                #rm = RadiationModel()
-                #rm.loadRadiationDataFromFile(self.radiationData[self.currentTimeIndex])
-                rm = self.radiationData[self.currentTimeIndex]
-                self.trModel.setRadiationFlux(rm)
-            self.trModel.setTa(self.temps[self.currentTimeIndex])
-            self.trModel.setRelativeHumidity(self.rh[self.currentTimeIndex])
-            if self.currentTimeIndex==0:
-                temp = self.trModel.getInitialConditions()
-                self.trModel.setInitialConditions(temp)
-            self.trModel.setMet(self.mets[self.currentTimeIndex])
-            self.trModel.getW()
-            
-            tms = t/self.numberOfSubSteps
-            for i in range(self.numberOfSubSteps):
-                self.trModel.solve(tms)
-                pmv,ppd,sens = self.trModel.ZhangPMVPPD()
-                tidx = self.currentTimeIndex*self.numberOfSubSteps+i
-                self.simulationData.timeValue[tidx] = self.simulationData.timeValue[tidx-1] + tms # 
-                self.simulationData.pmv[tidx] = pmv  
-                self.simulationData.ppd[tidx] = ppd
-                self.simulationData.sensation[tidx] = sens
-                self.simulationData.meanCoreTemperature[tidx] = self.trModel.getMeanCoreTemperature()
-                self.simulationData.meanSkinTemperature[tidx] = self.trModel.getMeanSkinTemperature()
-                self.simulationData.rectalTemperature[tidx]   = self.trModel.getRectalTemperature()
-                self.simulationData.meanThermalResistance[tidx] = self.trModel.getMeanThermalResistance()
-                self.simulationData.meanEvaporativeResistance[tidx] = self.trModel.getMeanEvaporativelResistance()
-                
-                sTemp = self.trModel.getTemperature()
-                self.simulationData.skinTemperature[:,tidx] = sTemp[:,3]
-                self.simulationData.coreTemperature[:,tidx] = sTemp[:,0]
-                self.simulationData.skinWettedness[:,tidx] = self.trModel.getSkinWettedness()
-                self.simulationData.evaporativeResistance[:,tidx] = self.trModel.getEffectiveEvaporativeResistance()
-                self.simulationData.thermalResistance[:,tidx] = self.trModel.getEffectiveThermalResistance()
-        except IndexError as ie:
-            self.setupError = ie
-            logging.error("Current time index is incorrect")
-            traceback.print_exc(file=sys.stdout)
-        except Exception as e:
-            self.setupError = e
-            traceback.print_exc(file=sys.stdout)
-
+#The simulation itself does not depend on Qt, see support.SimulationCore
+from support.SimulationCore import SimulationData, Simulator, simulationProcess
 
 from multiprocessing import Process, Queue
 
-def simulationProcess(simulator,parentQ,childQ):
-    stopProcessing = False
-
-    maxSteps = simulator.timeValues.shape[0]
-    stepFactor = 100.0/float(maxSteps)
-    if stepFactor>1:
-        stepFactor = 1.0/float(maxSteps)
-    childQ.put_nowait({'type':'status','progress':0.25})
-    try:
-        while simulator.currentTimeIndex < maxSteps:
-            if not parentQ.empty():
-                res = parentQ.get_nowait()
-                if isinstance(res,dict):
-                    if 'comm' in res and res['comm']=='stop':
-                        stopProcessing = True
-                    elif 'comm' in res and res['comm']=='status':
-                        childQ.put_nowait(simulator.getCurrentStatus())
-            if not stopProcessing:
-                simulator.run()
-                if simulator.setupError is not None:
-                    childQ.put_nowait({'type':'status','error':str(simulator.setupError),'simulationResults':simulator.getCurrentStatus()})
-                    break
-                #print(simulator.currentTimeIndex,stepFactor,0.25+0.75*simulator.currentTimeIndex*stepFactor)
-                childQ.put_nowait({'type':'status','progress':0.25+0.75*simulator.currentTimeIndex*stepFactor})
-                simulator.currentTimeIndex +=1
-            else:
-                break
-        childQ.put_nowait(simulator.getCurrentStatus())    
-    except Exception as e:
-        childQ.put_nowait({'type':'status','error':str(e),'simulationResults':simulator.getCurrentStatus()})
-    finally:
-        childQ.put_nowait({'type':'status','completed':True,'simulationResults':simulator.getCurrentStatus()})
-        childQ.close()
-
 class SimulationProcessManager(QtCore.QThread):
     '''
     Instance that runs simulations based on Activity and target human mesh data
     '''
     completed = pyqtSignal(object)
     progress  = pyqtSignal(float)
+    #Number of samples received so far, emitted as the samples of each activity arrive
+    samplesReceived = pyqtSignal(int)
+    #Emitted with True once the simulation process has paused (and written its checkpoint) and False on resume
+    paused = pyqtSignal(bool)
     pauseProcessing = False
     stopProcessing  = False
     numberOfSubSteps = 10
     
     def __init__(self,parent=None):
         super(SimulationProcessManager,self).__init__(parent)
+        #Commands to and results from the simulation process
+        self.parent_conn = Queue()
+        self.child_conn = Queue()
         
-        
-    def setup(self, activities,humanModel,projectedSimulation=True,numberOfSubSteps=10):
+    def setup(self, activities,humanModel,projectedSimulation=True,numberOfSubSteps=10,integrator='bdf',integratorOptions=None,stopConditions=None,storageDirectory=None,recording=None,sharedMemory=True):
         '''
         activities - list of activities with clothing, velocity Of Air, radiation Data
+                     or an ActivitySchedule (e.g. ActivitySchedule.fromFile for weather/occupancy files)
         humanModel - target human model based on which simulations should be setup
         projectedSimulation - Use the standard 16 segment anatomy model
         numberOfSubSteps - number of sub steps to be simulated per duration (number of samples along time)
+        integrator - name of the time integration backend, see Simulator.setup
+        integratorOptions - dict of backend settings (rtol, atol, ...)
+        stopConditions - conditions that end the simulation early, see Simulator.setup
+        storageDirectory - directory for disk backed results, see Simulator.setup
+        recording - fields to be stored, see Simulator.setup
+        sharedMemory - the simulation process writes the results into shared memory allocated here, only the
+                       indexes of the completed samples are sent back
         '''
         self.simulator = Simulator()        
-        self.simulator.setup(activities, humanModel, projectedSimulation, numberOfSubSteps)
+        self.simulator.setup(activities, humanModel, projectedSimulation, numberOfSubSteps, integrator, integratorOptions, stopConditions, storageDirectory, recording, sharedMemory)
 
     def setupSimulator(self,simulator):
+        '''
+        simulator - a Simulator that has been setup or one restored with Simulator.loadCheckpoint
+        '''
         self.simulator = simulator
     
     def getSimulationResults(self):
-        if not hasattr(self, 'simulationResults'):
-            self.parent_conn.put({'comm':'status'})
-            res = self.child_conn.get()
-            while res['type'] != 'simulationdata':
-                if res['type']=='status':
-                    if not (self.stopProcessing or self.pauseProcessing):
-                        self.progress.emit(float(res['progress']))
-                res = self.child_conn.get()
-            self.simulationResults = res
-        return self.simulationResults['data']
+        '''
+        Results assembled from the samples received so far
+        '''
+        return self.simulator.simulationData
     
     def getNumberOfTimeSamples(self):
-        if not hasattr(self, 'simulationResults'):
-            self.parent_conn.put({'comm':'status'})
-            res = self.child_conn.get()
-            while res['type'] != 'simulationdata':
-                if res['type']=='status':
-                    if not (self.stopProcessing or self.pauseProcessing):
-                        self.progress.emit(float(res['progress']))
-                res = self.child_conn.get()
-            self.simulationResults = res
-        return self.simulationResults['numberoftimesamples']
+        return self.simulator.simulationData.numberOfTimeSamples
+    
+    def getNumberOfReceivedSamples(self):
+        return self.receivedSamples
+    
+    def setResults(self,status):
+        #The process only reports the status, the data is assembled from the samples
+        status['data'] = self.simulator.simulationData
+        status['numberoftimesamples'] = self.simulator.simulationData.numberOfTimeSamples
+        self.simulationResults = status
     
-    def pause(self):
+    def pause(self,checkpointFile=None):
+        '''
+        Pause the simulation after the current sub step
+        checkpointFile - if given the state is written to it, see Simulator.loadCheckpoint
+        '''
         self.pauseProcessing = True
+        self.parent_conn.put({'comm':'pause','checkpoint':checkpointFile})
+        
+    def resume(self):
+        self.pauseProcessing = False
+        self.parent_conn.put({'comm':'resume'})
+        
+    def isPaused(self):
+        return self.pauseProcessing
 
-    def stop(self):
+    def stop(self,checkpointFile=None):
+        '''
+        End the simulation after the current sub step, the results of the completed samples are kept
+        checkpointFile - if given the state is written to it so that the simulation can be continued later
+        '''
         self.stopProcessing = True
-        self.child_conn.send({'comm':'stop'})
+        self.parent_conn.put({'comm':'stop','checkpoint':checkpointFile})
         
     def getSolvedTimeIndex(self):
         return self.simulator.currentTimeIndex
         
     def run(self):
-        self.parent_conn = Queue()
-        self.child_conn = Queue()
+        self.receivedSamples = self.simulator.getNumberOfCompletedSamples()
         self.jp = Process(target=simulationProcess, args=(self.simulator,self.parent_conn,self.child_conn,))
         self.jp.start()
         self.error = None
@@ -356,15 +151,27 @@ class SimulationProcessManager(QtCore.QThread):
                             self.progress.emit(float(res['progress']))
                     elif 'error' in res:
                         self.error = res['error']
-                        self.simulationResults = res['simulationResults']
-                        self.completed.emit(self.simulationResults)
-                        break
+                        self.setResults(res['simulationResults'])
                     elif 'completed' in res:
-                        self.simulationResults = res['simulationResults']
+                        self.setResults(res['simulationResults'])
                         self.completed.emit(self.simulationResults)
                         break
+                    elif 'paused' in res:
+                        self.paused.emit(res['paused'])
                     else:
                         logging.info("Unexpected result from process",res)
+                elif res['type'] == 'samples':
+                    self.simulator.simulationData.setSamples(res['delta'])
+                    self.receivedSamples = res['delta']['stop']
+                    self.samplesReceived.emit(self.receivedSamples)
                 elif res['type'] == 'simulationdata':
-                    self.simulationResults = res
-        self.jp.join()        
+                    self.setResults(res)
+        self.jp.join()
+        simulationData = self.simulator.simulationData
+        if self.stopProcessing and simulationData.stopTime is None and 0 < self.receivedSamples < simulationData.numberOfTimeSamples:
+            #Only keep the samples of the activities completed before the stop
+            simulationData.stopTime = simulationData.timeValue[self.receivedSamples-1]
+            simulationData.stopReason = 'Stopped by user'
+            simulationData.truncate(self.receivedSamples)
+        #The process has ended, the results are kept in this process only
+        self.simulator.simulationData.releaseSharedMemory()        
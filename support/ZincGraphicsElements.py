@@ -383,6 +383,18 @@ class GenerateZincGraphicsElements(object):
             del self.centroidGlyph
         
     
+    def setSpectrumRanges(self,maxPotentials,minPotentials):
+        '''
+        Update the spectrum ranges of the fields created by createGraphicsElements, e.g. as more results become available
+        '''
+        self.scene.beginChange()
+        for fieldName,spectrumComponent in self.spectrumComponent.items():
+            if fieldName in maxPotentials:
+                spectrumComponent.setRangeMaximum(maxPotentials[fieldName])
+            if fieldName in minPotentials:
+                spectrumComponent.setRangeMinimum(minPotentials[fieldName])
+        self.scene.endChange()
+
     def setDataField(self,fieldName):
         self.scene.beginChange()
         self.surface.setDataField(self.dataField[fieldName])
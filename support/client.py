@@ -38,8 +38,8 @@ from __future__ import unicode_literals,print_function
 import sip
 import zmq
 import uuid
-import pickle
-from support.Simulations import Simulator
+from support.Simulations import Simulator, SimulationData
+from support.ProjectFiles import saveProjectFile
 from PyQt5 import QtWidgets
 from userinterface.CacheManagement import WorkspaceCache
 
@@ -89,15 +89,19 @@ class RemoteTask(object):
     def getIdentity(self):
         return self.socket.identity
     
-    def setup(self, activities,humanModel,projectedSimulation=True,numberOfSubSteps=10):
+    def setup(self, activities,humanModel,projectedSimulation=True,numberOfSubSteps=10,integrator='bdf',integratorOptions=None,stopConditions=None,recording=None):
         '''
         activities - list of activities with clothing, velocity Of Air, radiation Data
         humanModel - target human model based on which simulations should be setup
         projectedSimulation - Use the standard 16 segment anatomy model
         numberOfSubSteps - number of sub steps to be simulated per duration (number of samples along time)
+        integrator - name of the time integration backend, see Simulator.setup
+        integratorOptions - dict of backend settings (rtol, atol, ...)
+        stopConditions - conditions that end the simulation early, see Simulator.setup
+        recording - fields to be stored, see Simulator.setup
         '''
         self.simulator = Simulator()        
-        self.simulator.setup(activities, humanModel, projectedSimulation, numberOfSubSteps)
+        self.simulator.setup(activities, humanModel, projectedSimulation, numberOfSubSteps, integrator, integratorOptions, stopConditions, recording=recording)
 
     def setupSimulator(self,simulator):
         self.simulator = simulator
@@ -127,6 +131,35 @@ class RemoteTask(object):
             idn = identity
         self.socket.send_pyobj({'comm':'getresults','identity':idn})
         res = self.socket.recv_pyobj()
+        #The server sends the results as result file contents, see support.ResultFiles
+        if isinstance(res.get('data',None),bytes):
+            res['data'] = SimulationData.fromBytes(res['data'])
+        return res
+        
+    def pause(self,identity=None):
+        '''
+        Pause the task after its current activity, its results then include a checkpoint and it can be resumed
+        '''
+        return self.control('pause',identity)
+    
+    def stop(self,identity=None):
+        '''
+        End the task after its current activity, the results of the completed activities and a checkpoint are kept
+        '''
+        return self.control('stop',identity)
+    
+    def resume(self,identity=None):
+        '''
+        Continue a paused or stopped task from its checkpoint, on any free worker
+        '''
+        return self.control('resume',identity)
+    
+    def control(self,command,identity=None):
+        idn = self.socket.identity
+        if identity is not None:
+            idn = identity
+        self.socket.send_pyobj({'comm':command,'identity':idn})
+        res = self.socket.recv_pyobj()
         return res
         
     def remove(self,identify=None):
@@ -228,11 +261,9 @@ class ListServerTasks(QtWidgets.QWidget):
                 if result == QtWidgets.QMessageBox.No:
                     return
             direc = self.cache.get('LASTSUCCESSFULWORKSPACE',default='.')
-            filename = QtWidgets.QFileDialog.getSaveFileName(None, tr('Save project'),direc,"Pickle (*.pkl)")
+            filename = QtWidgets.QFileDialog.getSaveFileName(None, tr('Save project'),direc,"Project (*.abp)")
             if not filename is None and len(filename[0].strip()) > 0:
-                with open(filename[0],'wb+') as ser:                  
-                    projectData = [projectinfo[1],projectinfo[2],res['data'],projectinfo[3],projectinfo[4],projectinfo[5],projectinfo[6]]
-                    pickle.dump(projectData,ser)
+                saveProjectFile(filename[0],projectinfo[1],projectinfo[2],res['data'],projectinfo[3],projectinfo[4],projectinfo[5],projectinfo[6])
         else:
             QtWidgets.QMessageBox.critical(None, tr("Failed to download "), res['message'])
             
@@ -47,6 +47,8 @@ import argparse
 #Use a file based dict as we are dealing across processes
 simulationresults = sqlitedict.SqliteDict('thermoregulationResults.sqlite', autocommit=True)
 simulationprogress = sqlitedict.SqliteDict('thermoregulationProgress.sqlite', autocommit=True)
+#Pause/stop requests for running tasks, checked after each activity
+simulationcontrol = sqlitedict.SqliteDict('thermoregulationControl.sqlite', autocommit=True)
 
 #Call this function in your main after creating the QApplication
 def setup_interrupt_handling():
@@ -78,6 +80,15 @@ def safe_timer(timeout, func, *args, **kwargs):
 
 
 
+def getResults(simulator):
+    '''
+    Status of the simulation with the results as result file contents (see support.ResultFiles) rather than pickled
+    '''
+    res = simulator.getCurrentStatus(False)
+    res['data'] = simulator.getSimulationResults().toBytes()
+    return res
+
+
 def simulationTask(ident,simulator):
 
     def recordProgress(val):
@@ -93,17 +104,36 @@ def simulationTask(ident,simulator):
     stepFactor = 100.0/float(maxSteps)
     if stepFactor>1:
         stepFactor = 1.0/float(maxSteps)
+    def checkControl():
+        #Pausing ends the run call after the sub step, the request is handled below
+        if ident in simulationcontrol:
+            simulator.pause()
+            
     recordProgress(0.25)
     try:
         while simulator.currentTimeIndex < maxSteps:
-            simulator.run()
+            if ident in simulationcontrol:
+                #Paused and stopped tasks keep a checkpoint, so that they can be resumed by any worker
+                res = getResults(simulator)
+                res['status'] = simulationcontrol[ident]
+                res['checkpoint'] = simulator.getCheckpoint()
+                del simulationcontrol[ident]
+                simulationresults[ident] = res
+                print(ident,' ',res['status'])
+                return
+            if not simulator.run(checkControl):
+                if simulator.setupError is not None:
+                    raise RuntimeError(str(simulator.setupError))
+                continue
             recordProgress(0.25+0.75*simulator.currentTimeIndex*stepFactor)
             simulator.currentTimeIndex +=1
-        recordResults(simulator.getCurrentStatus())
+            if simulator.isStopped():
+                break
+        recordResults(getResults(simulator))
     except Exception as e:
         import traceback
         traceback.print_exc(file=sys.stdout)
-        res = simulator.getCurrentStatus()
+        res = getResults(simulator)
         res['error'] = str(e)
         recordResults(res)
     except KeyboardInterrupt:
@@ -129,6 +159,23 @@ class ServerWorker(QtCore.QThread):
                     self.pools.apply_async(simulationTask,(ident, simulator))
                     msg = pickle.dumps({'status':'success','comm':'start'})
                     worker.send_multipart([ident, msg])
+                elif msg['comm'] in ['pause','stop']:
+                    idx = msg['identity']
+                    simulationcontrol[idx] = 'paused' if msg['comm']=='pause' else 'stopped'
+                    msg = pickle.dumps({'status':'success','comm':msg['comm']})
+                    worker.send_multipart([ident, msg])
+                elif msg['comm']=='resume':
+                    idx = msg['identity']
+                    if idx in simulationcontrol:
+                        del simulationcontrol[idx]
+                    if idx in simulationresults and 'checkpoint' in simulationresults[idx]:
+                        from support.SimulationCore import Simulator
+                        simulator = Simulator.fromCheckpoint(simulationresults[idx]['checkpoint'])
+                        self.pools.apply_async(simulationTask,(idx, simulator))
+                        msg = pickle.dumps({'status':'success','comm':'resume'})
+                    else:
+                        msg = pickle.dumps({'status':'failed','message':'no checkpoint to resume from'})
+                    worker.send_multipart([ident, msg])
                 elif msg['comm']=='getresults':
                     idx = msg['identity']
                     result = simulationresults[idx]
@@ -150,6 +197,8 @@ class ServerWorker(QtCore.QThread):
                         del simulationprogress[idx]
                     if idx in simulationresults:
                         del simulationresults[idx]
+                    if idx in simulationcontrol:
+                        del simulationcontrol[idx]
                     msg = pickle.dumps({'status':'success','comm':'remove'})
                     worker.send_multipart([ident, msg])
                 else:
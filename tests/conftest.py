@@ -0,0 +1,80 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import os
+import sys
+import pytest
+
+repositoryDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not repositoryDirectory in sys.path:
+    sys.path.insert(0,repositoryDirectory)
+activitiesDirectory = os.path.join(repositoryDirectory,'Configurations','activities')
+meshesDirectory = os.path.join(repositoryDirectory,'Configurations','meshes')
+
+
+def createModel(humanModel=None,Ta=30.0,met=1.0,rh=0.4,velocityOfAir=0.1,clothingFile='clothing.json',projected=True):
+    '''
+    Tanabe model with the boundary conditions of an activity set as Simulator.run does, the standard 16 segment body if
+    humanModel is None
+    '''
+    from abics.run import loadHumanModel
+    from support.Interfaces import loadClothingModel
+    from thermoregulation.Tanabe65MN import Tanabe65MNModel, Tanabe65MNProjectedToStandard16
+    if humanModel is None:
+        model = Tanabe65MNModel(loadHumanModel(None))
+    elif projected:
+        model = Tanabe65MNProjectedToStandard16(loadHumanModel(humanModel,True))
+    else:
+        model = Tanabe65MNModel(loadHumanModel(humanModel,False))
+    clothingModel = loadClothingModel(os.path.join(activitiesDirectory,clothingFile))
+    clothingModel.setVelocityOfAir(velocityOfAir)
+    model.setClothingModel(clothingModel)
+    model.setTa(Ta)
+    model.setRelativeHumidity(rh)
+    model.setInitialConditions(model.getInitialConditions())
+    model.setMet(met)
+    model.getW()
+    return model
+
+
+@pytest.fixture(scope='session')
+def femaleMesh():
+    '''
+    HumanModel of the female mesh, the mesh the shipped per face radiation file was computed for
+    '''
+    from bodymodels.LoadOBJHumanModel import HumanModel
+    return HumanModel(os.path.join(meshesDirectory,'female.obj'),2/3.0,True)
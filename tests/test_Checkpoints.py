@@ -0,0 +1,163 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import os
+import signal
+import numpy as np
+import pytest
+from conftest import activitiesDirectory
+from abics.run import loadHumanModel, runSimulation
+from support.SimulationCore import Simulator, SimulationData
+from thermoregulation.Integrators import BDFIntegrator
+
+
+def checkpointActivities():
+    '''
+    Warm, cool and hot transient activities with a steady state activity between them
+    '''
+    activities = {'activityname':'checkpoints'}
+    conditions = [(35.0,1.2,False),(20.0,2.0,False),(28.0,1.0,True),(40.0,1.5,False)]
+    for i,(Tab,met,steadyState) in enumerate(conditions):
+        activities[i] = {'clothingFile':os.path.join(activitiesDirectory,'clothing.json'),'radiationFluxFile':'',
+                         'metabolicActivity':met,'Tab':Tab,'duration':20.0,'velocityOfAir':0.2,'rh':40.0,'id':i,
+                         'steadyState':steadyState}
+    return activities
+
+
+def createSimulator(integrator='bdf'):
+    simulator = Simulator()
+    simulator.setup(checkpointActivities(),loadHumanModel(None),False,5,integrator)
+    assert simulator.setupError is None
+    return simulator
+
+
+def runActivities(simulator,subStepCallback=None):
+    '''
+    Run until the simulation completes or is stopped, returns True on completion
+    '''
+    while simulator.currentTimeIndex < simulator.numActivities and not simulator.isStopped():
+        if simulator.stopProcessing:
+            return False
+        completed = simulator.run(subStepCallback)
+        assert simulator.setupError is None
+        if completed:
+            simulator.currentTimeIndex += 1
+    return True
+
+
+def assertSameResults(simulator,reference):
+    data = simulator.getSimulationResults()
+    expected = reference.getSimulationResults()
+    assert data.numberOfTimeSamples == expected.numberOfTimeSamples
+    for name in SimulationData.seriesNames+['sensation']:
+        assert np.array_equal(getattr(data,name),getattr(expected,name)),name
+    for name in SimulationData.fieldNames:
+        assert np.array_equal(data.getFaceField(name),expected.getFaceField(name)),name
+
+
+def stopAt(simulator,activity,subStep):
+    def stopSimulation():
+        if (simulator.currentTimeIndex,simulator.subStepIndex) == (activity,subStep):
+            simulator.stop()
+    return stopSimulation
+
+
+@pytest.mark.parametrize('integrator',['bdf','radau','implicit-euler'])
+@pytest.mark.parametrize('activity,subStep',[(1,2),(2,3),(3,4)])
+def testContinuedCheckpointMatchesUninterruptedRun(integrator,activity,subStep):
+    reference = createSimulator(integrator)
+    assert runActivities(reference)
+    
+    simulator = createSimulator(integrator)
+    assert not runActivities(simulator,stopAt(simulator,activity,subStep))
+    #The stop is honoured within the activity
+    assert (simulator.currentTimeIndex,simulator.subStepIndex) == (activity,subStep)
+    assert simulator.getNumberOfCompletedSamples() == activity*5+subStep
+    
+    resumed = Simulator.fromCheckpoint(simulator.getCheckpoint())
+    assert not resumed.stopProcessing
+    assert (resumed.currentTimeIndex,resumed.subStepIndex) == (activity,subStep)
+    assert runActivities(resumed)
+    assertSameResults(resumed,reference)
+    #The integrator continues where it was left rather than restarting
+    assert resumed.trModel.getIntegratorStatistics()['nsteps'] == reference.trModel.getIntegratorStatistics()['nsteps']
+
+
+def testContinuedCheckpointOfNonResumableIntegrator(monkeypatch):
+    '''
+    Integrators that cannot be resumed restart from the checkpointed state, the results agree within the integration tolerance
+    '''
+    monkeypatch.setattr(BDFIntegrator,'resumable',False)
+    reference = createSimulator()
+    assert runActivities(reference)
+    simulator = createSimulator()
+    assert not runActivities(simulator,stopAt(simulator,1,2))
+    resumed = Simulator.fromCheckpoint(simulator.getCheckpoint())
+    assert runActivities(resumed)
+    data = resumed.getSimulationResults()
+    expected = reference.getSimulationResults()
+    assert np.array_equal(data.timeValue,expected.timeValue)
+    assert not np.array_equal(data.rectalTemperature,expected.rectalTemperature)
+    assert np.allclose(data.rectalTemperature,expected.rectalTemperature,rtol=0,atol=1e-4)
+    assert np.allclose(data.getFaceField('skinTemperature'),expected.getFaceField('skinTemperature'),rtol=0,atol=1e-4)
+
+
+def testRunSimulationStopsOnSignalWithinActivity(tmp_path,monkeypatch):
+    reference = createSimulator()
+    assert runSimulation(reference)
+    
+    simulator = createSimulator()
+    checkpointFile = str(tmp_path/'simulation.checkpoint')
+    handler = signal.getsignal(signal.SIGTERM)
+    signal.signal(signal.SIGTERM,lambda signum,frame: simulator.stop())
+    saveCheckpoint = Simulator.saveCheckpoint
+    def saveAndSignal(self,filename):
+        saveCheckpoint(self,filename)
+        if (self.currentTimeIndex,self.subStepIndex) == (1,3):
+            os.kill(os.getpid(),signal.SIGTERM)
+    monkeypatch.setattr(Simulator,'saveCheckpoint',saveAndSignal)
+    try:
+        #A negative interval writes a checkpoint after every sub step
+        assert not runSimulation(simulator,checkpointFile,-1.0)
+    finally:
+        signal.signal(signal.SIGTERM,handler)
+    monkeypatch.undo()
+    
+    resumed = Simulator.loadCheckpoint(checkpointFile)
+    assert (resumed.currentTimeIndex,resumed.subStepIndex) == (1,3)
+    assert runSimulation(resumed)
+    assertSameResults(resumed,reference)
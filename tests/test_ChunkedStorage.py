@@ -0,0 +1,185 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import os
+import pickle
+import numpy as np
+import pytest
+from support.ChunkedStorage import ChunkedTimeSeries, PiecewiseConstantTimeSeries
+
+nDofs = 13
+numberOfTimeSamples = 300
+chunkSize = 64
+
+
+@pytest.fixture
+def dense():
+    return np.random.RandomState(11).rand(nDofs,numberOfTimeSamples)
+
+
+@pytest.fixture
+def chunked(tmp_path,dense):
+    series = ChunkedTimeSeries(str(tmp_path),'field',nDofs,numberOfTimeSamples,chunkSize)
+    for t in range(numberOfTimeSamples):
+        series[:,t] = dense[:,t]
+    return series
+
+
+timeKeys = [0,63,64,-1,slice(None),slice(10,200),slice(None,None,7),slice(250,None),np.array([5,299,64,63,0])]
+dofKeys = [slice(None),4,slice(2,9),np.array([12,0,3])]
+
+
+@pytest.mark.parametrize('timeKey',timeKeys,ids=repr)
+@pytest.mark.parametrize('dofKey',dofKeys,ids=repr)
+def testIndexingMatchesDense(chunked,dense,dofKey,timeKey):
+    #dofs and times are selected independently, also when both are index arrays
+    assert np.array_equal(chunked[dofKey,timeKey],dense[dofKey][...,timeKey])
+
+
+def testArrayAndReductions(chunked,dense):
+    assert chunked.shape == dense.shape and chunked.ndim == 2
+    assert np.array_equal(np.asarray(chunked),dense)
+    assert np.array_equal(chunked[3],dense[3])
+    assert chunked.max() == dense.max() and chunked.min() == dense.min()
+    assert np.array_equal(np.concatenate(list(chunked.iterateChunks()),axis=1),dense)
+    assert chunked.getNumberOfChunks() == 5
+
+
+def testUnwrittenSamplesReadAsZero(tmp_path,dense):
+    series = ChunkedTimeSeries(str(tmp_path),'partial',nDofs,numberOfTimeSamples,chunkSize)
+    expected = np.zeros_like(dense)
+    for t in [3,70,71]:
+        series[:,t] = dense[:,t]
+        expected[:,t] = dense[:,t]
+    series[2:5,200] = 1.5
+    expected[2:5,200] = 1.5
+    assert np.array_equal(np.asarray(series),expected)
+    #Only the chunks that were written are on disk
+    assert sorted(os.listdir(str(tmp_path))) == ['partial_000000.npy','partial_000001.npy','partial_000003.npy']
+    assert series.min() == 0.0
+
+
+def testIndexErrors(chunked):
+    with pytest.raises(IndexError):
+        chunked[:,numberOfTimeSamples]
+    with pytest.raises(IndexError):
+        chunked[:,-numberOfTimeSamples-1] = 0.0
+    with pytest.raises(TypeError):
+        chunked[:,0:2] = 0.0
+
+
+def testTruncate(tmp_path,chunked,dense):
+    chunked.truncate(100)
+    assert chunked.shape == (nDofs,100)
+    assert np.array_equal(np.asarray(chunked),dense[:,:100])
+    assert chunked.max() == dense[:,:100].max()
+    assert sorted(os.listdir(str(tmp_path))) == ['field_000000.npy','field_000001.npy']
+
+
+def testPicklingRefersToTheChunks(chunked,dense):
+    copy = pickle.loads(pickle.dumps(chunked))
+    assert copy.chunks == dict()
+    assert np.array_equal(np.asarray(copy),dense)
+    #Writes through one instance are seen by the other once flushed
+    copy[:,10] = -1.0
+    copy.flush()
+    assert np.all(chunked[:,10] == -1.0)
+
+
+def piecewiseConstantSamples():
+    '''
+    Dense samples that change at a few times and are unwritten (0) from 280 on
+    '''
+    random = np.random.RandomState(13)
+    dense = np.zeros((nDofs,numberOfTimeSamples))
+    changes = [0,40,41,150,151,200,280]
+    for start,stop in zip(changes[:-1],changes[1:]):
+        dense[:,start:stop] = random.rand(nDofs,1)
+    #A value that comes back after a change is stored again
+    dense[:,151:200] = dense[:,40:41]
+    return dense,280
+
+
+@pytest.fixture
+def piecewiseConstant():
+    dense,written = piecewiseConstantSamples()
+    series = PiecewiseConstantTimeSeries(nDofs,numberOfTimeSamples,chunkSize=chunkSize)
+    for t in range(written):
+        series[:,t] = dense[:,t]
+    return series
+
+
+@pytest.mark.parametrize('timeKey',timeKeys,ids=repr)
+@pytest.mark.parametrize('dofKey',dofKeys,ids=repr)
+def testPiecewiseConstantIndexingMatchesDense(piecewiseConstant,dofKey,timeKey):
+    dense,_ = piecewiseConstantSamples()
+    assert np.array_equal(piecewiseConstant[dofKey,timeKey],dense[dofKey][...,timeKey])
+
+
+def testPiecewiseConstantStoresDistinctSamples(piecewiseConstant):
+    dense,written = piecewiseConstantSamples()
+    assert piecewiseConstant.getNumberOfDistinctSamples() == 6
+    assert piecewiseConstant.shape == dense.shape and piecewiseConstant.ndim == 2
+    assert np.array_equal(np.asarray(piecewiseConstant),dense)
+    assert np.array_equal(np.concatenate(list(piecewiseConstant.iterateChunks()),axis=1),dense)
+    #Unwritten samples count as 0
+    assert piecewiseConstant.max() == dense.max() and piecewiseConstant.min() == 0.0
+    piecewiseConstant.truncate(written)
+    assert piecewiseConstant.min() == dense[:,:written].min()
+    with pytest.raises(TypeError):
+        piecewiseConstant[2,0] = 1.0
+
+
+@pytest.mark.parametrize('start,stop',[(0,numberOfTimeSamples),(30,45),(160,290),(285,numberOfTimeSamples)])
+def testPiecewiseConstantSamplesTransfer(piecewiseConstant,start,stop):
+    dense,_ = piecewiseConstantSamples()
+    values,indexes = piecewiseConstant.getSamples(start,stop)
+    assert len(values) <= piecewiseConstant.getNumberOfDistinctSamples()
+    copy = PiecewiseConstantTimeSeries(nDofs,numberOfTimeSamples)
+    copy.setSamples(start,(values,indexes))
+    expected = np.zeros_like(dense)
+    expected[:,start:stop] = dense[:,start:stop]
+    assert np.array_equal(np.asarray(copy),expected)
+
+
+@pytest.mark.parametrize('numberOfSamples',[0,40,41,175,300])
+def testPiecewiseConstantTruncate(piecewiseConstant,numberOfSamples):
+    dense,_ = piecewiseConstantSamples()
+    piecewiseConstant.truncate(numberOfSamples)
+    assert piecewiseConstant.shape == (nDofs,numberOfSamples)
+    assert np.array_equal(np.asarray(piecewiseConstant),dense[:,:numberOfSamples])
+    assert piecewiseConstant.getNumberOfDistinctSamples() == len(np.unique(piecewiseConstant.sampleIndexes[piecewiseConstant.sampleIndexes >= 0]))
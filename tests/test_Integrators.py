@@ -0,0 +1,69 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import warnings
+import numpy as np
+import pytest
+from conftest import createModel
+
+
+@pytest.mark.parametrize('timeStep',[1.0,5.0])
+def testImplicitEulerDivergenceIsDetected(timeStep):
+    '''
+    Diverging newton iterations split the step before temperatures overflow, the run emits no floating point warnings
+    '''
+    model = createModel(None,10.0,0.8,0.4,1.0)
+    model.setIntegrator('implicit-euler',timeStep=timeStep)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        model.solve(1800.0)
+    reference = createModel(None,10.0,0.8,0.4,1.0)
+    reference.solve(1800.0)
+    assert np.all(np.isfinite(model.getState()))
+    #The cold exposure has settled, backward euler reaches the same state
+    assert np.allclose(model.getState(),reference.getState(),rtol=0,atol=1e-3)
+
+
+def testImplicitEulerNewtonStepRejectsDivergence():
+    model = createModel(None,10.0,0.8,0.4,1.0)
+    model.setIntegrator('implicit-euler')
+    integrator = model.getIntegrator()
+    integrator.initialize(model,0.0,model.getState())
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert integrator.newtonStep(0.0,model.getState(),1e4) is None
+        assert integrator.newtonStep(0.0,model.getState(),0.01) is not None
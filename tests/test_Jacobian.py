@@ -0,0 +1,151 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import numpy as np
+import pytest
+from scipy import sparse
+from conftest import createModel
+from scipy.integrate import BDF
+from thermoregulation.Integrators import LowRankUpdateLU, CoupledJacobianBDF
+
+
+def finiteDifferenceJacobian(model,state,columns=None):
+    '''
+    Central difference jacobian of dTbydt at state, for the given columns (all by default)
+    '''
+    if columns is None:
+        columns = range(state.shape[0])
+    columns = list(columns)
+    jacobian = np.zeros((state.shape[0],len(columns)))
+    for i,j in enumerate(columns):
+        h = 1e-6*max(1.0,abs(state[j]))
+        forward = np.array(state)
+        forward[j] += h
+        backward = np.array(state)
+        backward[j] -= h
+        jacobian[:,i] = (np.array(model.dTbydt(forward)) - np.array(model.dTbydt(backward)))/(2*h)
+    return jacobian
+
+
+def warmStates(model):
+    #States on either side of the set points, away from the switches of the control terms
+    state = model.getInitialConditions()
+    return [state + 0.37, state - 0.41, state + np.linspace(-0.6,0.8,state.shape[0])]
+
+
+@pytest.mark.parametrize('Ta,met,rh',[(30.0,1.0,0.4),(17.0,1.2,0.3),(43.0,2.0,0.6)])
+def testJacobianMatchesFiniteDifferences(Ta,met,rh):
+    model = createModel(None,Ta,met,rh)
+    for state in warmStates(model):
+        expected = finiteDifferenceJacobian(model,state)
+        jacobian = model.dTbydtJacobian(state,True).toarray()
+        assert np.allclose(jacobian,expected,rtol=1e-5,atol=1e-6*np.max(np.abs(expected)))
+        
+        
+def testJacobianFactorsMatchAssembledJacobian():
+    model = createModel(None,35.0,1.5,0.5)
+    for state in warmStates(model):
+        L,U,G = model.dTbydtJacobianFactors(state)
+        jacobian = model.dTbydtJacobian(state,True).toarray()
+        assert np.allclose(L.toarray() + U.dot(sparse.csr_matrix(G).toarray()),jacobian,rtol=1e-12,atol=1e-15)
+
+
+def testProjectedJacobianMatchesFiniteDifferences(femaleMesh):
+    model = createModel(femaleMesh,25.0,1.0,0.4)
+    state = warmStates(model)[2]
+    expected = finiteDifferenceJacobian(model,state)
+    jacobian = model.dTbydtJacobian(state,True).toarray()
+    assert np.allclose(jacobian,expected,rtol=1e-5,atol=1e-6*np.max(np.abs(expected)))
+
+
+def testLowRankUpdateSolve():
+    model = createModel(None,30.0)
+    state = warmStates(model)[0]
+    L,U,G = model.dTbydtJacobianFactors(state)
+    c = 12.5
+    A = sparse.identity(L.shape[0],format='csc') - c*L
+    dense = np.identity(L.shape[0]) - c*model.dTbydtJacobian(state,True).toarray()
+    b = np.linspace(1.0,2.0,L.shape[0])
+    assert np.allclose(LowRankUpdateLU(A,U,G,c).solve(b),np.linalg.solve(dense,b),rtol=1e-10,atol=1e-12)
+    
+    
+def testAnalyticJacobianIntegrationMatchesFiniteDifferences():
+    #The coupled BDF solver (sparse LU with a low rank update) converges to the same solution as BDF with estimated jacobians
+    states = []
+    for useAnalyticJacobian in [True,False]:
+        model = createModel(None,40.0,1.5,0.5)
+        model.setIntegrator('bdf',rtol=1e-8,atol=1e-10,useAnalyticJacobian=useAnalyticJacobian)
+        model.solve(1800.0)
+        states.append(model.getState())
+    assert np.allclose(states[0],states[1],rtol=0,atol=1e-5)
+
+
+def coupledSolver(model,tBound=600.0):
+    def rhs(t,y):
+        return np.array(model.dTbydt(y))
+    def jacobianFactors(t,y):
+        return model.dTbydtJacobianFactors(y)
+    return CoupledJacobianBDF(rhs,0.0,model.getState(),tBound,jacobianFactors,model.jacobianBlockSize,rtol=1e-8,atol=1e-10)
+
+
+def testNewtonScaleIsRecovered():
+    model = createModel(None,40.0,1.5,0.5)
+    solver = coupledSolver(model)
+    L = solver.L
+    identity = sparse.identity(L.shape[0],format='csc')
+    c = 0.37
+    #The scale does not depend on how the newton matrix is formed
+    for A in [identity - c*L,identity - L*c,sparse.csc_array(identity) - c*sparse.csc_array(L),(identity - c*L).toarray()]:
+        assert solver.getNewtonScale(A) == pytest.approx(c,rel=1e-12)
+    with pytest.raises(RuntimeError):
+        solver.getNewtonScale(2*identity - c*L)
+
+
+def testCoupledBDFMatchesBDFWithAssembledJacobian():
+    model = createModel(None,40.0,1.5,0.5)
+    coupled = coupledSolver(model)
+    reference = BDF(coupled.fun,0.0,model.getState(),600.0,jac=lambda t,y: model.dTbydtJacobian(y,True).toarray(),rtol=1e-8,atol=1e-10)
+    #Rounding differences move the step sizes slightly, the step sequence and the solution are the same
+    steps = [0,0]
+    for k,solver in enumerate([coupled,reference]):
+        while solver.status == 'running':
+            solver.step()
+            steps[k] += 1
+    assert coupled.status == 'finished' and reference.status == 'finished'
+    assert steps[0] == steps[1]
+    assert coupled.nlu == reference.nlu and coupled.njev == reference.njev
+    assert np.allclose(coupled.y,reference.y,rtol=1e-9,atol=1e-11)
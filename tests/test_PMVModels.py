@@ -0,0 +1,203 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import logging
+import numpy as np
+import pytest
+from conftest import createModel
+from scipy.optimize import brentq
+from thermoregulation.PMVModels import FangerModel, ZhangModel
+
+
+def scalarFangerPMV(ta,tr,vel,rh,met,wme=0.0,icl=0.10,maxIterations=150):
+    '''
+    Point by point Fanger PMV/PPD (ISO 7730), the loop FangerModel.computePMVArrays vectorises, None if it does not converge
+    '''
+    pa = rh * 10 * np.exp(16.6536 - 4030.183 / (ta + 235))
+    m = met * 58.15
+    w = wme * 58.15
+    mw = m - w
+    if icl <= 0.078:
+        fcl = 1 + (1.29 * icl)
+    else:
+        fcl = 1.05 + (0.645 * icl)
+    hcf = 12.1 * np.sqrt(vel)
+    taa = ta + 273
+    tra = tr + 273
+    tcla = taa + (35.5 - ta) / (3.5 * icl + 0.1)
+    p1 = icl * fcl
+    p2 = p1 * 3.96
+    p3 = p1 * 100
+    p4 = p1 * taa
+    p5 = 308.7 - 0.028 * mw + p2 * pow(tra / 100, 4)
+    xn = tcla / 100
+    xf = tcla / 50
+    hc = 0.0
+    n = 0
+    while abs(xn - xf) > 0.00015:
+        xf = (xf + xn) / 2
+        hcn = 2.38 * pow(abs(100.0 * xf - taa), 0.25)
+        hc = hcf if hcf > hcn else hcn
+        xn = (p5 + p4 * hc - p2 * pow(xf, 4)) / (100 + p3 * hc)
+        n = n + 1
+        if n > maxIterations:
+            return None
+    tcl = 100 * xn - 273
+    hl1 = 3.05 * 0.001 * (5733 - (6.99 * mw) - pa)
+    hl2 = 0.42 * (mw - 58.15) if mw > 58.15 else 0.0
+    hl3 = 1.7 * 0.00001 * m * (5867 - pa)
+    hl4 = 0.0014 * m * (34 - ta)
+    hl5 = 3.96 * fcl * (pow(xn, 4) - pow(tra / 100, 4))
+    hl6 = fcl * hc * (tcl - ta)
+    ts = 0.303 * np.exp(-0.036 * m) + 0.028
+    pmv = ts * (mw - hl1 - hl2 - hl3 - hl4 - hl5 - hl6)
+    ppd = 100.0 - 95.0 * np.exp(-0.03353 * pow(pmv, 4.0) - 0.2179 * pow(pmv, 2.0))
+    return pmv,ppd
+
+
+@pytest.mark.parametrize('icl',[0.05,0.10,0.20])
+def testFangerArraysMatchScalarLoop(icl):
+    ta,tr,vel,rh,met = np.meshgrid([10.0,22.0,28.0,36.0],[15.0,30.0],[0.05,0.3,1.0],[0.3,0.7],[0.8,1.2,3.0],indexing='ij')
+    wme = np.where(met > 2.0,0.5,0.0)
+    pmv,ppd = FangerModel().computePMVArrays(ta,tr,vel,rh,met,wme,icl)
+    assert pmv.shape == ta.shape and ppd.shape == ta.shape
+    for index in np.ndindex(ta.shape):
+        expected = scalarFangerPMV(ta[index],tr[index],vel[index],rh[index],met[index],wme[index],icl)
+        assert pmv[index] == pytest.approx(expected[0],rel=1e-12,abs=1e-12)
+        assert ppd[index] == pytest.approx(expected[1],rel=1e-12,abs=1e-12)
+
+
+def testFangerPointsThatDoNotConvergeAreNan():
+    fanger = FangerModel()
+    fanger.maxIterations = 4
+    ta = np.array([22.0,22.0])
+    vel = np.array([0.1,0.1])
+    icl = np.array([1.0,0.05])
+    expected = [scalarFangerPMV(t,t,v,0.5,1.2,0.0,c,fanger.maxIterations) for t,v,c in zip(ta,vel,icl)]
+    assert expected[0] is not None and expected[1] is None
+    pmv,ppd = fanger.computePMVArrays(ta,ta,vel,0.5,1.2,0.0,icl)
+    assert pmv[0] == pytest.approx(expected[0][0],rel=1e-12)
+    assert np.isnan(pmv[1]) and np.isnan(ppd[1])
+
+
+def testModelFangerPMVReportsNonConvergence(monkeypatch,caplog):
+    model = createModel()
+    pmv,ppd = model.FangerPMV(0.1)
+    assert np.isfinite(pmv) and np.isfinite(ppd)
+    monkeypatch.setattr(FangerModel,'maxIterations',0)
+    with caplog.at_level(logging.WARNING):
+        pmv,ppd = model.FangerPMV(0.1)
+    assert np.isnan(pmv) and np.isnan(ppd)
+    assert 'did not converge' in caplog.text
+
+
+def dictZhangPMV(zm,skin,core,setPoint,dt=None):
+    '''
+    Zhang sensation evaluated part by part on the segment dicts, the loop ZhangModel.computePMVArrays vectorises
+    '''
+    dtd = 0.001 if dt is None else dt
+    meanWholeBodySkinTemp = np.mean([v[0] for v in skin.values()])
+    meanWholeBodySetTemp = np.mean(list(setPoint.values()))
+    pmv = 0.0
+    for part,segments in zm.calcKeys.items():
+        tsk = np.mean([skin[k][0] for k in segments])
+        dtsk = np.mean([skin[k][1]/dtd for k in segments])
+        dtcr = np.mean([core[k][1]/dtd for k in segments])
+        tset = np.mean([setPoint[k] for k in segments])
+        C1a,C1b,K1,C2a,C2b,C3 = zm.partSpecificRegressionCoefficients[part]
+        C1 = C1a if tsk < tset else C1b
+        local = 4*(2.0/(1.0+np.exp(-C1*(tsk-tset)-K1*(tsk-meanWholeBodySkinTemp-tset+meanWholeBodySetTemp)))-1)
+        if not dt is None:
+            C2 = C2a if dtsk < 0 else C2b
+            local += C2*dtsk + C3*dtcr
+        pmv += local*zm.thermalSensationWeightingFactors[part]
+    ppd = 100.0 - 95.0 * np.exp(-0.03353 * np.power(pmv, 4.0) - 0.2179 * np.power(pmv, 2.0))
+    pmvr = int(np.ceil(pmv+np.sign(pmv)*0.1))
+    feeling = ['Very Cold','Cold','Cool','Slightly Cool','Neutral','Slightly Warm','Warm','Hot','Very Hot'][min(max(pmvr,-4),4)+4]
+    return pmv,ppd,feeling
+
+
+def zhangInputs(zm,offset,dt=None):
+    '''
+    Segment dicts with the skin offset from the set points by offset (plus a spread), rates are only used when dt is given
+    '''
+    rng = np.random.RandomState(3)
+    keys = zm.sixteenSegmentkeys
+    setPoint = dict(zip(keys,np.linspace(33.0,35.0,len(keys))))
+    spread = rng.uniform(-0.3,0.3,len(keys))
+    skinRates = rng.uniform(-2e-3,2e-3,len(keys))*(0 if dt is None else dt)
+    coreRates = rng.uniform(-1e-4,1e-4,len(keys))*(0 if dt is None else dt)
+    skin = dict((k,[setPoint[k]+offset+spread[i],skinRates[i]]) for i,k in enumerate(keys))
+    core = dict((k,[37.0+0.1*spread[i],coreRates[i]]) for i,k in enumerate(keys))
+    return skin,core,setPoint
+
+
+def zhangArrays(zm,skin,core,setPoint):
+    keys = zm.sixteenSegmentkeys
+    skin = np.array([skin[k] for k in keys])
+    core = np.array([core[k] for k in keys])
+    return skin[:,0],skin[:,1],core[:,0],core[:,1],np.array([setPoint[k] for k in keys])
+
+
+#pmv values at which the sensation code ceil(pmv + 0.1*sign(pmv)) changes, levels above 4 are clipped to Very Hot
+sensationThresholds = [-3.9,-2.9,-1.9,-0.9,0.0,0.9,1.9,2.9]
+
+
+@pytest.mark.parametrize('dt',[None,60.0],ids=['steady','dynamic'])
+@pytest.mark.parametrize('threshold',sensationThresholds)
+def testZhangArraysMatchDictComputation(threshold,dt):
+    zm = ZhangModel()
+    pmvOf = lambda offset: dictZhangPMV(zm,*zhangInputs(zm,offset,dt),dt=dt)[0]
+    #Skin offsets that put the pmv just either side of the threshold
+    offsets = [brentq(lambda offset: pmvOf(offset)-(threshold+delta),-20.0,20.0,xtol=1e-12) for delta in (-1e-3,1e-3)]
+    inputs = [zhangInputs(zm,offset,dt) for offset in offsets]
+    expected = [dictZhangPMV(zm,*values,dt=dt) for values in inputs]
+    assert expected[0][2] != expected[1][2]
+    for values,(pmv,ppd,feeling) in zip(inputs,expected):
+        apmv,appd,sensation = zm.computePMVArrays(*zhangArrays(zm,*values),dt=dt)
+        assert apmv.shape == (1,) and sensation.dtype == np.int8
+        assert apmv[0] == pytest.approx(pmv,rel=1e-12,abs=1e-12)
+        assert appd[0] == pytest.approx(ppd,rel=1e-12,abs=1e-12)
+        assert zm.getSensationLabel(sensation[0]) == feeling
+        assert zm.computePMV(*values,dt=dt) == (apmv[0],appd[0],feeling)
+    #Rows are evaluated independently, with per row or shared set points
+    arrays = [zhangArrays(zm,*values) for values in inputs]
+    stacked = [np.array([a[i] for a in arrays]) for i in range(5)]
+    for setPoint in (stacked[4],stacked[4][0]):
+        apmv,appd,sensation = zm.computePMVArrays(stacked[0],stacked[1],stacked[2],stacked[3],setPoint,dt)
+        assert np.allclose(apmv,[e[0] for e in expected],rtol=1e-12,atol=1e-12)
+        assert [zm.getSensationLabel(c) for c in sensation] == [e[2] for e in expected]
@@ -0,0 +1,177 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import io
+import os
+import pickle
+import numpy as np
+import pytest
+from conftest import activitiesDirectory
+from abics.run import loadActivities, loadHumanModel
+from support.ChunkedStorage import ChunkedTimeSeries
+from support.ResultFiles import ResultFileWriter, ResultFile, isResultFile
+from support.SimulationCore import Simulator, SimulationData
+
+
+def runSimulation(activityFile='activities_figa.json',**options):
+    simulator = Simulator()
+    simulator.setup(loadActivities(os.path.join(activitiesDirectory,activityFile)),loadHumanModel(None),False,10,**options)
+    while simulator.currentTimeIndex < simulator.numActivities and not simulator.isStopped():
+        simulator.run()
+        assert simulator.setupError is None
+        simulator.currentTimeIndex += 1
+    return simulator.getSimulationResults()
+
+
+def assertSameResults(loaded,data):
+    assert loaded.numberOfTimeSamples == data.numberOfTimeSamples
+    assert loaded.nDofs == data.nDofs
+    assert loaded.recordingStride == data.recordingStride
+    assert loaded.getRecordingLevel('skinTemperature') == data.getRecordingLevel('skinTemperature')
+    assert loaded.stopTime == data.stopTime and loaded.stopReason == data.stopReason
+    assert list(loaded.sensation) == list(data.sensation)
+    for name in data.seriesNames:
+        assert np.array_equal(getattr(loaded,name),getattr(data,name))
+    assert np.array_equal(loaded.segmentLabels,data.segmentLabels)
+    assert np.array_equal(loaded.bodySurfaceArea,data.bodySurfaceArea)
+    for name in data.fieldNames:
+        field = getattr(data,name)
+        if field is None:
+            assert getattr(loaded,name) is None
+        else:
+            assert np.array_equal(np.asarray(getattr(loaded,name)),np.asarray(field))
+    assert sorted(loaded.segmentFields) == sorted(data.segmentFields)
+    for name,field in data.segmentFields.items():
+        assert np.array_equal(loaded.segmentFields[name],field)
+    assert np.array_equal(loaded.getMeanSegmentSkinTemperatures(),data.getMeanSegmentSkinTemperatures())
+
+
+@pytest.mark.parametrize('options',[dict(),
+                                    dict(recording={'coreTemperature':'segment','skinWettedness':None,'stride':4}),
+                                    dict(stopConditions=[{'type':'rectalTemperature','threshold':36.5,'direction':-1}])],
+                         ids=['face','segmentAndStride','stopped'])
+def testSimulationDataRoundTrip(tmp_path,options):
+    data = runSimulation(**options)
+    assert (data.stopTime is not None) == ('stopConditions' in options)
+    filename = str(tmp_path/'results.abr')
+    data.save(filename)
+    assert isResultFile(filename)
+    assert not os.path.exists(filename+'.tmp')
+    assertSameResults(SimulationData.load(filename),data)
+    assertSameResults(SimulationData.fromBytes(data.toBytes()),data)
+
+
+def testChunkedSimulationDataRoundTrip(tmp_path):
+    storage = tmp_path/'chunks'
+    storage.mkdir()
+    data = runSimulation(storageDirectory=str(storage))
+    assert isinstance(data.skinTemperature,ChunkedTimeSeries)
+    filename = str(tmp_path/'results.abr')
+    data.save(filename)
+    loaded = SimulationData.load(filename)
+    assertSameResults(loaded,data)
+    #The fields are stored in the result file rather than refer to the chunk files
+    assert isinstance(loaded.skinTemperature,np.ndarray)
+
+
+def testOverwritingKeepsTheOriginalUntilClosed(tmp_path):
+    filename = str(tmp_path/'results.abr')
+    writer = ResultFileWriter(filename)
+    writer.addArray('a',np.arange(3))
+    writer.close({'version':1})
+    writer = ResultFileWriter(filename)
+    writer.addArray('a',np.arange(5))
+    assert ResultFile(filename).getArray('a').shape == (3,)
+    writer.close({'version':2})
+    result = ResultFile(filename)
+    assert result.attributes == {'version':2}
+    assert np.array_equal(result.getArray('a'),np.arange(5))
+
+
+@pytest.mark.parametrize('inMemory',[False,True],ids=['file','bytes'])
+def testArraysAndTimeSeries(tmp_path,inMemory):
+    random = np.random.RandomState(7)
+    arrays = {'float':random.rand(17),
+              'float32':random.rand(3,5).astype(np.float32),
+              'int':np.arange(-4,7,dtype=np.int64),
+              'bigEndian':np.arange(6,dtype='>f8').reshape(2,3),
+              'empty':np.zeros((0,4)),
+              'labels':np.array([0,0,1,2,2,2],dtype=np.int32)}
+    dense = random.rand(11,700)
+    chunked = ChunkedTimeSeries(str(tmp_path),'field',11,700,chunkSize=64)
+    for t in range(700):
+        chunked[:,t] = dense[:,t]
+    attributes = {'name':'test','count':np.int64(3),'values':np.arange(3.0),'nested':{'stopTime':None}}
+    if inMemory:
+        ser = io.BytesIO()
+        writer = ResultFileWriter(ser)
+    else:
+        filename = str(tmp_path/'arrays.abr')
+        writer = ResultFileWriter(filename)
+    for name,array in arrays.items():
+        writer.addArray(name,array)
+    writer.addTimeSeries('dense',dense,chunkSize=100)
+    writer.addTimeSeries('chunked',chunked)
+    writer.addTimeSeries('noSamples',np.zeros((4,0)))
+    writer.close(attributes)
+    result = ResultFile(ser.getvalue()) if inMemory else ResultFile(filename)
+    assert result.attributes == {'name':'test','count':3,'values':[0.0,1.0,2.0],'nested':{'stopTime':None}}
+    for name,array in arrays.items():
+        assert result.hasArray(name)
+        loaded = result.getArray(name)
+        assert loaded.shape == array.shape
+        assert np.array_equal(loaded,array)
+        assert loaded.dtype.byteorder != '>'
+    assert not result.hasArray('missing')
+    assert sorted(result.getArrayNames('float')) == ['float','float32']
+    for name in ['dense','chunked']:
+        assert result.getArray(name).shape == (11,700)
+        assert np.array_equal(result.getArray(name),dense)
+        assert np.array_equal(result.getTimeSeries(name,130,257),dense[:,130:257])
+        assert np.array_equal(result.getTimeSeries(name,650),dense[:,650:])
+    assert result.getArray('noSamples').shape == (4,0)
+
+
+def testRejectsOtherFiles(tmp_path):
+    filename = str(tmp_path/'results.pkl')
+    with open(filename,'wb') as ser:
+        pickle.dump({'timeValue':np.arange(3)},ser)
+    assert not isResultFile(filename)
+    with pytest.raises(ValueError):
+        ResultFile(filename)
+    with pytest.raises(ValueError):
+        ResultFile(b'abc')
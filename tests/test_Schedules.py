@@ -0,0 +1,137 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import json
+import os
+import shutil
+import numpy as np
+import pytest
+from conftest import activitiesDirectory
+from abics.run import loadActivities
+from support.Schedules import ActivitySchedule
+
+#duration (minutes), Tab, rh (%), velocityOfAir, metabolicActivity, clothing, radiation, steadyState
+scheduleRows = [(30.0,35.0,40.0,0.2,1.2,'clothing.json','',0),
+                (15.0,20.0,60.0,0.5,2.0,'noclothing.json','radiation.json',0),
+                (45.0,28.0,50.0,0.1,1.0,'clothing.json','radiation.json',1),
+                (45.0,30.0,30.0,0.3,1.5,'noclothing.json','',0)]
+
+
+@pytest.fixture
+def scheduleDirectory(tmp_path):
+    '''
+    Directory with the clothing and radiation files referred to by scheduleRows and the equivalent activity file
+    '''
+    for name in ['clothing.json','noclothing.json','radiation.json']:
+        shutil.copy(os.path.join(activitiesDirectory,name),str(tmp_path))
+    activities = {'activityname':'schedule'}
+    for i,(duration,Tab,rh,voa,met,clothing,radiation,steadyState) in enumerate(scheduleRows):
+        activities[str(i)] = {'clothingFile':clothing,'radiationFluxFile':radiation,'metabolicActivity':met,'Tab':Tab,
+                              'duration':duration,'velocityOfAir':voa,'rh':rh,'id':i,'steadyState':bool(steadyState)}
+    with open(str(tmp_path/'activities.json'),'w') as ser:
+        json.dump(activities,ser)
+    return tmp_path
+
+
+def writeDurationsCSV(directory):
+    filename = str(directory/'schedule.csv')
+    with open(filename,'w') as ser:
+        ser.write('duration,Tab,rh,velocityOfAir,metabolicActivity,clothing,radiation,steadyState\n')
+        for row in scheduleRows:
+            ser.write('%g,%g,%g,%g,%g,%s,%s,%d\n'%row)
+    return ActivitySchedule.fromFile(filename)
+
+
+def writeTimesCSV(directory):
+    #Start times with the column aliases, the last row lasts as long as the one before it
+    filename = str(directory/'schedule.csv')
+    times = np.cumsum([0.0]+[row[0] for row in scheduleRows[:-1]])/60.0
+    with open(filename,'w') as ser:
+        ser.write('time,Ta,RH,voa,met,clothingFile,radiationFluxFile,steadyState\n')
+        for time,row in zip(times,scheduleRows):
+            ser.write('%.17g,%g,%g,%g,%g,%s,%s,%d\n'%((time,)+row[1:]))
+    return ActivitySchedule.fromFile(filename,timeUnit='hours')
+
+
+def writeIndexesNPZ(directory):
+    #Clothing and radiation columns as indexes into file lists stored with the columns
+    filename = str(directory/'schedule.npz')
+    clothingFiles = ['clothing.json','noclothing.json']
+    radiationFiles = ['radiation.json']
+    columns = dict((name,np.array([row[i] for row in scheduleRows])) for i,name in
+                   enumerate(['duration','Tab','rh','velocityOfAir','metabolicActivity']))
+    columns['duration'] = columns['duration']*60.0
+    columns['clothing'] = np.array([clothingFiles.index(row[5]) for row in scheduleRows])
+    columns['radiation'] = np.array([radiationFiles.index(row[6]) if len(row[6]) > 0 else -1 for row in scheduleRows])
+    columns['steadyState'] = np.array([row[7] for row in scheduleRows])
+    np.savez(filename,clothingFiles=np.array(clothingFiles),radiationFiles=np.array(radiationFiles),**columns)
+    return ActivitySchedule.fromFile(filename,timeUnit='seconds')
+
+
+def referencedFiles(indexes,files):
+    return [files[i] if i >= 0 else None for i in indexes]
+
+
+@pytest.mark.parametrize('createSchedule',[writeDurationsCSV,writeTimesCSV,writeIndexesNPZ],ids=['durations','times','indexes'])
+def testScheduleFileMatchesActivities(scheduleDirectory,createSchedule):
+    schedule = createSchedule(scheduleDirectory)
+    expected = ActivitySchedule.fromActivities(loadActivities(str(scheduleDirectory/'activities.json')))
+    assert schedule.getNumberOfEntries() == len(scheduleRows)
+    #Durations in seconds and rh as a fraction
+    assert np.allclose(schedule.getDurations(),[row[0]*60.0 for row in scheduleRows],rtol=1e-12)
+    assert np.allclose(schedule.entries['rh'],[row[2]/100.0 for row in scheduleRows],rtol=1e-12)
+    for name in ['duration','Tab','rh','velocityOfAir','metabolicActivity']:
+        assert np.allclose(schedule.entries[name],expected.entries[name],rtol=1e-12),name
+    assert np.array_equal(schedule.entries['steadyState'],expected.entries['steadyState'])
+    #Each file is listed once and the entries refer to the same files
+    assert sorted(schedule.clothingFiles) == sorted(expected.clothingFiles)
+    assert schedule.radiationFiles == expected.radiationFiles == [os.path.abspath(str(scheduleDirectory/'radiation.json'))]
+    assert referencedFiles(schedule.entries['clothing'],schedule.clothingFiles) == referencedFiles(expected.entries['clothing'],expected.clothingFiles)
+    assert referencedFiles(schedule.entries['radiation'],schedule.radiationFiles) == referencedFiles(expected.entries['radiation'],expected.radiationFiles)
+    assert list(schedule.entries['radiation']) == [-1,0,0,-1]
+
+
+def testResolveColumn(scheduleDirectory):
+    directory = str(scheduleDirectory)
+    indexes,files = ActivitySchedule.resolveColumn(np.array(['radiation.json','','radiation.json']),None,directory)
+    assert list(indexes) == [0,-1,0]
+    assert files == [os.path.join(directory,'radiation.json')]
+    indexes,files = ActivitySchedule.resolveColumn(np.array([1,0,1]),['clothing.json','noclothing.json'],directory)
+    assert list(indexes) == [1,0,1] and indexes.dtype == np.int32
+    assert files == [os.path.join(directory,'clothing.json'),os.path.join(directory,'noclothing.json')]
+    with pytest.raises(ValueError):
+        ActivitySchedule.resolveColumn(np.array([1,0]),None,directory)
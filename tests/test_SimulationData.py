@@ -0,0 +1,90 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import numpy as np
+import pytest
+from conftest import createModel
+from support.SimulationCore import SimulationData
+
+
+@pytest.fixture(scope='module')
+def projectedModel(femaleMesh):
+    return createModel(femaleMesh)
+
+
+def recordData(model,recording,numberOfTimeSamples=7):
+    '''
+    SimulationData with random face values recorded at every sample as Simulator.run does, returns it with the values
+    '''
+    data = SimulationData(model,numberOfTimeSamples,recording=recording)
+    rng = np.random.RandomState(7)
+    faceValues = dict((name,rng.uniform(20.0,40.0,(data.nDofs,numberOfTimeSamples))) for name in data.fieldNames)
+    for tidx in range(numberOfTimeSamples):
+        for name in data.getFieldsToRecord(tidx):
+            data.recordField(name,tidx,faceValues[name][:,tidx])
+    return data,faceValues
+
+
+def testSegmentFieldsAreSpreadOverTheirFaces(projectedModel):
+    data,faceValues = recordData(projectedModel,{'coreTemperature':'segment','skinTemperature':'segment','stride':2})
+    aggregator = data.getSegmentAggregator()
+    for name in ['coreTemperature','skinTemperature']:
+        values = data.getFaceField(name)
+        assert values.shape == (data.nDofs,4)
+        #Each face shows the area weighted mean of its segment at the recorded samples
+        means = aggregator.mean(faceValues[name][:,::2],data.bodySurfaceArea)
+        for segment in range(aggregator.numberOfSegments):
+            faces = aggregator.getFaces(segment)
+            assert faces.shape[0] > 1
+            assert np.allclose(values[faces],means[segment])
+        assert np.all(values[aggregator.labels < 0] == 0)
+        assert np.array_equal(data.getFaceField(name,1,3),values[:,1:3])
+    #Fields recorded per face are returned as recorded
+    assert np.array_equal(data.getFaceField('skinWettedness'),faceValues['skinWettedness'][:,::2])
+
+
+def testUnrecordedFieldsAreZero(projectedModel):
+    data,_ = recordData(projectedModel,{'skinWettedness':None,'evaporativeResistance':None,'stride':2})
+    for name in ['skinWettedness','evaporativeResistance']:
+        values = data.getFaceField(name)
+        assert values.shape == (data.nDofs,4)
+        assert not np.any(values)
+        assert data.getFaceField(name,1,3).shape == (data.nDofs,2)
+        #Requests beyond the recorded samples are clipped
+        assert data.getFaceField(name,2,10).shape == (data.nDofs,2)
+        assert data.getFaceField(name,5).shape == (data.nDofs,0)
+    assert np.any(data.getFaceField('skinTemperature'))
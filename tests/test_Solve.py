@@ -0,0 +1,140 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import numpy as np
+import pytest
+from conftest import createModel
+
+
+def countInitializations(model):
+    '''
+    Count the restarts of the model's integrator
+    '''
+    integrator = model.getIntegrator()
+    initialize = integrator.initialize
+    calls = [0]
+    def countingInitialize(*args,**kwargs):
+        calls[0] += 1
+        return initialize(*args,**kwargs)
+    integrator.initialize = countingInitialize
+    return calls
+
+
+@pytest.mark.parametrize('integrator',['bdf','radau','implicit-euler'])
+def testSubStepsContinueTheIntegration(integrator):
+    '''
+    With continuous integration, N sub step solves take the same steps as one solve over the whole span
+    '''
+    model = createModel(None,40.0,1.5,0.5,0.2)
+    model.setIntegrator(integrator)
+    model.setContinuousIntegration(True)
+    restarts = countInitializations(model)
+    for _ in range(10):
+        model.solve(360.0)
+    reference = createModel(None,40.0,1.5,0.5,0.2)
+    reference.setIntegrator(integrator)
+    reference.solve(3600.0)
+    assert restarts[0] == 1
+    assert model.simulationTime == pytest.approx(3600.0)
+    assert model.getIntegratorStatistics()['nsteps'] == reference.getIntegratorStatistics()['nsteps']
+    assert np.allclose(model.getState(),reference.getState(),rtol=1e-12,atol=1e-12)
+
+
+def testRestartedSubStepsTakeMoreSteps():
+    continued = createModel(None,40.0,1.5,0.5,0.2)
+    restarted = createModel(None,40.0,1.5,0.5,0.2)
+    restarted.setContinuousIntegration(False)
+    for _ in range(10):
+        continued.solve(360.0)
+        restarted.solve(360.0)
+    assert restarted.getIntegratorStatistics()['nsteps'] > continued.getIntegratorStatistics()['nsteps']
+    assert np.allclose(restarted.getState(),continued.getState(),rtol=0,atol=1e-4)
+
+
+@pytest.mark.parametrize('change',[lambda model: model.setTa(model.Ta[0]),
+                                   lambda model: model.setMet(model.met),
+                                   lambda model: model.setRelativeHumidity(model.relativeHumdity),
+                                   lambda model: model.setClothingModel(model.clothingModel)],
+                         ids=['Ta','met','rh','clothing'])
+def testParameterEpochChangeRestartsTheIntegration(change):
+    model = createModel(None,40.0,1.5,0.5,0.2)
+    restarts = countInitializations(model)
+    for _ in range(5):
+        model.solve(360.0)
+    assert restarts[0] == 1
+    epoch = model.parameterEpoch
+    change(model)
+    assert model.parameterEpoch > epoch
+    state,time = model.getState(),model.simulationTime
+    for _ in range(5):
+        model.solve(360.0)
+    assert restarts[0] == 2
+    #The restarted integration is that of a model started from the state at the change
+    fresh = createModel(None,40.0,1.5,0.5,0.2)
+    fresh.setInitialConditions(state)
+    fresh.simulationTime = time
+    fresh.solve(1800.0)
+    assert np.allclose(model.getState(),fresh.getState(),rtol=1e-12,atol=1e-12)
+
+
+def testStatesAreSampledAtTheOutputTimes():
+    '''
+    solve integrates straight to the requested times, the integrator chooses its steps and the states are sampled
+    from its dense output
+    '''
+    model = createModel(None,40.0,1.5,0.5,0.2)
+    model.solve(120.0)
+    times = [0.0,1.0,10.0,75.0,600.0,1800.0]
+    states = model.solve(times,True)
+    assert states.shape == (len(times)-1,model.getState().shape[0])
+    #Times are relative to the end of the previous solve
+    assert model.simulationTime == pytest.approx(1920.0)
+    assert np.array_equal(states[-1],model.getState())
+    #Far fewer steps than seconds simulated, and the output times do not add steps
+    single = createModel(None,40.0,1.5,0.5,0.2)
+    single.solve(1920.0)
+    assert model.getIntegratorStatistics()['nsteps'] == single.getIntegratorStatistics()['nsteps']
+    assert model.getIntegratorStatistics()['nsteps'] < 200
+    #Each sample agrees with a tightly integrated model stopped at that time
+    for t,state in zip(times[1:],states):
+        reference = createModel(None,40.0,1.5,0.5,0.2)
+        reference.setIntegrator('bdf',rtol=1e-10,atol=1e-12)
+        reference.solve(120.0+t)
+        assert np.allclose(state,reference.getState(),rtol=0,atol=1e-4)
+    #Without storeIntermediateStates only the final state is kept
+    assert model.solve(np.array([0.0,30.0,60.0])) is None
+    assert model.simulationTime == pytest.approx(1980.0)
@@ -0,0 +1,130 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import os
+import numpy as np
+import pytest
+from conftest import createModel, activitiesDirectory
+from abics.run import loadHumanModel
+from support.SimulationCore import Simulator
+
+steadyConditions = [(30.0,1.0,0.4,0.1),(15.0,1.5,0.5,0.5),(40.0,2.0,0.3,0.2),(10.0,0.8,0.4,1.0)]
+
+
+@pytest.mark.parametrize('conditions',steadyConditions)
+def testSteadyStateMatchesLongTransient(conditions):
+    model = createModel(None,*conditions)
+    state = model.solveSteadyState()
+    assert np.max(np.abs(model.dTbydt(state))) < 1e-8
+    assert np.array_equal(model.getState(),state)
+    reference = createModel(None,*conditions)
+    reference.setIntegrator('bdf',rtol=1e-10,atol=1e-12)
+    reference.solve(5*3600.0)
+    assert np.max(np.abs(state - reference.getState())) < 1e-10
+    #The model time is not changed
+    assert model.simulationTime == 0.0
+
+
+def testSteadyStateOfProjectedMesh(femaleMesh):
+    model = createModel(femaleMesh,25.0,1.2,0.5,0.2)
+    state = model.solveSteadyState()
+    assert np.max(np.abs(model.dTbydt(state))) < 1e-8
+    #A steady state is its own starting guess
+    assert np.array_equal(model.solveSteadyState(state),state)
+    assert model.steadyStateIterations == 0
+
+
+def testSteadyStateFailureKeepsTheState():
+    model = createModel(None,*steadyConditions[2])
+    initial = model.getState().copy()
+    with pytest.raises(RuntimeError):
+        model.solveSteadyState(maxIterations=2)
+    assert np.array_equal(model.getState(),initial)
+
+
+def simulatorActivities(steadyStates,temperatures=(35.0,20.0,40.0)):
+    activities = {'activityname':'steady'}
+    for i,(steadyState,Tab) in enumerate(zip(steadyStates,temperatures)):
+        activities[i] = {'clothingFile':os.path.join(activitiesDirectory,'clothing.json'),'radiationFluxFile':'',
+                         'metabolicActivity':1.2,'Tab':Tab,'duration':30.0,'velocityOfAir':0.2,'rh':40.0,'id':i,
+                         'steadyState':steadyState}
+    return activities
+
+
+def runActivities(activities,stopConditions=None):
+    simulator = Simulator()
+    simulator.setup(activities,loadHumanModel(None),False,5,stopConditions=stopConditions)
+    times = []
+    while simulator.currentTimeIndex < simulator.numActivities and not simulator.isStopped():
+        simulator.run()
+        assert simulator.setupError is None
+        simulator.currentTimeIndex += 1
+        data = simulator.getSimulationResults()
+        times.append((simulator.trModel.simulationTime,data.timeValue[simulator.getNumberOfCompletedSamples()-1]))
+    return simulator,times
+
+
+def testSteadyStateActivitiesAdvanceTheModelTime():
+    simulator,times = runActivities(simulatorActivities([True,False,True]))
+    #The model time agrees with the recorded times after every activity
+    for modelTime,recordedTime in times:
+        assert modelTime == pytest.approx(recordedTime,abs=1e-9)
+    assert times[-1][0] == pytest.approx(3*30*60.0)
+    data = simulator.getSimulationResults()
+    assert np.allclose(np.diff(data.timeValue),360.0)
+    #The transient activity starts from the equilibrium of the first one
+    model = createModel(None,35.0,1.2,0.4,0.2)
+    model.solveSteadyState()
+    steady = model.getRectalTemperature()
+    assert np.allclose(data.rectalTemperature[:5],steady,rtol=0,atol=1e-10)
+    model.setTa(20.0)
+    model.solve(360.0)
+    assert data.rectalTemperature[5] == pytest.approx(model.getRectalTemperature(),abs=1e-6)
+
+
+def testSteadyStateActivityStops():
+    '''
+    A condition crossed on the way to the equilibrium stops the simulation at the first sample of the activity
+    '''
+    stopConditions = [{'type':'rectalTemperature','threshold':37.1}]
+    simulator,_ = runActivities(simulatorActivities([False,False,True]),stopConditions)
+    data = simulator.getSimulationResults()
+    assert data.stopTime == pytest.approx(2*30*60.0+360.0)
+    assert data.stopReason == 'Rectal temperature exceeded 37.1'
+    assert data.numberOfTimeSamples == 11
+    assert data.rectalTemperature[-1] > 37.1 and np.all(data.rectalTemperature[:-1] < 37.1)
+    assert simulator.trModel.simulationTime == pytest.approx(data.stopTime)
@@ -0,0 +1,154 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import os
+import numpy as np
+import pytest
+from conftest import createModel, activitiesDirectory
+from thermoregulation.StopConditions import createStopCondition
+from thermoregulation.Tanabe65MNEnsemble import Tanabe65MNEnsemble
+
+
+def conditionValue(model,state,condition):
+    model.setState(state)
+    model.updateDerivedQuantities()
+    return condition.value(model)
+
+
+def crossingInterval(conditions,definition,integrator,duration=20.0,interval=0.01):
+    '''
+    Times of the samples (interval apart) between which the condition is first crossed, integrating without stop conditions
+    '''
+    model = createModel(None,*conditions)
+    model.setIntegrator(integrator)
+    condition = createStopCondition(definition)
+    times = np.arange(interval,duration+interval,interval)
+    states = model.solve(times,True)
+    initial = conditionValue(model,model.getState(),condition)
+    values = np.array([initial]+[conditionValue(model,s,condition) for s in states]) - condition.threshold
+    if condition.direction > 0:
+        crossed = np.flatnonzero((values[:-1] < 0) & (values[1:] >= 0))
+    else:
+        crossed = np.flatnonzero((values[:-1] > 0) & (values[1:] <= 0))
+    assert crossed.shape[0] > 0
+    times = np.concatenate([[0.0],times])
+    return times[crossed[0]],times[crossed[0]+1]
+
+
+stopCases = [((48.0,1.5,0.4,0.1),{'type':'rectalTemperature','threshold':38.0}),
+             ((43.0,2.0,0.6,0.1),{'type':'coreTemperature','threshold':37.5}),
+             ((35.0,1.2,0.5,0.1),{'type':'skinWettedness','threshold':0.23}),
+             ((43.0,2.0,0.6,0.1),{'type':'pmv','threshold':3.0}),
+             ((10.0,0.8,0.4,1.0),{'type':'coreTemperature','threshold':33.0,'direction':-1})]
+
+
+@pytest.mark.parametrize('integrator',['bdf','radau','lsoda','implicit-euler'])
+@pytest.mark.parametrize('conditions,definition',stopCases)
+def testStopTimeIsAtTheCrossing(conditions,definition,integrator):
+    model = createModel(None,*conditions)
+    model.setIntegrator(integrator)
+    model.setStopConditions([definition])
+    states = model.solve(np.arange(0.5,20.1,0.5),True)
+    assert model.isStopped()
+    start,end = crossingInterval(conditions,definition,integrator)
+    #The crossing located by the integrator lies between the samples that bracket it
+    assert start - 1e-4 <= model.stopTime <= end + 1e-4
+    condition = model.getStopConditions()[0]
+    assert abs(conditionValue(model,model.getState(),condition) - condition.threshold) < 1e-4*max(1.0,abs(condition.threshold))
+    assert model.stopReason == condition.getReason()
+    assert model.simulationTime == model.stopTime
+    #The states are returned up to the crossing, the last one being the state at the crossing
+    assert states.shape[0] == int(np.ceil(model.stopTime/0.5))
+    assert np.array_equal(states[-1],model.getState())
+
+
+def testFirstOfSeveralConditionsStops():
+    definitions = [{'type':'rectalTemperature','threshold':38.5},{'type':'rectalTemperature','threshold':38.0}]
+    model = createModel(None,48.0,1.5,0.4,0.1)
+    model.setStopConditions(definitions)
+    model.solve(60.0)
+    reference = createModel(None,48.0,1.5,0.4,0.1)
+    reference.setStopConditions(definitions[1:])
+    reference.solve(60.0)
+    assert model.stopReason == 'Rectal temperature exceeded 38'
+    assert abs(model.stopTime - reference.stopTime) < 1e-4
+
+
+def testSimulatorTruncatesResults():
+    from abics.run import loadActivities, loadHumanModel
+    from support.SimulationCore import Simulator
+    simulator = Simulator()
+    simulator.setup(loadActivities(os.path.join(activitiesDirectory,'activities_figa.json')),loadHumanModel(None),False,10,\
+                    stopConditions=[{'type':'rectalTemperature','threshold':36.5,'direction':-1}])
+    while simulator.currentTimeIndex < simulator.numActivities and not simulator.isStopped():
+        simulator.run()
+        assert simulator.setupError is None
+        simulator.currentTimeIndex += 1
+    data = simulator.getSimulationResults()
+    #The body cools down during the second activity (3600s to 7200s)
+    assert data.stopTime is not None and 3600.0 < data.stopTime < 7200.0
+    assert data.stopReason == 'Rectal temperature fell below 36.5'
+    assert data.timeValue[-1] == pytest.approx(data.stopTime)
+    assert data.rectalTemperature[-1] == pytest.approx(36.5,abs=1e-4)
+    assert np.all(np.asarray(data.rectalTemperature[:-1]) > 36.5)
+
+
+def testEnsembleRecordsMemberCrossings():
+    memberConditions = [(45.0,1.0,0.4,0.1),(48.0,1.5,0.4,0.1),(42.0,2.0,0.4,0.1),(45.0,1.0,0.4,0.1),(25.0,1.0,0.4,0.1)]
+    definitions = [{'type':'rectalTemperature','threshold':37.2}]
+    single = []
+    for conditions in memberConditions:
+        model = createModel(None,*conditions)
+        model.setStopConditions(definitions)
+        model.solve(60.0)
+        single.append(model.stopTime)
+    ensemble = Tanabe65MNEnsemble([createModel(None,*conditions) for conditions in memberConditions])
+    ensemble.setStopConditions(definitions)
+    ensemble.solve(60.0)
+    #The member at 25C does not warm up to the threshold, the ensemble runs to the end
+    assert single[-1] is None and np.isnan(ensemble.memberStopTimes[-1]) and ensemble.memberStopReasons[-1] is None
+    assert not ensemble.isStopped() and ensemble.simulationTime == 60.0
+    assert np.allclose(ensemble.memberStopTimes[:-1],single[:-1],rtol=0,atol=1e-4)
+    #Identical members cross together
+    assert ensemble.memberStopTimes[0] == ensemble.memberStopTimes[3]
+    assert ensemble.memberStopReasons[0] == 'Rectal temperature exceeded 37.2'
+
+    ensemble = Tanabe65MNEnsemble([createModel(None,*conditions) for conditions in memberConditions[:-1]])
+    ensemble.setStopConditions(definitions)
+    ensemble.solve(60.0)
+    assert ensemble.isStopped() and ensemble.stopTime == pytest.approx(max(single[:-1]),abs=1e-4)
+    assert ensemble.simulationTime == ensemble.stopTime
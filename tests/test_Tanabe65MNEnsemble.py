@@ -0,0 +1,120 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import numpy as np
+import pytest
+from conftest import createModel
+from thermoregulation.Tanabe65MNEnsemble import Tanabe65MNEnsemble
+from thermoregulation.BoundaryConditions import BoundaryConditionSchedule
+
+numberOfMembers = 50
+
+
+def memberConditions(count=numberOfMembers,seed=3):
+    '''
+    (Ta, met, rh, velocity of air) of each member
+    '''
+    random = np.random.RandomState(seed)
+    return [(random.uniform(15,45),random.uniform(0.8,2.5),random.uniform(0.2,0.8),random.uniform(0.1,1.0)) for _ in range(count)]
+
+
+@pytest.fixture(scope='module')
+def singleRuns():
+    models = []
+    for conditions in memberConditions():
+        model = createModel(None,*conditions)
+        model.setIntegrator('bdf',rtol=1e-10,atol=1e-12)
+        model.solve(600.0)
+        models.append(model)
+    return models
+
+
+@pytest.fixture(scope='module')
+def ensembleRun():
+    ensemble = Tanabe65MNEnsemble([createModel(None,*conditions) for conditions in memberConditions()])
+    ensemble.setIntegrator('bdf',rtol=1e-10,atol=1e-12)
+    ensemble.solve(600.0)
+    return ensemble
+
+
+def testEnsembleMatchesSingleRuns(singleRuns,ensembleRun):
+    expected = np.concatenate([model.getState() for model in singleRuns])
+    assert np.max(np.abs(ensembleRun.getState() - expected)) < 1e-9
+    assert np.allclose(ensembleRun.getMeanSkinTemperature(),[m.getMeanSkinTemperature() for m in singleRuns],rtol=0,atol=1e-9)
+    assert np.allclose(ensembleRun.getRectalTemperature(),[m.getRectalTemperature() for m in singleRuns],rtol=0,atol=1e-9)
+    
+    
+def testEnsembleMembersMatchSingleRuns(singleRuns,ensembleRun):
+    pmv,ppd,sensation = ensembleRun.ZhangPMVPPD()
+    for k in [0,17,numberOfMembers-1]:
+        member = ensembleRun.getMember(k)
+        assert np.allclose(member.getSkinWettedness(),singleRuns[k].getSkinWettedness(),rtol=0,atol=1e-9)
+        assert abs(pmv[k] - singleRuns[k].ZhangPMVPPD()[0]) < 1e-6
+        
+        
+def testEnsembleJacobianIsBlockDiagonal():
+    conditions = memberConditions(3)
+    ensemble = Tanabe65MNEnsemble([createModel(None,*c) for c in conditions])
+    state = ensemble.getInitialConditions() + 0.3
+    jacobian = ensemble.dTbydtJacobian(state).toarray()
+    n = ensemble.jacobianBlockSize
+    for k,c in enumerate(conditions):
+        model = createModel(None,*c)
+        block = model.dTbydtJacobian(state[k*n:(k+1)*n],True).toarray()
+        assert np.allclose(jacobian[k*n:(k+1)*n,k*n:(k+1)*n],block,rtol=1e-12,atol=1e-14)
+    assert np.count_nonzero(jacobian) == sum(np.count_nonzero(jacobian[k*n:(k+1)*n,k*n:(k+1)*n]) for k in range(3))
+
+
+def testEnsembleScheduleMatchesSingleRuns():
+    conditions = memberConditions(3,seed=5)
+    schedule = BoundaryConditionSchedule([0.0,60.0,120.0,300.0],Tab=[20.0,38.0,38.0,25.0],rh=[0.3,0.6,0.6,0.4],\
+                                         velocityOfAir=[0.1,0.8,0.8,0.2])
+    expected = []
+    for c in conditions:
+        model = createModel(None,*c)
+        model.setIntegrator('bdf',rtol=1e-10,atol=1e-12)
+        model.solve(30.0)
+        model.setBoundaryConditionSchedule(schedule)
+        model.solve(400.0)
+        expected.append(model.getState())
+    ensemble = Tanabe65MNEnsemble([createModel(None,*c) for c in conditions])
+    ensemble.setIntegrator('bdf',rtol=1e-10,atol=1e-12)
+    ensemble.solve(30.0)
+    #Schedule times are relative to the time at which it is set
+    ensemble.setBoundaryConditionSchedule(schedule)
+    ensemble.solve(400.0)
+    assert np.max(np.abs(ensemble.getState() - np.concatenate(expected))) < 1e-9
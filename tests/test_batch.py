@@ -0,0 +1,129 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import csv
+import json
+import os
+import numpy as np
+import pytest
+from conftest import activitiesDirectory, meshesDirectory
+from abics.batch import main
+import abics.run
+
+
+def writeActivities(filename,Tab=35.0,radiationFluxFile=''):
+    activities = {'activityname':os.path.basename(filename)}
+    for i,T in enumerate([Tab,20.0]):
+        activities[str(i)] = {'clothingFile':os.path.join(activitiesDirectory,'clothing.json'),'description':'Activity %d'%i,
+                              'radiationFluxFile':radiationFluxFile,'metabolicActivity':1.2,'Tab':T,
+                              'duration':30.0,'velocityOfAir':0.2,'rh':40.0,'id':i}
+    with open(filename,'w') as ser:
+        json.dump(activities,ser)
+    return filename
+
+
+def readSummary(directory):
+    with open(os.path.join(directory,'summary.csv'),'r') as ser:
+        return list(csv.DictReader(ser))
+
+
+@pytest.mark.parametrize('workers',['1','2'])
+def testBatchOfActivityFiles(tmp_path,workers):
+    inputs = tmp_path/'inputs'
+    inputs.mkdir()
+    hot = writeActivities(str(inputs/'hot.json'),40.0)
+    writeActivities(str(inputs/'warm.json'),30.0)
+    #Clothing definitions in the same directory are not cases
+    with open(str(inputs/'clothing.json'),'w') as ser:
+        json.dump({'name':'clothing'},ser)
+    out = str(tmp_path/'out')
+    assert main([str(inputs),os.path.join(activitiesDirectory,'activities_figa.json'),'-o',out,'-w',workers]) == 0
+    summary = readSummary(out)
+    assert [row['name'] for row in summary] == ['hot','warm','activities_figa']
+    assert all(row['status'] == 'completed' for row in summary)
+    for row in summary:
+        assert os.path.exists(row['results'])
+    #The results of a case are those of the headless runner
+    single = str(tmp_path/'hot.npz')
+    assert abics.run.main([hot,'-o',single]) == 0
+    expected = np.load(single)
+    results = np.load(os.path.join(out,'hot.npz'))
+    for name in ['timeValue','rectalTemperature','meanSkinTemperature','skinTemperature']:
+        assert np.array_equal(results[name],expected[name])
+    assert float(summary[0]['rectalTemperature']) == pytest.approx(expected['rectalTemperature'][-1],rel=1e-12)
+    assert float(summary[0]['simulatedTime']) == pytest.approx(3600.0)
+
+
+def testManifestAndBodies(tmp_path):
+    writeActivities(str(tmp_path/'hot.json'),40.0)
+    manifest = str(tmp_path/'manifest.json')
+    with open(manifest,'w') as ser:
+        json.dump({'cases':[{'name':'hot','activities':'hot.json'},{'name':'hot','activities':'hot.json','substeps':5}]},ser)
+    bodies = str(tmp_path/'bodies.json')
+    with open(bodies,'w') as ser:
+        json.dump([{'name':'f30','gender':'female','age':30},{'name':'m60','gender':'male','age':60,'weight':90.0}],ser)
+    out = str(tmp_path/'out')
+    assert main([manifest,'-b',bodies,'-o',out,'-w','2']) == 0
+    summary = readSummary(out)
+    #Repeated names are made unique as they name the result files
+    assert [row['name'] for row in summary] == ['hot_f30','hot_m60','hot_f30_1','hot_m60_1']
+    assert [row['gender'] for row in summary] == ['female','male','female','male']
+    assert all(row['status'] == 'completed' for row in summary)
+    assert np.load(os.path.join(out,'hot_f30_1.npz'))['timeValue'].shape == (10,)
+    assert float(summary[0]['rectalTemperature']) != float(summary[1]['rectalTemperature'])
+
+
+def testFailedCasesAreReported(tmp_path):
+    good = writeActivities(str(tmp_path/'good.json'))
+    #Per face fluxes require the mesh they were computed for
+    bad = writeActivities(str(tmp_path/'bad.json'),radiationFluxFile=os.path.join(activitiesDirectory,'radiation.json'))
+    out = str(tmp_path/'out')
+    assert main([good,bad,'-o',out,'-w','2']) == 2
+    summary = readSummary(out)
+    assert [row['status'] for row in summary] == ['completed','failed']
+    assert 'per face fluxes' in summary[1]['message']
+    assert not os.path.exists(os.path.join(out,'bad.npz'))
+
+
+def testProjectedCasesWithRadiation(tmp_path):
+    radiation = writeActivities(str(tmp_path/'radiation.json'),radiationFluxFile=os.path.join(activitiesDirectory,'radiation.json'))
+    plain = writeActivities(str(tmp_path/'plain.json'))
+    out = str(tmp_path/'out')
+    assert main([radiation,plain,'-m',os.path.join(meshesDirectory,'female.obj'),'-o',out,'-w','2']) == 0
+    summary = readSummary(out)
+    assert all(row['status'] == 'completed' for row in summary)
+    assert float(summary[0]['meanSkinTemperature']) > float(summary[1]['meanSkinTemperature'])
@@ -0,0 +1,179 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import os
+import numpy as np
+import pytest
+from conftest import createModel, activitiesDirectory
+
+
+def referenceDTbydt(model,temp):
+    '''
+    dTbydt as computed before the work buffers and the activity invariant terms were introduced, a new array for
+    every term
+    '''
+    temperature = np.reshape(temp[0:-1], (-1,4))
+    cbcTemp = temp[-1]
+    Err = temperature - model.setPointTemperature
+    Wrm = np.array(Err,copy=True)
+    Cld = -np.array(Err,copy=True)
+    Wrm[Err<0] = 0
+    Cld[Err>0] = 0
+    Wrms = np.sum(model.SKINR_norm*Wrm[:,3])
+    Clds = np.sum(model.SKINR_norm*Cld[:,3])
+    e11 = np.sum(Err[model.headDofs,0]*model.headSurfaceFactors)
+    Wrm11 = max(e11,0)
+    Cld11 = max(-e11,0)
+    Ch = np.zeros(temperature.shape)
+    Ch[:,1] = (-model.Cch*e11-model.Sch*(Wrms-Clds) + model.Pch*Cld11*Clds)*model.chit
+    Ch[Ch<0] = 0
+    DL = max(model.Cdl*e11+model.Sdl*(Wrms-Clds) + model.Pdl*Wrm11*Wrms,0)
+    ST = max(-model.Cst*e11-model.Sst*(Wrms-Clds) + model.Pst*Cld11*Clds,0)
+    km = np.power(2.0,Err[:,3]/10)
+    Esw = (model.Csw*e11 + model.Ssw*(Wrms-Clds) + model.Psw*Wrm11*Wrms)*model.SKINS*km
+    Qij = model.metabolicRate + model.W + Ch
+    
+    BFS = (model.basalBloodFlow +(model.W + Ch)/1.16)
+    BFS[:,3] = km*(model.basalBloodFlow[:,3] + model.SKINV*DL)/(1.0+model.SKINC*ST)
+    BF = model.alpha*model.rhoC*BFS*(temperature - cbcTemp)
+    D  = model.thermalConductance*(temperature[:,0:3]-temperature[:,1:])
+    Qt = (temperature[:,3]-model.To)*model.hc*model.bodySurfaceArea
+    Psk = 0.61078*np.exp(17.625*temperature[:,3]/(temperature[:,3]+237.3))
+    Pa  = model.relativeHumdity*0.61078*np.exp(17.625*model.Ta/(model.Ta+237.3))
+    Emax = model.emaxFactor*(Psk-Pa)*model.bodySurfaceArea/model.lhm
+    Emax[Emax<0] = 0.0
+    Esw[Esw<0] = 0.0
+    E = model.eswScaleFactor*(Emax-Esw) + Esw
+    ix = E>Esw
+    E[ix] = Esw[ix]
+    dT = np.zeros(temperature.shape)
+    dT[:,0] = Qij[:,0] - BF[:,0] - D[:,0]
+    dT[:,1] = Qij[:,1] - BF[:,1] + D[:,0] - D[:,1]
+    dT[:,2] = Qij[:,2] - BF[:,2] + D[:,1] - D[:,2]
+    dT[:,3] = Qij[:,3] - BF[:,3] + D[:,2] - Qt - E + model.radiationHeatFlux[:,0]
+    
+    headDofs,chestDofs,area = model.headDofs,model.chestDofs,model.bodySurfaceArea
+    ta = np.sum(model.Ta[headDofs]*area[headDofs])/np.sum(area[headDofs])
+    ta = 0.5*(ta + np.sum(model.Ta[chestDofs]*area[chestDofs])/np.sum(area[chestDofs]))
+    pa = model.relativeHumdity*0.61078*np.exp(17.625*ta/(ta+237.3))
+    dT[chestDofs,0] -= (0.0014*(34-ta)+0.017*(5.867-pa))*(np.sum(np.sum(Qij)))
+    result = np.zeros(temp.shape)
+    result[0:-1] = np.reshape(dT/model.heatCapacity,(-1,1))[:,0]
+    result[-1] = np.sum(np.sum(BF))/model.cbcheatCapacity
+    return result
+
+
+def perturbedStates(model,count=5,seed=7):
+    '''
+    The initial state and states around it that switch the sweating, shivering and vasomotion terms on and off
+    '''
+    random = np.random.RandomState(seed)
+    state = model.getInitialConditions()
+    return [state] + [state + random.uniform(-3.0,3.0,state.shape) for _ in range(count)]
+
+
+@pytest.mark.parametrize('Ta,met,rh,velocityOfAir',[(30.0,1.0,0.4,0.1),(17.0,1.2,0.3,1.0),(43.0,2.0,0.6,0.1)])
+def testStandardModelMatchesReference(Ta,met,rh,velocityOfAir):
+    model = createModel(None,Ta,met,rh,velocityOfAir)
+    for state in perturbedStates(model):
+        assert np.array_equal(np.array(model.dTbydt(state)),referenceDTbydt(model,state))
+
+
+def testProjectedModelWithRadiationMatchesReference(femaleMesh):
+    from support.Interfaces import loadRadiationModel
+    model = createModel(femaleMesh,35.0,1.0,0.5,0.3)
+    model.setRadiationFlux(loadRadiationModel(os.path.join(activitiesDirectory,'radiation.json')))
+    for state in perturbedStates(model):
+        assert np.array_equal(np.array(model.dTbydt(state)),referenceDTbydt(model,state))
+        
+        
+def testBoundaryConditionChangesAreSeen():
+    #The cached invariant terms are recomputed when a setter changes the boundary conditions
+    model = createModel(None,30.0)
+    state = model.getInitialConditions()
+    model.dTbydt(state)
+    model.setTa(40.0)
+    model.setRelativeHumidity(0.8)
+    assert np.array_equal(np.array(model.dTbydt(state)),referenceDTbydt(model,state))
+
+
+
+def setRadiationFlux(model):
+    from support.Interfaces import loadRadiationModel
+    model.setRadiationFlux(loadRadiationModel(os.path.join(activitiesDirectory,'radiation.json')))
+
+
+def setClothingModel(model):
+    from support.Interfaces import loadClothingModel
+    model.setClothingModel(loadClothingModel(os.path.join(activitiesDirectory,'noclothing.json')))
+
+
+def setBoundaryConditionSchedule(model):
+    from thermoregulation.BoundaryConditions import BoundaryConditionSchedule
+    model.setBoundaryConditionSchedule(BoundaryConditionSchedule([0.0,600.0],Tab=[25.0,45.0],rh=[0.3,0.9]))
+    model.updateBoundaryConditions(model.simulationTime+300.0)
+
+
+@pytest.mark.parametrize('change',[lambda model: model.setTa(40.0),
+                                   lambda model: model.setRelativeHumidity(0.8),
+                                   lambda model: model.setMet(2.0),
+                                   setClothingModel,
+                                   setRadiationFlux,
+                                   setBoundaryConditionSchedule],
+                         ids=['Ta','rh','met','clothing','radiation','schedule'])
+def testEverySetterInvalidatesTheInvariantTerms(femaleMesh,change):
+    model = createModel(femaleMesh,30.0,1.0,0.4,0.2)
+    state = model.getInitialConditions()
+    model.dTbydt(state)
+    epoch = model.parameterEpoch
+    assert model.invariantTermsEpoch == epoch
+    change(model)
+    assert model.parameterEpoch > epoch
+    assert np.array_equal(np.array(model.dTbydt(state)),referenceDTbydt(model,state))
+    assert model.invariantTermsEpoch == model.parameterEpoch
+
+
+def testInvariantTermsAreKeptWithinAnEpoch():
+    #Changes that bypass the setters are not seen until the epoch changes
+    model = createModel(None,30.0)
+    state = model.getInitialConditions()
+    model.dTbydt(state)
+    model.Ta.fill(40.0)
+    model.relativeHumdity = 0.8
+    assert not np.array_equal(np.array(model.dTbydt(state)),referenceDTbydt(model,state))
+    model.parametersChanged()
+    assert np.array_equal(np.array(model.dTbydt(state)),referenceDTbydt(model,state))
@@ -0,0 +1,163 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import json
+import logging
+import os
+import signal
+import numpy as np
+import pytest
+from conftest import activitiesDirectory, meshesDirectory
+from abics.run import main, loadActivities
+from support.Schedules import ActivitySchedule
+from support.SimulationCore import SimulationData
+
+
+@pytest.fixture(autouse=True)
+def restoreSignalHandler():
+    #main installs a SIGTERM handler to checkpoint on pre-emption
+    handler = signal.getsignal(signal.SIGTERM)
+    yield
+    signal.signal(signal.SIGTERM,handler)
+
+
+def writeActivities(directory,radiationFluxFile='',clothingFile='clothing.json'):
+    '''
+    Activity file in the format saved by the activity wizard, a warm and a cool activity
+    '''
+    activities = {'activityname':'test'}
+    for i,(Tab,duration) in enumerate([(35.0,30.0),(20.0,30.0)]):
+        activities[str(i)] = {'clothingFile':os.path.join(activitiesDirectory,clothingFile),'description':'Activity %d'%i,
+                              'radiationFluxFile':radiationFluxFile,'metabolicActivity':1.2,'Tab':Tab,
+                              'duration':duration,'velocityOfAir':0.2,'rh':40.0,'id':i}
+    filename = os.path.join(str(directory),'activities.json')
+    with open(filename,'w') as ser:
+        json.dump(activities,ser)
+    return filename
+
+
+def testRunWithoutMesh(tmp_path):
+    out = str(tmp_path/'results.npz')
+    assert main([os.path.join(activitiesDirectory,'activities_figa.json'),'-o',out]) == 0
+    results = np.load(out)
+    assert results['timeValue'].shape == (30,)
+    assert results['timeValue'][-1] == pytest.approx(4*3600.0)
+    assert np.all(np.isfinite(results['rectalTemperature']))
+    assert results['skinTemperature'].shape == (16,30)
+    assert results['segmentSkinTemperature'].shape[1] == 30
+    assert not 'stopTime' in results
+    
+    
+def testResultFileOutput(tmp_path):
+    activities = writeActivities(tmp_path)
+    npz = str(tmp_path/'results.npz')
+    abr = str(tmp_path/'results.abr')
+    assert main([activities,'-o',npz,'--stride','3']) == 0
+    assert main([activities,'-o',abr,'--stride','3']) == 0
+    expected = np.load(npz)
+    data = SimulationData.load(abr)
+    assert data.recordingStride == 3
+    for name in data.seriesNames:
+        assert np.array_equal(getattr(data,name),expected[name])
+    assert np.array_equal(np.asarray(data.skinTemperature),expected['skinTemperature'])
+    assert np.array_equal(data.getFieldTimeValues(),expected['fieldTimeValue'])
+
+
+def testProjectedRunWithRadiation(tmp_path):
+    '''
+    Per face radiation of the mesh is aggregated to the 16 segments of the projected simulation
+    '''
+    mesh = os.path.join(meshesDirectory,'female.obj')
+    withRadiation = str(tmp_path/'radiation.npz')
+    withoutRadiation = str(tmp_path/'noradiation.npz')
+    radiation = tmp_path/'radiation'
+    radiation.mkdir()
+    assert main([writeActivities(radiation,os.path.join(activitiesDirectory,'radiation.json')),mesh,'-o',withRadiation]) == 0
+    assert main([writeActivities(tmp_path),mesh,'-o',withoutRadiation]) == 0
+    results = np.load(withRadiation)
+    reference = np.load(withoutRadiation)
+    assert results['timeValue'].shape == (20,)
+    assert np.all(np.isfinite(results['skinTemperature']))
+    assert results['skinTemperature'].shape[0] == reference['skinTemperature'].shape[0]
+    #The radiant flux warms the skin
+    assert np.all(results['meanSkinTemperature'][1:] > reference['meanSkinTemperature'][1:])
+
+
+def testPerFaceRadiationWithoutMeshIsRejected(tmp_path,caplog):
+    out = str(tmp_path/'results.npz')
+    activities = writeActivities(tmp_path,os.path.join(activitiesDirectory,'radiation.json'))
+    with caplog.at_level(logging.ERROR):
+        assert main([activities,'-o',out]) == 1
+    assert 'per face fluxes' in caplog.text
+    assert not os.path.exists(out)
+
+
+def testMissingRadiationFileIsSkipped(tmp_path,caplog):
+    '''
+    As in the user interface, an activity whose radiation file cannot be found is simulated without radiation flux
+    '''
+    missing = tmp_path/'missing'
+    missing.mkdir()
+    out = str(tmp_path/'results.npz')
+    reference = str(tmp_path/'reference.npz')
+    with caplog.at_level(logging.WARNING):
+        assert main([writeActivities(missing,str(tmp_path/'missing.json')),'-o',out]) == 0
+    assert 'missing.json does not exist' in caplog.text
+    assert main([writeActivities(tmp_path),'-o',reference]) == 0
+    assert np.array_equal(np.load(out)['skinTemperature'],np.load(reference)['skinTemperature'])
+
+
+def testMovedRadiationFileIsFoundByName(tmp_path,caplog):
+    '''
+    The example activities refer to radiation.json relative to the directory the user interface ran in
+    '''
+    filename = os.path.join(activitiesDirectory,'activities.json')
+    schedule = ActivitySchedule.fromActivities(loadActivities(filename))
+    assert schedule.radiationFiles == [os.path.join(activitiesDirectory,'radiation.json')]
+    assert list(schedule.entries['radiation']) == [0,-1,0,0]
+    #The fluxes are per face of the female mesh, they cannot be applied to the standard body
+    with caplog.at_level(logging.ERROR):
+        assert main([filename,'-o',str(tmp_path/'results.npz')]) == 1
+    assert 'per face fluxes' in caplog.text
+
+
+def testDenseJacobianIntegratorIsRefusedForFullMesh(tmp_path,caplog):
+    out = str(tmp_path/'results.npz')
+    with caplog.at_level(logging.ERROR):
+        assert main([writeActivities(tmp_path),os.path.join(meshesDirectory,'female.obj'),'-o',out,'--full','--integrator','lsoda']) == 1
+    assert 'lsoda integrator assembles a dense jacobian' in caplog.text
+    assert not os.path.exists(out)
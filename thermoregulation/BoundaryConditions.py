@@ -0,0 +1,117 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import numpy as np
+
+
+class BoundaryConditionSchedule(object):
+    '''
+    Piecewise linear time series of the ambient conditions within an activity, evaluated by the model at the
+    integration time of every rhs evaluation (see Tanabe65MNModel.setBoundaryConditionSchedule)
+    times - sample times in seconds from the start of the activity (increasing)
+    series - any of Tab (C), rh (fraction), velocityOfAir (m/s) and metabolicActivity (met), one value per sample time
+    Values are held constant before the first and after the last sample time
+    '''
+    seriesNames = ['Tab','rh','velocityOfAir','metabolicActivity']
+    
+    def __init__(self,times,**series):
+        self.times = np.asarray(times,dtype=np.float64)
+        if self.times.ndim != 1 or self.times.shape[0] == 0:
+            raise ValueError('Schedule times should be a non empty list of values')
+        if np.any(np.diff(self.times) <= 0):
+            raise ValueError('Schedule times should be increasing')
+        self.series = dict()
+        for name,values in series.items():
+            if name not in self.seriesNames:
+                raise ValueError('Unknown schedule series %s, supported series are %s'%(name,', '.join(self.seriesNames)))
+            values = np.asarray(values,dtype=np.float64)
+            if values.shape != self.times.shape:
+                raise ValueError('Schedule series %s has %d values for %d times'%(name,values.shape[0],self.times.shape[0]))
+            self.series[name] = values
+    
+    @classmethod
+    def fromActivitySeries(cls,timeSeries):
+        '''
+        Create a schedule from an activity's timeSeries entry, which uses the activity units:
+        {'time':[minutes from the start of the activity], 'Tab':[C], 'rh':[%], 'velocityOfAir':[m/s], 'metabolicActivity':[met]}
+        '''
+        series = dict()
+        for name in cls.seriesNames:
+            if name in timeSeries:
+                series[name] = np.asarray(timeSeries[name],dtype=np.float64)
+        if 'rh' in series:
+            series['rh'] = series['rh']/100.0 #Convert from %
+        return cls(np.asarray(timeSeries['time'],dtype=np.float64)*60.0,**series)
+    
+    def hasSeries(self,name):
+        return name in self.series
+    
+    def getSeries(self,name):
+        return self.series[name]
+    
+    def getInitialValue(self,name):
+        return self.series[name][0]
+    
+    def getDuration(self):
+        return self.times[-1]
+    
+    def getInterpolationWeights(self,t):
+        '''
+        Returns (i,w) such that the value at t is (1-w)*values[i] + w*values[i+1] (i+1 is clipped to the last sample)
+        '''
+        times = self.times
+        if t <= times[0]:
+            return 0,0.0
+        if t >= times[-1]:
+            return times.shape[0]-1,0.0
+        i = np.searchsorted(times,t,side='right') - 1
+        return i,(t - times[i])/(times[i+1] - times[i])
+    
+    def interpolate(self,values,i,w):
+        '''
+        Interpolate sample values (first axis along time) with weights from getInterpolationWeights
+        '''
+        if w == 0.0:
+            return values[i]
+        return (1.0-w)*values[i] + w*values[i+1]
+    
+    def evaluate(self,t):
+        '''
+        Returns a dict with the value of each series at time t (seconds from the start of the activity)
+        '''
+        i,w = self.getInterpolationWeights(t)
+        return dict((name,self.interpolate(values,i,w)) for name,values in self.series.items())
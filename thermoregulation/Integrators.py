@@ -0,0 +1,653 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import types
+import numpy as np
+from scipy.integrate import BDF, Radau, LSODA, ode
+from scipy.optimize import brentq
+from scipy.sparse.linalg import splu
+from scipy import sparse
+
+
+class LowRankUpdateLU(object):
+    '''
+    Factorisation of A - beta*U*G, where A is sparse and U*G is a low rank (n x k)*(k x n) update
+    A is factorised with a sparse LU, the update is applied through the Sherman-Morrison-Woodbury identity
+    blockSize - when given, A is block diagonal with blocks of this size and the update is block wise:
+                U (n x k) holds the k columns of every block and G is a (numberOfBlocks, k, blockSize) array
+    '''
+    
+    def __init__(self,A,U,G,beta=1.0,blockSize=None):
+        if blockSize is None:
+            self.LU = splu(sparse.csc_matrix(A))
+        else:
+            #Blocks are coupled to their last unknown (blood compartment), the natural ordering does not fill in
+            self.LU = splu(sparse.csc_matrix(A),permc_spec='NATURAL')
+        self.G = G
+        self.blockSize = blockSize
+        self.rank = U.shape[1]
+        if self.rank > 0:
+            self.Z = self.LU.solve(beta*U.astype(self.LU.U.dtype))
+            if blockSize is None:
+                self.S = np.identity(self.rank) - G.dot(self.Z)
+            else:
+                self.Z = np.reshape(self.Z,(-1,blockSize,self.rank))
+                self.S = np.identity(self.rank) - np.matmul(G,self.Z)
+        
+    def solve(self,b):
+        x = self.LU.solve(b)
+        if self.rank == 0:
+            return x
+        if self.blockSize is None:
+            return x + self.Z.dot(np.linalg.solve(self.S,self.G.dot(x)))
+        xb = np.reshape(x,(-1,self.blockSize,1))
+        w = np.linalg.solve(self.S,np.matmul(self.G,xb))
+        return x + np.reshape(np.matmul(self.Z,w),x.shape)
+
+
+class CoupledJacobianBDF(BDF):
+    '''
+    scipy BDF solver for systems whose jacobian is a sparse matrix plus a low rank update, J = L + U*G
+    jacobianFactors(t,y) should return L (sparse), U (n x k) and G (sparse, k x n)
+    The newton matrix I - c*J is factorised as the sparse LU of I - c*L and the low rank
+    part is applied through the Sherman-Morrison-Woodbury identity, so J is never assembled
+    '''
+    
+    def __init__(self, fun, t0, y0, t_bound, jacobianFactors, blockSize=None, **kwargs):
+        self.jacobianFactors = jacobianFactors
+        self.newtonScale = None
+        def jac(t,y):
+            self.L,self.U,self.G = self.jacobianFactors(t,y)
+            return self.L
+        super(CoupledJacobianBDF,self).__init__(fun, t0, y0, t_bound, jac=jac, **kwargs)
+        
+        def lu(A):
+            self.nlu += 1
+            self.newtonScale = self.getNewtonScale(A)
+            return LowRankUpdateLU(A,self.U,self.G,self.newtonScale,blockSize)
+        
+        def solve_lu(LU, b):
+            return LU.solve(b)
+        
+        self.lu = lu
+        self.solve_lu = solve_lu
+        
+    def getNewtonScale(self,A):
+        '''
+        Returns c of the newton matrix A = I - c*L, where L is the sparse part of the last jacobian, from the diagonals
+        of A and L. The low rank part has to be factorised with the same c
+        '''
+        dA = 1.0 - np.asarray(A.diagonal())
+        dL = np.asarray(self.L.diagonal())
+        c = np.dot(dA,dL)/np.dot(dL,dL)
+        if not np.allclose(dA,c*dL,rtol=1e-8,atol=1e-12):
+            raise RuntimeError('BDF newton matrix is not of the form I - c*J')
+        return c
+
+
+class CoupledJacobianRadau(Radau):
+    '''
+    scipy Radau IIA solver for jacobians of the form J = L + U*G, see CoupledJacobianBDF
+    The real and complex newton matrices mu*I - J are factorised as sparse LU of mu*I - L with a low rank update
+    '''
+    
+    def __init__(self, fun, t0, y0, t_bound, jacobianFactors, blockSize=None, **kwargs):
+        self.jacobianFactors = jacobianFactors
+        def jac(t,y):
+            L,self.U,self.G = self.jacobianFactors(t,y)
+            return L
+        super(CoupledJacobianRadau,self).__init__(fun, t0, y0, t_bound, jac=jac, **kwargs)
+        
+        def lu(A):
+            self.nlu += 1
+            return LowRankUpdateLU(A,self.U,self.G,1.0,blockSize)
+        
+        def solve_lu(LU, b):
+            return LU.solve(b)
+        
+        self.lu = lu
+        self.solve_lu = solve_lu
+
+
+class ThermoregulationIntegrator(object):
+    '''
+    Base class for the time integration backends of the thermoregulation models
+    A backend integrates a system that provides dTbydt(y), dTbydtJacobianFactors(y) (L,U,G with J = L + U*G),
+    dTbydtJacobian(y), getJacobianSparsity() and jacobianBlockSize (size of the diagonal blocks of L, None if not block diagonal)
+    and updateBoundaryConditions(t), which is called before evaluating the rhs or jacobian at time t
+    rtol, atol - relative and absolute tolerances
+    Subclasses implement initialize(system,t0,y0) and integrate(t) which returns the state at time t
+    Optional events (see setEvents) are located within the steps, integrate stops at the first event
+    '''
+    name = None
+    eventTolerance = 1e-6
+    #Set by backends that assemble the jacobian as a dense matrix, these are limited to small models
+    denseJacobian = False
+    #Set by backends whose pickled state continues the integration exactly where it was left, see isResumable
+    resumable = False
+    
+    def __init__(self,rtol=1e-6,atol=1e-8):
+        self.rtol = rtol
+        self.atol = atol
+        self.system = None
+        self.eventFunction = None
+        self.resetEvents()
+        self.resetStatistics()
+        
+    def getTolerances(self):
+        return self.rtol,self.atol
+    
+    def __getstate__(self):
+        #Backend solvers (scipy ode/OdeSolver instances) cannot be pickled, resumable backends keep their data (see isResumable)
+        state = self.__dict__.copy()
+        for name in ['solver','interpolant']:
+            if name in state:
+                state[name] = None
+        return state
+    
+    def isResumable(self):
+        '''
+        True if an unpickled copy continues the integration with the same steps as the original, otherwise the
+        owner has to restart it from the state of the system
+        '''
+        return self.resumable
+    
+    def setTolerances(self,rtol=None,atol=None):
+        if rtol is not None:
+            self.rtol = rtol
+        if atol is not None:
+            self.atol = atol
+        
+    def resetStatistics(self):
+        self.nsteps = 0
+        self.nfev = 0
+        self.njev = 0
+        self.nlu = 0
+        
+    def getStatistics(self):
+        '''
+        Number of steps, rhs evaluations, jacobian evaluations and LU decompositions since the last reset
+        '''
+        return {'integrator':self.name,'nsteps':self.nsteps,'nfev':self.nfev,'njev':self.njev,'nlu':self.nlu}
+    
+    def rhs(self,t,y):
+        self.nfev += 1
+        self.system.updateBoundaryConditions(t)
+        #dTbydt returns its work array, integrators keep references to rhs values
+        return np.array(self.system.dTbydt(y))
+    
+    def setEvents(self,eventFunction,directions=None):
+        '''
+        eventFunction - callable g(t,y) returning an array of event function values, an event occurs where a value crosses zero
+        directions - per event, 1 for crossings from negative to positive, -1 for positive to negative and 0 for both (default)
+        Pass None to remove the events
+        '''
+        self.eventFunction = eventFunction
+        self.eventDirections = None
+        if directions is not None:
+            self.eventDirections = np.asarray(directions)
+        self.resetEvents()
+        
+    def resetEvents(self):
+        self.eventValues = None
+        self.pendingEvent = None
+        self.event = None
+        
+    def getEvent(self):
+        '''
+        Returns (event index, time) if the last call to integrate stopped at an event, otherwise None
+        '''
+        return self.event
+    
+    def detectEvent(self,tA,tB,interpolant):
+        '''
+        Check the event functions over the step [tA,tB], interpolant(t) returns the state within the step
+        The earliest crossing is located by root finding on the interpolant and kept as the pending event
+        (index,time,state) until the integration reaches it
+        '''
+        if self.eventFunction is None or self.pendingEvent is not None or tB <= tA:
+            return
+        gA = self.eventValues
+        if gA is None:
+            gA = self.eventFunction(tA,interpolant(tA))
+        gB = self.eventFunction(tB,interpolant(tB))
+        self.eventValues = gB
+        directions = self.eventDirections
+        if directions is None:
+            directions = np.zeros(gB.shape[0])
+        crossing = ((gA < 0) & (gB >= 0) & (directions >= 0)) | ((gA > 0) & (gB <= 0) & (directions <= 0))
+        event = None
+        for k in np.flatnonzero(crossing):
+            if gB[k] == 0:
+                te = tB
+            else:
+                te = brentq(lambda tv: self.eventFunction(tv,interpolant(tv))[k],tA,tB,xtol=self.eventTolerance)
+            if event is None or te < event[1]:
+                event = (k,te)
+        if event is not None:
+            self.pendingEvent = (event[0],event[1],np.array(interpolant(event[1])))
+        
+    def takePendingEvent(self,t):
+        '''
+        Returns the state at the pending event if it occurs at or before t (the event is then reported by getEvent), otherwise None
+        '''
+        if self.pendingEvent is None or self.pendingEvent[1] > t:
+            return None
+        k,te,ye = self.pendingEvent
+        self.pendingEvent = None
+        self.event = (k,te)
+        #The located root is only accurate to eventTolerance, treat the event as exactly on its threshold so
+        #that continuing the integration does not report it again
+        self.eventValues = np.array(self.eventFunction(te,ye),dtype=np.float64)
+        self.eventValues[k] = 0.0
+        return ye
+    
+    def initialize(self,system,t0,y0,tBound=None):
+        '''
+        Start integrating system from state y0 at time t0
+        tBound - time up to which the solution is required, when omitted it is taken from the first call to integrate
+        '''
+        raise NotImplementedError()
+    
+    def integrate(self,t):
+        raise NotImplementedError()
+
+
+class VodeIntegrator(ThermoregulationIntegrator):
+    '''
+    scipy vode BDF integrator (scipy.integrate.ode), with the assembled dense jacobian
+    Kept for comparison with earlier results, it takes many more steps than bdf and is limited to small models
+    (the blood compartment couples every unknown, so the jacobian has no band structure vode could use)
+    useAnalyticJacobian - when False vode approximates the jacobian by finite differences
+    maxSteps - maximum number of internal steps per call to integrate
+    vode is not re-entrant, only one instance can be active at a time within a process
+    vode provides no dense output, events are located by linear interpolation between the requested output times
+    '''
+    name = 'vode'
+    denseJacobian = True
+    
+    def __init__(self,rtol=1e-6,atol=1e-8,useAnalyticJacobian=True,maxSteps=50000):
+        super(VodeIntegrator,self).__init__(rtol,atol)
+        self.useAnalyticJacobian = useAnalyticJacobian
+        self.maxSteps = maxSteps
+        
+    def jacobian(self,t,y):
+        self.njev += 1
+        self.system.updateBoundaryConditions(t)
+        return self.system.dTbydtJacobian(y,True).toarray()
+        
+    def initialize(self,system,t0,y0,tBound=None):
+        self.system = system
+        jac = None
+        if self.useAnalyticJacobian:
+            jac = self.jacobian
+        self.solver = ode(self.rhs,jac)
+        self.solver.set_integrator('vode', method='bdf', with_jacobian=True, rtol=self.rtol, atol=self.atol, nsteps=self.maxSteps)
+        self.solver.set_initial_value(y0,t0)
+        self.t = t0
+        self.y = np.array(y0,dtype=np.float64)
+        self.resetEvents()
+        #Statistics accumulated from previous vode instances
+        self.offsets = [self.nsteps,self.njev,self.nlu]
+        
+    def integrate(self,t):
+        self.event = None
+        ye = self.takePendingEvent(t)
+        if ye is not None:
+            #Restart vode from the event state
+            event,values = self.event,self.eventValues
+            self.initialize(self.system,event[1],ye)
+            self.event,self.eventValues = event,values
+            return np.array(ye)
+        y = np.array(self.solver.integrate(t))
+        if not self.solver.successful():
+            raise RuntimeError('vode failed with return code %d at t=%g'%(self.solver.get_return_code(),self.solver.t))
+        #vode keeps counts since initialisation in iwork (NST, NJE, NLU)
+        iwork = self.solver._integrator.iwork
+        self.nsteps = self.offsets[0] + int(iwork[10])
+        if not self.useAnalyticJacobian:
+            self.njev = self.offsets[1] + int(iwork[12])
+        self.nlu = self.offsets[2] + int(iwork[18])
+        if self.eventFunction is not None:
+            tA,yA = self.t,self.y
+            self.detectEvent(tA,t,lambda tv: yA + (tv - tA)/(t - tA)*(y - yA))
+        self.t = t
+        self.y = y
+        if self.pendingEvent is not None:
+            return self.integrate(t)
+        return np.array(y)
+
+
+class OdeSolverIntegrator(ThermoregulationIntegrator):
+    '''
+    Integrator based on the scipy.integrate OdeSolver classes used by solve_ivp (BDF, Radau, LSODA)
+    useAnalyticJacobian - BDF and Radau use the sparse analytic jacobian with the global coupling treated as a
+    low rank update, LSODA uses the assembled dense analytic jacobian. When False, BDF and Radau estimate
+    the jacobian by finite differences using the jac_sparsity pattern of the model and LSODA by dense finite differences
+    maxStep - upper bound on the step size
+    Output values between internal steps are obtained from the solver's dense output
+    '''
+    name = None
+    solverClass = None
+    coupledSolverClass = None
+    resumable = True
+    #Solver attributes holding factorisations, the solvers refactorise the restored newton matrix when these are None
+    factorisations = ['LU','LU_real','LU_complex']
+    #Data of the pickled solver, restored on the next call to integrate
+    solverState = None
+    
+    def __init__(self,rtol=1e-6,atol=1e-8,useAnalyticJacobian=True,maxStep=np.inf):
+        super(OdeSolverIntegrator,self).__init__(rtol,atol)
+        self.useAnalyticJacobian = useAnalyticJacobian
+        self.maxStep = maxStep
+        
+    def jacobianFactors(self,t,y):
+        self.system.updateBoundaryConditions(t)
+        return self.system.dTbydtJacobianFactors(y)
+    
+    def jacobian(self,t,y):
+        self.system.updateBoundaryConditions(t)
+        return self.system.dTbydtJacobian(y,True).toarray()
+        
+    def createSolver(self,t0,y0,tBound):
+        options = {'rtol':self.rtol,'atol':self.atol,'max_step':self.maxStep}
+        if self.coupledSolverClass is not None:
+            if self.useAnalyticJacobian:
+                return self.coupledSolverClass(self.rhs,t0,y0,tBound,jacobianFactors=self.jacobianFactors,\
+                                               blockSize=self.system.jacobianBlockSize,**options)
+            return self.solverClass(self.rhs,t0,y0,tBound,jac_sparsity=self.system.getJacobianSparsity(),**options)
+        if self.useAnalyticJacobian:
+            return self.solverClass(self.rhs,t0,y0,tBound,jac=self.jacobian,**options)
+        return self.solverClass(self.rhs,t0,y0,tBound,**options)
+    
+    def __getstate__(self):
+        #The solver data (step size, order, differences, jacobian) is kept without its functions and factorisations
+        state = super(OdeSolverIntegrator,self).__getstate__()
+        if self.resumable and self.solver is not None:
+            solverState = {}
+            for name,value in self.solver.__dict__.items():
+                if isinstance(value,(types.FunctionType,types.MethodType)):
+                    continue
+                solverState[name] = None if name in self.factorisations else value
+            state['solverState'] = solverState
+        return state
+    
+    def restoreSolver(self):
+        '''
+        Recreate the solver from the pickled solver data
+        '''
+        nfev = self.nfev
+        self.solver = self.createSolver(self.t,self.y,self.solverState['t_bound'])
+        self.solver.__dict__.update(self.solverState)
+        #Evaluations made while creating the solver are not part of the integration
+        self.nfev = nfev
+        self.solverState = None
+        self.interpolant = None
+        
+    def initialize(self,system,t0,y0,tBound=None):
+        self.system = system
+        self.t = t0
+        self.y = np.array(y0,dtype=np.float64)
+        self.tBound = tBound
+        self.solver = None
+        self.solverState = None
+        self.interpolant = None
+        self.resetEvents()
+        #Solver statistics already accumulated from previous solver instances
+        self.offsets = [self.nfev,self.njev,self.nlu]
+        
+    def updateStatistics(self):
+        self.njev = self.offsets[1] + self.solver.njev
+        self.nlu = self.offsets[2] + self.solver.nlu
+        
+    def integrate(self,t):
+        self.event = None
+        ye = self.takePendingEvent(t)
+        if ye is not None:
+            #Continue from the event state on the next call
+            self.t = self.event[1]
+            self.y = ye
+            self.solver = None
+            self.solverState = None
+            self.interpolant = None
+            return np.array(ye)
+        if t == self.t:
+            return np.array(self.y)
+        if self.solver is None and self.solverState is not None:
+            self.restoreSolver()
+        if self.solver is None or t > self.solver.t_bound:
+            #Restart the solver when integrating past its bound
+            if self.solver is not None:
+                self.offsets = [self.nfev,self.njev,self.nlu]
+            tBound = t
+            if self.tBound is not None and self.tBound > t:
+                tBound = self.tBound
+            self.solver = self.createSolver(self.t,self.y,tBound)
+            self.interpolant = None
+        solver = self.solver
+        while solver.t < t:
+            message = solver.step()
+            if solver.status == 'failed':
+                raise RuntimeError('%s integrator failed at t=%g : %s'%(self.name,solver.t,message))
+            self.nsteps += 1
+            self.interpolant = None
+            if self.eventFunction is not None:
+                self.detectEvent(solver.t_old,solver.t,solver.dense_output())
+                if self.pendingEvent is not None and self.pendingEvent[1] <= t:
+                    self.updateStatistics()
+                    return self.integrate(t)
+        if solver.t == t:
+            y = np.array(solver.y)
+        else:
+            if self.interpolant is None:
+                self.interpolant = solver.dense_output()
+            y = self.interpolant(t)
+        self.updateStatistics()
+        self.t = t
+        self.y = y
+        return np.array(y)
+
+
+class BDFIntegrator(OdeSolverIntegrator):
+    '''
+    Variable order BDF (solve_ivp method BDF)
+    '''
+    name = 'bdf'
+    solverClass = BDF
+    coupledSolverClass = CoupledJacobianBDF
+
+
+class RadauIntegrator(OdeSolverIntegrator):
+    '''
+    Implicit Runge-Kutta Radau IIA of order 5 (solve_ivp method Radau)
+    '''
+    name = 'radau'
+    solverClass = Radau
+    coupledSolverClass = CoupledJacobianRadau
+
+
+class LSODAIntegrator(OdeSolverIntegrator):
+    '''
+    Adams/BDF switching LSODA (solve_ivp method LSODA), requires a dense jacobian and is suited to small models
+    '''
+    name = 'lsoda'
+    solverClass = LSODA
+    denseJacobian = True
+    #The Fortran solver state cannot be pickled
+    resumable = False
+    
+    def jacobian(self,t,y):
+        #LSODA does not count jacobian evaluations
+        self.njev += 1
+        return super(LSODAIntegrator,self).jacobian(t,y)
+    
+    def updateStatistics(self):
+        self.nlu = self.offsets[2] + int(self.solver.nlu)
+
+
+class ImplicitEulerIntegrator(ThermoregulationIntegrator):
+    '''
+    Fixed step backward Euler, each step solves y1 = y0 + h*f(y1) by a simplified newton iteration
+    with the jacobian evaluated once per step (factorised as a sparse LU with a low rank update)
+    timeStep - step size in seconds, steps are taken on the grid t0 + k*timeStep
+    maxIterations - newton iterations per step, steps that do not converge are split in two (at most maxSubdivisions times)
+                    The iteration is treated as not converging as soon as the scaled update grows
+    rtol, atol - newton convergence tolerance, the time discretisation error is not controlled
+    Output values between grid points are linearly interpolated, which is consistent with the first order scheme
+    '''
+    name = 'implicit-euler'
+    resumable = True
+    #Largest scaled newton update, larger updates are treated as divergence
+    divergenceLimit = 1e8
+    
+    def __init__(self,rtol=1e-6,atol=1e-8,timeStep=1.0,maxIterations=6,maxSubdivisions=8):
+        super(ImplicitEulerIntegrator,self).__init__(rtol,atol)
+        self.timeStep = timeStep
+        self.maxIterations = maxIterations
+        self.maxSubdivisions = maxSubdivisions
+        
+    def initialize(self,system,t0,y0,tBound=None):
+        self.system = system
+        self.t0 = t0
+        self.stepIndex = 0
+        self.t = t0
+        self.y = np.array(y0,dtype=np.float64)
+        self.tPrevious = t0
+        self.yPrevious = self.y
+        self.resetEvents()
+        
+    def newtonStep(self,t0,y0,h):
+        '''
+        Returns the backward euler solution after a step h from (t0,y0) or None if the newton iteration does not converge
+        '''
+        t1 = t0 + h
+        self.system.updateBoundaryConditions(t1)
+        L,U,G = self.system.dTbydtJacobianFactors(y0)
+        self.njev += 1
+        n = y0.shape[0]
+        LU = LowRankUpdateLU(sparse.identity(n,format='csc') - h*L,U,G,h,self.system.jacobianBlockSize)
+        self.nlu += 1
+        y = np.array(y0)
+        scale = self.atol + self.rtol*np.abs(y0)
+        previousNorm = np.inf
+        #A diverging iteration is abandoned before the rhs is evaluated at unphysical temperatures
+        with np.errstate(over='raise',invalid='raise'):
+            try:
+                for _ in range(self.maxIterations):
+                    residual = y - y0 - h*self.rhs(t1,y)
+                    dy = LU.solve(-residual)
+                    norm = np.sqrt(np.mean((dy/scale)**2))
+                    if not np.isfinite(norm) or norm >= previousNorm or norm > self.divergenceLimit:
+                        return None
+                    y += dy
+                    if norm < 1.0:
+                        return y
+                    previousNorm = norm
+            except FloatingPointError:
+                return None
+        return None
+        
+    def advance(self,t0,y0,h,depth=0):
+        y = self.newtonStep(t0,y0,h)
+        if y is None:
+            if depth >= self.maxSubdivisions:
+                raise RuntimeError('%s integrator newton iteration failed to converge at t=%g with step %g'%(self.name,t0,h))
+            y = self.advance(t0,y0,0.5*h,depth+1)
+            return self.advance(t0+0.5*h,y,0.5*h,depth+1)
+        self.nsteps += 1
+        return y
+        
+    def interpolate(self,t):
+        w = (t - self.tPrevious)/(self.t - self.tPrevious)
+        return self.yPrevious + w*(self.y - self.yPrevious)
+    
+    def integrate(self,t):
+        self.event = None
+        ye = self.takePendingEvent(t)
+        if ye is not None:
+            #Restart the step grid at the event
+            event,values = self.event,self.eventValues
+            self.initialize(self.system,event[1],ye)
+            self.event,self.eventValues = event,values
+            return np.array(ye)
+        while self.t < t:
+            self.tPrevious = self.t
+            self.yPrevious = self.y
+            self.y = self.advance(self.t,self.y,self.timeStep)
+            self.stepIndex += 1
+            self.t = self.t0 + self.stepIndex*self.timeStep
+            if self.eventFunction is not None:
+                self.detectEvent(self.tPrevious,self.t,self.interpolate)
+                if self.pendingEvent is not None and self.pendingEvent[1] <= t:
+                    return self.integrate(t)
+        if t == self.t or self.t == self.tPrevious:
+            return np.array(self.y)
+        return self.interpolate(t)
+
+
+integratorBackends = {VodeIntegrator.name:VodeIntegrator,
+                      BDFIntegrator.name:BDFIntegrator,
+                      RadauIntegrator.name:RadauIntegrator,
+                      LSODAIntegrator.name:LSODAIntegrator,
+                      ImplicitEulerIntegrator.name:ImplicitEulerIntegrator}
+
+
+#Largest state for the backends that assemble a dense jacobian, that of a model with Tanabe65MNModel.globalCouplingDofLimit faces
+denseJacobianStateLimit = 512*4+1
+
+
+def checkIntegrator(name,stateSize=None):
+    '''
+    Raise a ValueError if name is not a supported backend, or if the backend assembles a dense jacobian
+    (vode, lsoda) and the state has more than denseJacobianStateLimit entries
+    '''
+    key = name.lower()
+    if key not in integratorBackends:
+        raise ValueError('Unknown integrator %s, supported integrators are %s'%(name,', '.join(sorted(integratorBackends.keys()))))
+    if stateSize is not None and integratorBackends[key].denseJacobian and stateSize > denseJacobianStateLimit:
+        raise ValueError('The %s integrator assembles a dense jacobian of %d x %d (%.1f GiB), use bdf or radau for models with more than %d unknowns'\
+                         %(name,stateSize,stateSize,stateSize*stateSize*8.0/2**30,denseJacobianStateLimit))
+    return key
+
+
+def createIntegrator(name='bdf',stateSize=None,**options):
+    '''
+    Create an integrator backend by name, see integratorBackends for the supported names
+    stateSize - number of unknowns of the system, backends with dense jacobians are refused for large systems (see checkIntegrator)
+    options are passed to the backend constructor (rtol, atol and backend specific settings)
+    '''
+    return integratorBackends[checkIntegrator(name,stateSize)](**options)
@@ -64,6 +64,10 @@ class ZhangModel(object):
     partSpecificRegressionCoefficients['Lower leg']= [0.29, 0.40, 0.10,206, 212, 0]
     partSpecificRegressionCoefficients['Foot']= [0.25, 0.26, 0.15,109, 162, 0 ]
     sixteenSegmentkeys = ['Head','Chest','Back','Pelvis','L-shoulder','R-shoulder','L-arm','R-arm','L-hand','R-hand','L-thigh','R-thigh','L-leg','R-leg','L-foot','R-foot']
+    #Sensation codes are the rounded pmv levels
+    sensationLabels = {-4:'Very Cold',-3:'Cold',-2:'Cool',-1:'Slightly Cool',0:'Neutral',1:'Slightly Warm',2:'Warm',3:'Hot',4:'Very Hot'}
+    invalidSensation = -128
+    
     def __init__(self):
         '''
         Constructor
@@ -77,85 +81,143 @@ class ZhangModel(object):
         calcKeys['Lower leg'] = ['L-leg','R-leg']
         calcKeys['Foot'] = ['L-foot','R-foot']
         self.calcKeys = calcKeys
+        #Column indexes (into sixteenSegmentkeys) of the segments averaged for each calculation part
+        #Single segment parts use the same column twice
+        calcParts = list(calcKeys.keys())
+        self.calcFirstSegment = np.array([self.sixteenSegmentkeys.index(calcKeys[k][0]) for k in calcParts])
+        self.calcSecondSegment = np.array([self.sixteenSegmentkeys.index(calcKeys[k][-1]) for k in calcParts])
+        self.calcCoefficients = np.array([self.partSpecificRegressionCoefficients[k] for k in calcParts],dtype=np.float64)
+        self.calcWeights = np.array([self.thermalSensationWeightingFactors[k] for k in calcParts])
     
+    def getSensationLabel(self,code):
+        return self.sensationLabels.get(int(code),'error')
     
-    def computePMV(self,sixteenSegmentSkinTempAndDt,sixteenSegmentCoreTempAndDt,setPointTemp,dt=None):
+    def computePMVArrays(self,skinTemperature,skinRate,coreTemperature,coreRate,setPointTemperature,dt=None):
         '''
-        Compute the sensation at either dynamic or steady state
-        Steady state seems to provide more convincing values 
+        Compute the sensation for many states at once
+        skinTemperature, skinRate, coreTemperature, coreRate - (T,16) (or (16,)) segment values ordered as sixteenSegmentkeys
+        setPointTemperature - (16,) or (T,16) segment skin set point temperatures
+        Returns pmv, ppd and int8 sensation codes (see sensationLabels) as arrays of length T
         '''
-        calcValues = dict()
         dtd = 0.001
         if not dt is None:
             dtd = dt
-        for k,v in self.calcKeys.items():
-            tsum = np.array([0.0,0.0,0.0,0.0,0.0])
-            for ky in v:
-                ast = sixteenSegmentSkinTempAndDt[ky]
-                act = sixteenSegmentCoreTempAndDt[ky]
-                tset = setPointTemp[ky]
-                tsum[0] += ast[0]
-                tsum[1] += ast[1]/dtd
-                tsum[2] += act[0]
-                tsum[3] += act[1]/dtd
-                tsum[4] += tset
-            calcValues[k] = tsum/len(v)
-        meanWholeBodySkinTemp = 0.0
-        meanWholeBodySetTemp = 0.0
+        skinTemperature = np.atleast_2d(skinTemperature)
+        setPointTemperature = np.atleast_2d(setPointTemperature)
+        first = self.calcFirstSegment
+        second = self.calcSecondSegment
+        def partMean(values):
+            return (values[:,first]+values[:,second])/2.0
+        tsk = partMean(skinTemperature)
+        tset = partMean(setPointTemperature)
+        dtsk = partMean(np.atleast_2d(skinRate))/dtd
+        dtcr = partMean(np.atleast_2d(coreRate))/dtd
+        meanWholeBodySkinTemp = np.mean(skinTemperature,axis=1)[:,np.newaxis]
+        meanWholeBodySetTemp = np.mean(setPointTemperature,axis=1)[:,np.newaxis]
         
-        for v in sixteenSegmentSkinTempAndDt.values():
-            meanWholeBodySkinTemp += v[0]
-        for v in setPointTemp.values():
-            meanWholeBodySetTemp += v            
-        meanWholeBodySkinTemp /= len(sixteenSegmentSkinTempAndDt)
-        meanWholeBodySetTemp /= len(setPointTemp)
-        
-        localSensation = dict()
-        for k,v in calcValues.items():
-            slc = self.partSpecificRegressionCoefficients[k]
-            C1 = slc[1]
-            if v[0] < v[-1]: #tskin,local < tskin,local,set
-                C1 = slc[0]
-            C2 = slc[4]
-            if v[1] < 0: #Dt < 0 - cooling
-                C2 = slc[3]
-            K1 = slc[2]
-            C3 = slc[5]
-            if not dt is None:
-                slv = 4*(2.0/(1.0+np.exp(-C1*(v[0]-v[-1])-K1*(v[0]-meanWholeBodySkinTemp-v[-1]+meanWholeBodySetTemp)))-1) + C2*v[1] + C3*v[3]
-            else:
-                slv = 4*(2.0/(1.0+np.exp(-C1*(v[0]-v[-1])-K1*(v[0]-meanWholeBodySkinTemp-v[-1]+meanWholeBodySetTemp)))-1)
-            localSensation[k] = slv
-            #print k,v,slv
-            
-        Soverall = 0.0
-        for lv,v in localSensation.items():
-            Soverall += (v*self.thermalSensationWeightingFactors[lv])
+        slc = self.calcCoefficients
+        C1 = np.where(tsk < tset,slc[:,0],slc[:,1]) #tskin,local < tskin,local,set
+        K1 = slc[:,2]
+        localSensation = 4*(2.0/(1.0+np.exp(-C1*(tsk-tset)-K1*(tsk-meanWholeBodySkinTemp-tset+meanWholeBodySetTemp)))-1)
+        if not dt is None:
+            C2 = np.where(dtsk < 0,slc[:,3],slc[:,4]) #Dt < 0 - cooling
+            localSensation += C2*dtsk + slc[:,5]*dtcr
             
-        pmv = Soverall
+        pmv = np.dot(localSensation,self.calcWeights)
         ppd = 100.0 - 95.0 * np.exp(-0.03353 * np.power(pmv, 4.0) - 0.2179 * np.power(pmv, 2.0))
-        pmvr = int(np.ceil(pmv+np.sign(pmv)*0.1))
-        feeling = 'error'
-        if pmvr <= -4.0:
-            feeling = 'Very Cold'
-        elif pmvr == -3.0:
-            feeling = 'Cold'
-        elif pmvr == -2.0:
-            feeling = 'Cool'
-        elif pmvr == -1:
-            feeling = 'Slightly Cool'
-        elif pmvr == 0:
-            feeling = 'Neutral'
-        elif pmvr == 1:
-            feeling = 'Slightly Warm'
-        elif pmvr == 2:
-            feeling = 'Warm'
-        elif pmvr == 3:
-            feeling = 'Hot'
-        elif pmvr >= 4:
-            feeling = 'Very Hot'
-            
-        return pmv,ppd,feeling
+        valid = np.isfinite(pmv)
+        sensation = np.full(pmv.shape,self.invalidSensation,dtype=np.int8)
+        sensation[valid] = np.clip(np.ceil(pmv[valid]+np.sign(pmv[valid])*0.1),-4,4)
+        return pmv,ppd,sensation
+    
+    def computePMV(self,sixteenSegmentSkinTempAndDt,sixteenSegmentCoreTempAndDt,setPointTemp,dt=None):
+        '''
+        Compute the sensation at either dynamic or steady state
+        Steady state seems to provide more convincing values 
+        '''
+        keys = self.sixteenSegmentkeys
+        skin = np.array([sixteenSegmentSkinTempAndDt[k] for k in keys],dtype=np.float64)
+        core = np.array([sixteenSegmentCoreTempAndDt[k] for k in keys],dtype=np.float64)
+        setPoint = np.array([setPointTemp[k] for k in keys],dtype=np.float64)
+        pmv,ppd,sensation = self.computePMVArrays(skin[:,0],skin[:,1],core[:,0],core[:,1],setPoint,dt)
+        return pmv[0],ppd[0],self.getSensationLabel(sensation[0])
+
+class FangerModel(object):
+    '''
+    Fanger's PMV/PPD (ISO 7730) evaluated for arrays of conditions at once, for comfort maps over
+    (Ta, rh, velocity of air, met) grids. Does not require a human model
+    '''
+    eps = 0.00015
+    maxIterations = 150
+    
+    def computePMVArrays(self,ta,tr,vel,rh,met,wme=0.0,icl=0.10):
+        '''
+        ta - air temperature (C), tr - mean radiant temperature (C), vel - relative air velocity (m/s)
+        rh - relative humidity (fraction, as set on Tanabe65MNModel), met - metabolic rate (met), wme - external work (met)
+        icl - thermal insulation of the clothing (m2K/W)
+        Inputs are broadcast against each other, returns pmv and ppd arrays of the broadcast shape
+        The clothing surface temperature is iterated for all points together, each point stops updating once it has
+        converged. Points that do not converge within maxIterations are returned as nan
+        '''
+        ta,tr,vel,rh,met,wme,icl = [np.array(v,dtype=np.float64) for v in np.broadcast_arrays(ta,tr,vel,rh,met,wme,icl)]
+        shape = ta.shape
+        ta,tr,vel,rh,met,wme,icl = [v.ravel() for v in (ta,tr,vel,rh,met,wme,icl)]
+        pa = rh * 10 * np.exp(16.6536 - 4030.183 / (ta + 235))
+        m = met * 58.15 #metabolic rate in W/M2
+        w = wme * 58.15 #external work in W/M2
+        mw = m - w #internal heat production in the human body
+        fcl = np.where(icl <= 0.078,1 + (1.29 * icl),1.05 + (0.645 * icl))
+
+        #heat transf. coeff. by forced convection
+        hcf = 12.1 * np.sqrt(vel)
+        taa = ta + 273
+        tra = tr + 273
+        tcla = taa + (35.5 - ta) / (3.5 * icl + 0.1)
+
+        p1 = icl * fcl
+        p2 = p1 * 3.96
+        p3 = p1 * 100
+        p4 = p1 * taa
+        p5 = 308.7 - 0.028 * mw + p2 * np.power(tra / 100, 4)
+        xn = tcla / 100
+        xf = tcla / 50
+        hc = np.zeros(ta.shape)
+        converged = np.ones(ta.shape,dtype='bool')
+
+        #Fixed point iteration for the clothing surface temperature on the points that have not converged
+        active = np.flatnonzero(np.abs(xn - xf) > self.eps)
+        n = 0
+        while active.shape[0] > 0:
+            xf[active] = (xf[active] + xn[active]) / 2
+            hcn = 2.38 * np.power(np.abs(100.0 * xf[active] - taa[active]), 0.25)
+            hc[active] = np.where(hcf[active] > hcn,hcf[active],hcn)
+            xn[active] = (p5[active] + p4[active] * hc[active] - p2[active] * np.power(xf[active], 4)) / (100 + p3[active] * hc[active])
+            n = n + 1
+            if n > self.maxIterations:
+                converged[active] = False
+                break
+            active = active[np.abs(xn[active] - xf[active]) > self.eps]
+
+        tcl = 100 * xn - 273
+
+        #heat loss diff. through skin
+        hl1 = 3.05 * 0.001 * (5733 - (6.99 * mw) - pa)
+        #heat loss by sweating
+        hl2 = np.where(mw > 58.15,0.42 * (mw - 58.15),0.0)
+        #latent respiration heat loss
+        hl3 = 1.7 * 0.00001 * m * (5867 - pa)
+        #dry respiration heat loss
+        hl4 = 0.0014 * m * (34 - ta)
+        #heat loss by radiation
+        hl5 = 3.96 * fcl * (np.power(xn, 4) - np.power(tra / 100, 4))
+        #heat loss by convection
+        hl6 = fcl * hc * (tcl - ta)
+
+        ts = 0.303 * np.exp(-0.036 * m) + 0.028
+        pmv = ts * (mw - hl1 - hl2 - hl3 - hl4 - hl5 - hl6)
+        pmv[~converged] = np.nan
+        ppd = 100.0 - 95.0 * np.exp(-0.03353 * np.power(pmv, 4.0) - 0.2179 * np.power(pmv, 2.0))
+        return np.reshape(pmv,shape),np.reshape(ppd,shape)
 
 import pickle
 if __name__ == '__main__':
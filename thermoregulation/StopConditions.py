@@ -0,0 +1,153 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import numpy as np
+
+
+class StopCondition(object):
+    '''
+    A condition that ends a simulation when a model quantity crosses a threshold
+    The integrator locates the crossing as a root of value(model) - threshold (see ThermoregulationIntegrator.setEvents)
+    direction - 1 to stop when the value rises through the threshold, -1 when it falls through it, 0 for both
+    Subclasses implement value(model), which is evaluated with the model set to the state being checked
+    '''
+    name = None
+    description = None
+    #Set when value requires the rates and wettedness (Tanabe65MNModel.updateDerivedQuantities) at the state
+    requiresDerivedQuantities = False
+    
+    def __init__(self,threshold,direction=1):
+        self.threshold = threshold
+        self.direction = direction
+        
+    def value(self,model):
+        raise NotImplementedError()
+    
+    def __call__(self,model):
+        return self.value(model) - self.threshold
+    
+    def getReason(self):
+        if self.direction < 0:
+            return '%s fell below %g'%(self.description,self.threshold)
+        elif self.direction > 0:
+            return '%s exceeded %g'%(self.description,self.threshold)
+        return '%s crossed %g'%(self.description,self.threshold)
+    
+    def getDefinition(self):
+        return {'type':self.name,'threshold':self.threshold,'direction':self.direction}
+    
+
+class CoreTemperatureLimit(StopCondition):
+    '''
+    Surface area weighted mean core temperature (C)
+    '''
+    name = 'coreTemperature'
+    description = 'Mean core temperature'
+    
+    def value(self,model):
+        return model.getMeanCoreTemperature()
+
+
+class RectalTemperatureLimit(StopCondition):
+    '''
+    Rectal (pelvis core) temperature (C)
+    '''
+    name = 'rectalTemperature'
+    description = 'Rectal temperature'
+    
+    def value(self,model):
+        return model.getRectalTemperature()
+
+
+class SkinWettednessLimit(StopCondition):
+    '''
+    Surface area weighted mean skin wettedness (0-1), or the maximum over the faces when useMaximum is set
+    '''
+    name = 'skinWettedness'
+    description = 'Skin wettedness'
+    requiresDerivedQuantities = True
+    
+    def __init__(self,threshold,direction=1,useMaximum=False):
+        super(SkinWettednessLimit,self).__init__(threshold,direction)
+        self.useMaximum = useMaximum
+        
+    def value(self,model):
+        wettedness = model.wettedness
+        if self.useMaximum:
+            return np.max(wettedness)
+        area = np.ravel(model.bodySurfaceArea)
+        return np.sum(wettedness*area)/np.sum(area)
+    
+    def getDefinition(self):
+        definition = super(SkinWettednessLimit,self).getDefinition()
+        definition['useMaximum'] = self.useMaximum
+        return definition
+
+
+class PMVLimit(StopCondition):
+    '''
+    Stops when the (Zhang) PMV leaves the band [-threshold, threshold]
+    '''
+    name = 'pmv'
+    description = 'Absolute PMV'
+    requiresDerivedQuantities = True
+    
+    def __init__(self,threshold=3.0,direction=1):
+        super(PMVLimit,self).__init__(threshold,direction)
+        
+    def value(self,model):
+        return np.abs(model.ZhangPMVPPD()[0])
+
+
+stopConditionTypes = {CoreTemperatureLimit.name:CoreTemperatureLimit,
+                      RectalTemperatureLimit.name:RectalTemperatureLimit,
+                      SkinWettednessLimit.name:SkinWettednessLimit,
+                      PMVLimit.name:PMVLimit}
+
+
+def createStopCondition(definition):
+    '''
+    Create a stop condition from a definition such as {'type':'rectalTemperature','threshold':39.0}
+    StopCondition instances are returned as is, see stopConditionTypes for the supported types
+    '''
+    if isinstance(definition,StopCondition):
+        return definition
+    options = dict(definition)
+    name = options.pop('type')
+    if name not in stopConditionTypes:
+        raise ValueError('Unknown stop condition %s, supported conditions are %s'%(name,', '.join(sorted(stopConditionTypes.keys()))))
+    return stopConditionTypes[name](**options)
@@ -36,14 +36,18 @@
  '''
 from __future__ import unicode_literals,print_function
 #from numba import jit
+import logging
 import numpy as np
-from thermoregulation.PMVModels import ZhangModel
-from scipy.integrate._ode import ode
+from thermoregulation.PMVModels import ZhangModel, FangerModel
+from thermoregulation.Integrators import createIntegrator, checkIntegrator, ThermoregulationIntegrator, LowRankUpdateLU
+from thermoregulation.StopConditions import createStopCondition
+from scipy import sparse
 canUsePersonalizedModel = True
 try:
     from bodymodels.LoadOBJHumanModel import HumanModel
 except:
     canUsePersonalizedModel = False
+from bodymodels.SegmentLabels import getSegmentLabels, SegmentAggregator
 from bodymodels.StandardT65Setup import Tanabe17segmentModel,\
     PersonalizedTanabe17SegmentModel
 import pickle
@@ -59,8 +63,30 @@ class Tanabe65MNModel(object):
     met = 0.8
     hr = 4.9 # W/m^2
     zhangComfortModel = ZhangModel()
+    fangerComfortModel = FangerModel()
     eswScaleFactor = 1.04921477
     emaxFactor = 19.7289316
+    #Models with at most these many dofs include the (dense) Err11/Wrms/Clds coupling in the assembled jacobian
+    globalCouplingDofLimit = 512
+    #Jacobians are general sparse matrices, see Tanabe65MNEnsemble for block diagonal ones
+    jacobianBlockSize = None
+    rtol = 1e-6
+    atol = 1e-8
+    integratorName = 'bdf'
+    integratorOptions = {}
+    #Keep the integrator history across calls to solve, it is restarted when the boundary conditions change
+    continuousIntegration = True
+    workspaceSize = -1
+    #Incremented whenever the boundary conditions change, terms that are invariant within an epoch are cached
+    parameterEpoch = 0
+    invariantTermsEpoch = -1
+    simulationTime = 0.0
+    integrationState = None
+    stopConditions = ()
+    boundaryConditionSchedule = None
+    boundaryConditionTime = None
+    stopTime = None
+    stopReason = None
     
     def __init__(self, humanModel):
         '''
@@ -69,8 +95,10 @@ class Tanabe65MNModel(object):
         self.humanModel = humanModel
         self.nDofs = humanModel.numberOfFaces
         parameters = humanModel.getPersonalizedParameters()
-        self.headDofs = humanModel.dofIndexes[0]
-        self.chestDofs = humanModel.dofIndexes[1]
+        self.segmentLabels = getSegmentLabels(humanModel)
+        self.segmentAggregator = SegmentAggregator(self.segmentLabels)
+        self.headDofs = self.segmentLabels==0
+        self.chestDofs = self.segmentLabels==1
         self.Qb = humanModel.getQb() #Qb is obtained from the sum of basal metabolic rate of all nodes, 0.778 met.
         self.Ta = np.zeros(self.nDofs)
         self.Qij = np.zeros((self.nDofs,4))
@@ -103,25 +131,27 @@ class Tanabe65MNModel(object):
         else:
             self.faceIndexes = np.zeros(1,dtype='bool')
         self.headSurfaceFactors = surfaceFactors[self.headDofs]
-        self.chestSurfaceFactors = surfaceFactors[humanModel.dofIndexes[1]]
+        self.chestSurfaceFactors = surfaceFactors[self.chestDofs]
         self.hc = np.zeros(self.nDofs)
         self.lhm = np.zeros(self.nDofs)
         
-        for i in range(16):
-            indexes = humanModel.dofIndexes[i]
-            self.bodySurfaceArea[indexes] = parameters['bodySurfaceArea'][i]
-            self.heatCapacity[indexes,:] = parameters['heatCapacity'][i,:]  
-            self.metabolicRate[indexes,:] = parameters['metabolicRate'][i,0:4]*surfaceFactors[indexes,np.newaxis]
-            self.setPointTemperature[indexes,:] = parameters['setPointTemperature'][i,:]  
-            self.basalBloodFlow[indexes,:] = parameters['basalBloodFlow'][i,:]*surfaceFactors[indexes,np.newaxis]
-            self.thermalConductance[indexes,:] = parameters['thermalResitance'][i,:]*surfaceFactors[indexes,np.newaxis]  
-            #self.radiationHeatFlux[indexes,0] = parameters['radiationHeatFlux'][i]*surfaceFactors[indexes]
-            self.chit[indexes] = parameters['weightingAndDistributionCoefficients'][i,4]
-            self.metf[indexes] = parameters['metabolicRate'][i,4]
-            self.SKINC[indexes] = parameters['weightingAndDistributionCoefficients'][i,3]*surfaceFactors[indexes]
-            self.SKINV[indexes] = parameters['weightingAndDistributionCoefficients'][i,2]*surfaceFactors[indexes]
-            self.SKINS[indexes] = parameters['weightingAndDistributionCoefficients'][i,1]*surfaceFactors[indexes]
-            self.SKINR_norm[indexes] = parameters['weightingAndDistributionCoefficients'][i,0]*surfaceFactors[indexes]
+        #Scatter the segment parameters onto the faces in one pass each
+        faces = self.segmentAggregator.faces
+        scatter = self.segmentAggregator.scatter
+        faceFactors = surfaceFactors[:,np.newaxis]
+        distributionCoefficients = scatter(parameters['weightingAndDistributionCoefficients'])
+        self.bodySurfaceArea[faces] = np.take(parameters['bodySurfaceArea'],self.segmentAggregator.faceSegments)
+        self.heatCapacity[:] = scatter(parameters['heatCapacity'])
+        self.metabolicRate[:] = scatter(parameters['metabolicRate'][:,0:4])*faceFactors
+        self.setPointTemperature[:] = scatter(parameters['setPointTemperature'])
+        self.basalBloodFlow[:] = scatter(parameters['basalBloodFlow'])*faceFactors
+        self.thermalConductance[:] = scatter(parameters['thermalResitance'])*faceFactors
+        self.chit[:] = distributionCoefficients[:,4]
+        self.metf[:] = scatter(parameters['metabolicRate'][:,4])
+        self.SKINC[:] = distributionCoefficients[:,3]*surfaceFactors
+        self.SKINV[:] = distributionCoefficients[:,2]*surfaceFactors
+        self.SKINS[:] = distributionCoefficients[:,1]*surfaceFactors
+        self.SKINR_norm[:] = distributionCoefficients[:,0]*surfaceFactors
             
         self.SKINR_head = parameters['weightingAndDistributionCoefficients'][0,0]*surfaceFactors[self.headDofs]
             
@@ -137,11 +167,21 @@ class Tanabe65MNModel(object):
         self.Cst = parameters['controlCoefficients']['Cst']
         self.Sst = parameters['controlCoefficients']['Sst']
         self.Pst = parameters['controlCoefficients']['Pst']
+        self.allocateWorkspace()
             
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        #Integrators that cannot continue after pickling are restarted from the restored state, see ThermoregulationIntegrator.isResumable
+        integrator = getattr(self,'integrator',None)
+        if integrator is None or not integrator.isResumable():
+            self.resetIntegration()
 
     def getDofIndexes(self):
         return self.humanModel.dofIndexes
 
+    def getSegmentLabels(self):
+        return self.segmentLabels
+
     def getNumberOfDofs(self):
         return self.nDofs
 
@@ -153,26 +193,27 @@ class Tanabe65MNModel(object):
         Ambient air temperature
         '''
         self.Ta.fill(Ta)
+        self.parametersChanged()
         #Calculate Operative temperature
         self.Tr = Ta + self.radiationHeatFlux[:,0]/4.184/(self.heatCapacity[:,3]*3600.0)  
         self.To = (self.hr*self.Tr + self.hc*self.Ta)/(self.hr + self.hc)
         
             
     def setRadiationFlux(self,radiationFluxModel):
+        self.parametersChanged()
         if radiationFluxModel.getNumIndicies()==16:
-            for i in range(16):
-                indexes = self.humanModel.dofIndexes[i]
-                self.radiationHeatFlux[indexes,0] = radiationFluxModel.getFluxFor(i)*self.humanModel.surfaceFactors[indexes]
+            faces = self.segmentAggregator.faces
+            fluxes = np.array([radiationFluxModel.getFluxFor(i) for i in range(16)])
+            self.radiationHeatFlux[faces,0] = fluxes[self.segmentAggregator.faceSegments]*self.humanModel.surfaceFactors[faces]
         elif radiationFluxModel.getNumIndicies()==self.radiationHeatFlux.shape[0]:
             self.radiationHeatFlux[:,0] = np.multiply(radiationFluxModel.getFluxes()[:,0],self.humanModel.surfaceFactors)
-        elif radiationFluxModel.getNumIndicies()>self.radiationHeatFlux.shape[0] and self.radiationHeatFlux.shape[0]==16:
-            weightedFluxes = np.multiply(radiationFluxModel.getFluxes()[:,0],self.mySurfaceFaceAreas)
-            for i in range(16):
-                indexes = self.myDofIndexes[i]
-                self.radiationHeatFlux[i,0] = np.sum(weightedFluxes[indexes])            
+        elif radiationFluxModel.getNumIndicies()==self.getNumberOfDofs() and self.radiationHeatFlux.shape[0]==16:
+            #Per face fluxes of the mesh projected to the standard model
+            self.radiationHeatFlux[:,0] = self.mySegmentAggregator.sum(radiationFluxModel.getFluxes()[:,0],self.mySurfaceFaceAreas)
         else:
-            print("Number of faces in radiation flux model does not match!")
-            raise ValueError("Number of faces in radiation flux model does not match!")
+            estr = "Number of faces in radiation flux model (%d) does not match the model (%d)!"%(radiationFluxModel.getNumIndicies(),self.getNumberOfDofs())
+            print(estr)
+            raise ValueError(estr)
         #Calculate Operative temperature
         #1 Watt = 1J/s, 1 cal = 4.184 Joules - 1 cal the energy need to raise temp by 1 C
         #Specific heat is the measure of calories needed to raise energy by 1 C
@@ -182,10 +223,21 @@ class Tanabe65MNModel(object):
     
     def setClothingModel(self,clothingModel):
         self.clothingModel = clothingModel
-        for i in range(16):
-            indexes = self.humanModel.dofIndexes[i]
-            self.hc[indexes] = clothingModel.getHeatTransferCoefficient(i)
-            self.lhm[indexes] = clothingModel.getVapourTransferCoefficient(i)
+        self.parametersChanged()
+        self.setClothingCoefficients(*self.getClothingCoefficients(clothingModel))
+        
+    def getClothingCoefficients(self,clothingModel):
+        '''
+        Returns the 16 segment heat and vapour transfer coefficients of clothingModel
+        '''
+        return np.array([clothingModel.getHeatTransferCoefficient(i) for i in range(16)]),\
+               np.array([clothingModel.getVapourTransferCoefficient(i) for i in range(16)])
+        
+    def setClothingCoefficients(self,heatTransferCoefficients,vapourTransferCoefficients):
+        faces = self.segmentAggregator.faces
+        faceSegments = self.segmentAggregator.faceSegments
+        self.hc[faces] = np.take(heatTransferCoefficients,faceSegments)
+        self.lhm[faces] = np.take(vapourTransferCoefficients,faceSegments)
         
         #Set the face coefficients to exposed values, the projected 16 segment model does not distinguish
         if np.any(self.faceIndexes):
@@ -195,17 +247,70 @@ class Tanabe65MNModel(object):
         
     def setRelativeHumidity(self,rh):
         self.relativeHumdity = rh
+        self.parametersChanged()
 
     def setMet(self,m):
         self.met = m
+        self.parametersChanged()
                 
+    def setBoundaryConditionSchedule(self,schedule=None):
+        '''
+        schedule - BoundaryConditionSchedule (see thermoregulation.BoundaryConditions) with time series of Ta, rh, velocity
+                   of air and met, or None to use constant values. Schedule times are relative to the current simulation time
+        The series are interpolated at the time of every rhs evaluation, so a logged environment is integrated in one pass
+        Velocity of air changes the clothing coefficients, these are computed from the current clothing model at the
+        sample times and interpolated in time. Series that are not in the schedule keep the values set by the setters
+        '''
+        self.boundaryConditionSchedule = schedule
+        self.boundaryConditionTime = None
+        self.scheduleOrigin = self.simulationTime
+        self.scheduleClothingCoefficients = None
+        if schedule is not None and schedule.hasSeries('velocityOfAir'):
+            clothingModel = self.clothingModel
+            velocityOfAir = clothingModel.velocityOfAir
+            coefficients = []
+            for v in schedule.getSeries('velocityOfAir'):
+                clothingModel.setVelocityOfAir(v)
+                coefficients.append(self.getClothingCoefficients(clothingModel))
+            clothingModel.setVelocityOfAir(velocityOfAir)
+            self.scheduleClothingCoefficients = np.array(coefficients)
+        self.resetIntegration()
+        self.updateBoundaryConditions(self.simulationTime)
+        
+    def updateBoundaryConditions(self,t):
+        '''
+        Set the boundary conditions of the schedule (if any) at integration time t, called by the integrators before
+        evaluating the rhs and jacobian
+        '''
+        schedule = self.boundaryConditionSchedule
+        if schedule is None or t is None or t == self.boundaryConditionTime:
+            return
+        self.boundaryConditionTime = t
+        i,w = schedule.getInterpolationWeights(t - self.scheduleOrigin)
+        series = schedule.series
+        if 'Tab' in series:
+            self.Ta.fill(schedule.interpolate(series['Tab'],i,w))
+        if 'rh' in series:
+            self.relativeHumdity = schedule.interpolate(series['rh'],i,w)
+        if 'metabolicActivity' in series:
+            self.met = schedule.interpolate(series['metabolicActivity'],i,w)
+            self.getW()
+        if self.scheduleClothingCoefficients is not None:
+            hc,lhm = schedule.interpolate(self.scheduleClothingCoefficients,i,w)
+            self.setClothingCoefficients(hc,lhm)
+        self.Tr = self.Ta + self.radiationHeatFlux[:,0]/4.184/(self.heatCapacity[:,3]*3600.0)  
+        self.To = (self.hr*self.Tr + self.hc*self.Ta)/(self.hr + self.hc)
+        #Invariant terms are recomputed on the next evaluation, the integration itself continues
+        self.parameterEpoch += 1
+        
     def getW(self):
         W = 58.2*(self.met-self.Qb)*self.bodySurfaceArea*self.metf
         W[W<0] = 0.0
         self.W[:,1] = W
         
     def getQ(self):
-        self.Qij = self.metabolicRate + self.W + self.Ch
+        np.add(self.metabolicRate,self.W,out=self.Qij)
+        np.add(self.Qij,self.Ch,out=self.Qij)
         return self.Qij
     
     def getInitialConditions(self):
@@ -215,21 +320,65 @@ class Tanabe65MNModel(object):
         return ic
     
     def setInitialConditions(self,temp):
-        self.temperature = np.reshape(temp[0:-1], (-1,4))
-        self.cbcTemp = temp[-1]
+        self.setState(temp)
+        self.resetIntegration()
     
-#    @jit
-    def computeErrCldsWrms(self,temperature):
-        self.Err = temperature - self.setPointTemperature
-        self.Wrm = np.array(self.Err,copy=True)
-        self.Cld = -np.array(self.Err,copy=True)
-        self.Wrm[self.Err<0] = 0
-        self.Cld[self.Err>0] = 0
+    def getState(self):
+        '''
+        Returns the state vector [temperature (row major), cbcTemp] used by the integrators
+        '''
+        state = np.zeros(self.nDofs*4+1)
+        state[0:-1] = np.reshape(self.temperature, (-1,1))[:,0]
+        state[-1] = self.cbcTemp
+        return state
+    
+    def setState(self,state):
+        self.temperature = np.reshape(state[0:-1], (-1,4))
+        self.cbcTemp = state[-1]
+    
+    def allocateWorkspace(self):
+        '''
+        Preallocate the buffers and index arrays used by dTbydt, so that rhs evaluations do not allocate node arrays
+        '''
+        nDofs = self.nDofs
+        self.workspaceSize = nDofs
+        self.headIndexes = np.flatnonzero(self.headDofs)
+        self.chestIndexes = np.flatnonzero(self.chestDofs)
+        self.Err = np.zeros((nDofs,4))
+        self.km = np.zeros(nDofs)
+        self.Esw = np.zeros(nDofs)
+        self.wsHead = np.zeros(self.headIndexes.shape[0])
+        self.wsBFS = np.zeros((nDofs,4))
+        self.wsBF = np.zeros((nDofs,4))
+        self.wsTdiff = np.zeros((nDofs,4))
+        self.wsD = np.zeros((nDofs,3))
+        self.wsVector = [np.zeros(nDofs) for _ in range(4)]
+        self.wsMask = np.zeros(nDofs,dtype='bool')
+        self.ambientVapourPressure = np.zeros(nDofs)
+        self.invariantTermsEpoch = -1
         
-        self.Wrms = np.sum(self.SKINR_norm*self.Wrm[:,3])
-        self.Clds = np.sum(self.SKINR_norm*self.Cld[:,3])
+    def computeErrCldsWrms(self,temperature):
+        if self.workspaceSize != self.nDofs:
+            self.allocateWorkspace()
+        a = self.wsVector[0]
+        mask = self.wsMask
+        Err = np.subtract(temperature,self.setPointTemperature,out=self.Err)
+        Err3 = Err[:,3]
+        #Skin warm and cold signals
+        np.copyto(a,Err3)
+        np.less(Err3,0,out=mask)
+        np.copyto(a,0,where=mask)
+        np.multiply(self.SKINR_norm,a,out=a)
+        self.Wrms = np.sum(a)
+        np.negative(Err3,out=a)
+        np.greater(Err3,0,out=mask)
+        np.copyto(a,0,where=mask)
+        np.multiply(self.SKINR_norm,a,out=a)
+        self.Clds = np.sum(a)
         
-        e11 = np.sum(self.Err[self.headDofs,0]*self.headSurfaceFactors)
+        head = np.take(Err[:,0],self.headIndexes,out=self.wsHead)
+        np.multiply(head,self.headSurfaceFactors,out=head)
+        e11 = np.sum(head)
         self.Err11 = e11
 
         Wrm11 = e11
@@ -238,9 +387,11 @@ class Tanabe65MNModel(object):
         Cld11 = -e11
         if Cld11 < 0:
             Cld11 = 0
-        self.Ch.fill(0.0)
-        self.Ch[:,1] = (-self.Cch*e11-self.Sch*(self.Wrms-self.Clds) + self.Pch*Cld11*self.Clds)*self.chit
-        self.Ch[self.Ch<0] = 0
+        #Only the muscle layer shivers, the other columns of Ch remain zero
+        Ch1 = self.Ch[:,1]
+        np.multiply((-self.Cch*e11-self.Sch*(self.Wrms-self.Clds) + self.Pch*Cld11*self.Clds),self.chit,out=Ch1)
+        np.less(Ch1,0,out=mask)
+        np.copyto(Ch1,0,where=mask)
             
         self.DL = self.Cdl*e11+self.Sdl*(self.Wrms-self.Clds) + self.Pdl*Wrm11*self.Wrms
         if self.DL<0:
@@ -248,28 +399,48 @@ class Tanabe65MNModel(object):
         self.ST = -self.Cst*e11-self.Sst*(self.Wrms-self.Clds) + self.Pst*Cld11*self.Clds
         if self.ST<0:
             self.ST = 0
-        self.km = np.power(2.0,self.Err[:,3]/10)
+        np.divide(Err3,10,out=self.km)
+        np.power(2.0,self.km,out=self.km)
         
-        self.Esw = (self.Csw*e11 + self.Ssw*(self.Wrms-self.Clds) + self.Psw*Wrm11*self.Wrms)*self.SKINS*self.km
+        np.multiply((self.Csw*e11 + self.Ssw*(self.Wrms-self.Clds) + self.Psw*Wrm11*self.Wrms),self.SKINS,out=self.Esw)
+        np.multiply(self.Esw,self.km,out=self.Esw)
 
     
     #Following eq 21 of X. Wan, J. Fan, J. Therm Biol, 33, 2008, 87-97
-    def getEmax(self,temperature):
+    def getEmax(self,temperature,out=None):
+        '''
+        out - optional buffer of length nDofs for the result
+        '''
+        if out is None:
+            out = np.zeros(self.nDofs)
+        self.updateInvariantTerms()
+        T3 = temperature[:,3]
+        c = self.wsVector[3]
         #Using Tetens eq
-        Psk = 0.61078*np.exp(17.625*temperature[:,3]/(temperature[:,3]+237.3)) #Units kpa 
-        #Require vapour pressure so RH is involved
-        Pa  = self.relativeHumdity*0.61078*np.exp(17.625*self.Ta/(self.Ta+237.3)) #Units kpa 
-        v = self.emaxFactor*(Psk-Pa)*self.bodySurfaceArea/self.lhm #Formula in Pa, Note that the bodysurface area factor is applied to handle nonstandard body area, according to Eq 14 of Tanabe 2002
-        v[v<0] = 0.0
+        np.multiply(17.625,T3,out=out)
+        np.add(T3,237.3,out=c)
+        np.divide(out,c,out=out)
+        np.exp(out,out=out)
+        Psk = np.multiply(0.61078,out,out=out) #Units kpa 
+        #Require vapour pressure so RH is involved, Pa is cached per parameter epoch
+        v = np.subtract(Psk,self.ambientVapourPressure,out=out)
+        #Formula in Pa, Note that the bodysurface area factor is applied to handle nonstandard body area, according to Eq 14 of Tanabe 2002
+        np.multiply(self.emaxFactor,v,out=v)
+        np.multiply(v,self.bodySurfaceArea,out=v)
+        np.divide(v,self.lhm,out=v)
+        np.less(v,0,out=self.wsMask)
+        np.copyto(v,0.0,where=self.wsMask)
         return v
     
     #Following eq 20 of X. Wan, J. Fan, J. Therm Biol, 33, 2008, 87-97
 #    @jit
-    def getQti(self,temperature):
-        return (temperature[:,3]-self.To)*self.hc*self.bodySurfaceArea
+    def getQti(self,temperature,out=None):
+        Qt = np.subtract(temperature[:,3],self.To,out=out)
+        np.multiply(Qt,self.hc,out=Qt)
+        return np.multiply(Qt,self.bodySurfaceArea,out=Qt)
     
 #    @jit
-    def RES(self):
+    def getRESFactor(self):
         #Using part of the head and chest to calculate Respiratory exchange
         #ta = np.sum(self.Ta[self.headDofs]*self.headSurfaceFactors)*0.3
         #ta = ta + np.sum(self.Ta[self.chestDofs]*self.chestSurfaceFactors)
@@ -277,58 +448,354 @@ class Tanabe65MNModel(object):
         ta = 0.5*( ta + np.sum(self.Ta[self.chestDofs]*self.bodySurfaceArea[self.chestDofs])/np.sum(self.bodySurfaceArea[self.chestDofs]))
         #Since vapour pressure is of interest
         pa  = self.relativeHumdity*0.61078*np.exp(17.625*ta/(ta+237.3)) #Units kpa
+        return (0.0014*(34-ta)+0.017*(5.867-pa))
+    
+    def RES(self):
         #return (0.0014*(34-ta)+0.017*(5.867-pa))*(np.sum(np.sum(self.Qij)))*self.chestSurfaceFactors
-        return (0.0014*(34-ta)+0.017*(5.867-pa))*(np.sum(np.sum(self.Qij)))
+        self.updateInvariantTerms()
+        return self.resFactor*(np.sum(np.sum(self.Qij)))
                 
     def dTbydt(self,temp):
         temperature = np.reshape(temp[0:-1], (-1,4))
         cbcTemp = temp[-1]
         #self.getW() Needs to be computed only once
+        self.updateInvariantTerms()
         self.computeErrCldsWrms(temperature)
-        self.getQ()
+        Qij = self.getQ()
         
-        BFS = (self.basalBloodFlow +(self.W + self.Ch)/1.16)
+        BFS = np.add(self.W,self.Ch,out=self.wsBFS)
+        np.divide(BFS,1.16,out=BFS)
+        np.add(self.basalBloodFlow,BFS,out=BFS)
         #Compute BF For skin
-        BFS[:,3] = self.km*(self.basalBloodFlow[:,3] + self.SKINV*self.DL)/(1.0+self.SKINC*self.ST)
-        BF = self.alpha*self.rhoC*BFS*(temperature - cbcTemp)
-        D  = self.thermalConductance*(temperature[:,0:3]-temperature[:,1:])
+        a,b = self.wsVector[0:2]
+        np.multiply(self.SKINV,self.DL,out=a)
+        np.add(self.basalBloodFlow[:,3],a,out=a)
+        np.multiply(self.km,a,out=a)
+        np.multiply(self.SKINC,self.ST,out=b)
+        np.add(1.0,b,out=b)
+        np.divide(a,b,out=BFS[:,3])
+        BF = np.multiply(self.alpha*self.rhoC,BFS,out=self.wsBF)
+        np.multiply(BF,np.subtract(temperature,cbcTemp,out=self.wsTdiff),out=BF)
+        D  = np.subtract(temperature[:,0:3],temperature[:,1:],out=self.wsD)
+        np.multiply(self.thermalConductance,D,out=D)
 
-        Qt = self.getQti(temperature)
-        Emax  = self.getEmax(temperature)
+        Qt = self.getQti(temperature,out=self.wsVector[0])
+        Emax  = self.getEmax(temperature,out=self.wsVector[1])
         Esw = self.Esw
-        Esw[Esw<0] = 0.0
-        Eb = self.eswScaleFactor*(Emax-Esw)
-        E =  Eb + Esw
-        ix = E>Esw
-        E[ix] = Esw[ix]
-        self.dT[:,0] = self.Qij[:,0] - BF[:,0] - D[:,0]
-        self.dT[:,1] = self.Qij[:,1] - BF[:,1] + D[:,0] - D[:,1]
-        self.dT[:,2] = self.Qij[:,2] - BF[:,2] + D[:,1] - D[:,2]
+        mask = self.wsMask
+        np.less(Esw,0,out=mask)
+        np.copyto(Esw,0.0,where=mask)
+        E = np.subtract(Emax,Esw,out=self.wsVector[2])
+        np.multiply(self.eswScaleFactor,E,out=E)
+        np.add(E,Esw,out=E)
+        np.greater(E,Esw,out=mask)
+        np.copyto(E,Esw,where=mask)
+        dT = self.dT
+        for j in range(3):
+            np.subtract(Qij[:,j],BF[:,j],out=dT[:,j])
+            if j > 0:
+                np.add(dT[:,j],D[:,j-1],out=dT[:,j])
+            np.subtract(dT[:,j],D[:,j],out=dT[:,j])
         #The manner in which Qt and E are computed impacts the temperature change
         #if this DT is zero, the temperatures are near the initial temperature
-        self.dT[:,3] = self.Qij[:,3] - BF[:,3] + D[:,2] - Qt - E + self.radiationHeatFlux[:,0]
+        dT3 = np.subtract(Qij[:,3],BF[:,3],out=dT[:,3])
+        np.add(dT3,D[:,2],out=dT3)
+        np.subtract(dT3,Qt,out=dT3)
+        np.subtract(dT3,E,out=dT3)
+        np.add(dT3,self.radiationHeatFlux[:,0],out=dT3)
         #Do RES for chest
 
-        self.dT[self.chestDofs,0] -= self.RES()
-        #dT = np.divide(self.dT,self.heatCapacity)
-        dT = self.dT/self.heatCapacity
-        dcbc = np.sum(np.sum(BF))/self.cbcheatCapacity
-         
-        self.dtc[0:-1] = np.reshape(dT,(-1,1))[:,0]
-        self.dtc[-1] = dcbc
+        dT[self.chestIndexes,0] -= self.RES()
+        np.divide(dT,self.heatCapacity,out=np.reshape(self.dtc[0:-1],(-1,4)))
+        self.dtc[-1] = np.sum(np.sum(BF))/self.cbcheatCapacity
         return self.dtc
-     
-    def solve(self,targetT):
-        temperature = np.zeros(self.nDofs*4+1)
-        temperature[0:-1] = np.reshape(self.temperature, (-1,1))[:,0]
-        temperature[-1] = self.cbcTemp
+
+    def dTbydtJacobianFactors(self,temp):
+        '''
+        Jacobian of dTbydt split as J = L + U*G
+        L - sparse local part, the four layer tridiagonal of each face and its coupling with the central blood compartment
+        U,G - (n x 3) and sparse (3 x n) factors of the low rank coupling through Err11, Wrms and Clds
+        '''
+        self.dTbydt(temp)
+        temperature = np.reshape(temp[0:-1], (-1,4))
+        cbcTemp = temp[-1]
+        nDofs = self.nDofs
+        n = nDofs*4+1
+        dofs = np.arange(nDofs)
+        ln2by10 = np.log(2.0)/10.0
+        cr = self.alpha*self.rhoC
+        K = self.thermalConductance
+        dTs = temperature - cbcTemp
+
+        BFS = (self.basalBloodFlow +(self.W + self.Ch)/1.16)
+        stf = 1.0+self.SKINC*self.ST
+        BFS[:,3] = self.km*(self.basalBloodFlow[:,3] + self.SKINV*self.DL)/stf
+        #Evaporative loss, E = Esw when Emax > Esw else Esw + eswScaleFactor*(Emax-Esw)
+        T3 = temperature[:,3]
+        Psk = 0.61078*np.exp(17.625*T3/(T3+237.3))
+        Emax = self.getEmax(temperature)
+        dEmax = self.emaxFactor*Psk*17.625*237.3/np.square(T3+237.3)*self.bodySurfaceArea/self.lhm
+        dEmax[Emax<=0] = 0.0
+        Esw = self.Esw
+        saturated = Emax > Esw
+        dEdEsw = np.where(saturated,1.0,1.0-self.eswScaleFactor)
+        dEdEmax = np.where(saturated,0.0,self.eswScaleFactor)
+        dE = dEdEsw*np.where(Esw>0,Esw*ln2by10,0.0) + dEdEmax*dEmax
+
+        diag = np.zeros((nDofs,4))
+        diag[:,0] = -cr*BFS[:,0] - K[:,0]
+        diag[:,1] = -cr*BFS[:,1] - K[:,0] - K[:,1]
+        diag[:,2] = -cr*BFS[:,2] - K[:,1] - K[:,2]
+        diag[:,3] = -cr*BFS[:,3]*(1.0+ln2by10*dTs[:,3]) - K[:,2] - self.hc*self.bodySurfaceArea - dE
+        dBF = cr*BFS
+        dBF[:,3] *= (1.0+ln2by10*dTs[:,3])
+
+        rows = [4*dofs[:,np.newaxis]+np.arange(4)]
+        cols = [rows[0]]
+        vals = [diag/self.heatCapacity]
+        for j in range(3):
+            rows.append(4*dofs+j)
+            cols.append(4*dofs+j+1)
+            vals.append(K[:,j]/self.heatCapacity[:,j])
+            rows.append(4*dofs+j+1)
+            cols.append(4*dofs+j)
+            vals.append(K[:,j]/self.heatCapacity[:,j+1])
+        #Central blood compartment column and row
+        rows.append(np.arange(n-1))
+        cols.append(np.full(n-1,n-1))
+        vals.append(cr*BFS/self.heatCapacity)
+        rows.append(np.full(n-1,n-1))
+        cols.append(np.arange(n-1))
+        vals.append(dBF/self.cbcheatCapacity)
+        rows.append(np.array([n-1]))
+        cols.append(np.array([n-1]))
+        vals.append(np.array([-cr*np.sum(BFS)/self.cbcheatCapacity]))
+        L = sparse.coo_matrix((np.concatenate([np.ravel(v) for v in vals]),\
+                               (np.concatenate([np.ravel(r) for r in rows]),np.concatenate([np.ravel(c) for c in cols]))),shape=(n,n)).tocsc()
+
+        #Gradients of Err11, Wrms and Clds
+        headDofs = dofs[self.headDofs]
+        wrmActive = self.Err[:,3] > 0
+        cldActive = self.Err[:,3] < 0
+        G = sparse.coo_matrix((np.concatenate([self.headSurfaceFactors,self.SKINR_norm[wrmActive],-self.SKINR_norm[cldActive]]),\
+                               (np.concatenate([np.zeros(headDofs.shape[0]),np.ones(np.sum(wrmActive)),np.full(np.sum(cldActive),2)]),\
+                                np.concatenate([4*headDofs,4*dofs[wrmActive]+3,4*dofs[cldActive]+3]))),shape=(3,n)).tocsr()
+
+        e11 = self.Err11
+        Wrm11 = max(e11,0.0)
+        Cld11 = max(-e11,0.0)
+        chActive = self.Ch[:,1] > 0
+        da = np.array([-self.Cch - self.Pch*self.Clds*(e11<0), -self.Sch, self.Sch + self.Pch*Cld11])
+        db = np.array([self.Cdl + self.Pdl*self.Wrms*(e11>0), self.Sdl + self.Pdl*Wrm11, -self.Sdl])*(self.DL>0)
+        dd = np.array([-self.Cst - self.Pst*self.Clds*(e11<0), -self.Sst, self.Sst + self.Pst*Cld11])*(self.ST>0)
+        df = np.array([self.Csw + self.Psw*self.Wrms*(e11>0), self.Ssw + self.Psw*Wrm11, -self.Ssw])
+
+        dCh = (chActive*self.chit)[:,np.newaxis]*da
+        dBFS3 = self.km[:,np.newaxis]*((self.SKINV/stf)[:,np.newaxis]*db \
+                                       - ((self.basalBloodFlow[:,3] + self.SKINV*self.DL)*self.SKINC/np.square(stf))[:,np.newaxis]*dd)
+        dEsw = ((Esw>0)*self.SKINS*self.km)[:,np.newaxis]*df
+        U = np.zeros((n,3))
+        Uf = np.reshape(U[0:-1],(nDofs,4,3))
+        Uf[:,1,:] = dCh - cr*(dCh/1.16)*dTs[:,1,np.newaxis]
+        Uf[:,3,:] = -cr*dBFS3*dTs[:,3,np.newaxis] - dEdEsw[:,np.newaxis]*dEsw
+        Uf[self.chestDofs,0,:] -= self.resFactor*np.sum(dCh,axis=0)
+        Uf /= self.heatCapacity[:,:,np.newaxis]
+        U[-1] = cr*np.sum((dCh/1.16)*dTs[:,1,np.newaxis] + dBFS3*dTs[:,3,np.newaxis],axis=0)/self.cbcheatCapacity
+        return L,U,G
+
+    def dTbydtJacobian(self,temp,includeGlobalCoupling=None):
+        '''
+        Sparse jacobian of dTbydt
+        includeGlobalCoupling - add the dense Err11/Wrms/Clds coupling terms, defaults to True for models with
+        at most globalCouplingDofLimit dofs. When omitted the result is the local (face + blood compartment) jacobian
+        '''
+        if includeGlobalCoupling is None:
+            includeGlobalCoupling = self.nDofs <= self.globalCouplingDofLimit
+        L,U,G = self.dTbydtJacobianFactors(temp)
+        if includeGlobalCoupling:
+            return (L + sparse.csc_matrix(U)*G).tocsc()
+        return L
+
+    def getJacobianSparsity(self,includeGlobalCoupling=None):
+        '''
+        Structural nonzero pattern of dTbydtJacobian, suitable for finite difference colouring
+        '''
+        if includeGlobalCoupling is None:
+            includeGlobalCoupling = self.nDofs <= self.globalCouplingDofLimit
+        nDofs = self.nDofs
+        n = nDofs*4+1
+        dofs = np.arange(nDofs)
+        rows = [np.repeat(4*dofs,4)+np.tile(np.arange(4),nDofs)]
+        cols = [rows[0]]
+        for j in range(3):
+            rows.extend([4*dofs+j,4*dofs+j+1])
+            cols.extend([4*dofs+j+1,4*dofs+j])
+        rows.extend([np.arange(n),np.full(n,n-1)])
+        cols.extend([np.full(n,n-1),np.arange(n)])
+        if includeGlobalCoupling:
+            coupledRows = np.concatenate([4*dofs+1,4*dofs+3,4*dofs[self.chestDofs],[n-1]])
+            coupledCols = np.concatenate([4*dofs[self.headDofs],4*dofs+3])
+            rows.append(np.repeat(coupledRows,coupledCols.shape[0]))
+            cols.append(np.tile(coupledCols,coupledRows.shape[0]))
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        pattern = sparse.coo_matrix((np.ones(rows.shape[0]),(rows,cols)),shape=(n,n)).tocsc()
+        pattern.data[:] = 1.0
+        return pattern
+
+    def setIntegrator(self,integrator='bdf',**options):
+        '''
+        Select the time integration backend used by solve
+        integrator - name of a backend in thermoregulation.Integrators.integratorBackends ('bdf','radau','implicit-euler',
+                     or 'lsoda' and 'vode' which assemble dense jacobians and are refused for large models)
+                     or a ThermoregulationIntegrator instance
+        options - backend settings, for instance rtol, atol, useAnalyticJacobian, timeStep (implicit-euler)
+        '''
+        if isinstance(integrator,ThermoregulationIntegrator):
+            integrator.setTolerances(**{k:options[k] for k in ['rtol','atol'] if k in options})
+            self.integratorName = integrator.name
+            self.integrator = integrator
+        else:
+            checkIntegrator(integrator,self.getState().shape[0])
+            self.integratorName = integrator
+            self.integratorOptions = dict(options)
+            self.integrator = None
+        self.resetIntegration()
+
+    def setContinuousIntegration(self,flag=True):
+        '''
+        When set, the integrator and its history are kept across calls to solve, and the requested times are sampled
+        from its dense output. Otherwise the integrator is restarted on every call
+        '''
+        self.continuousIntegration = flag
+        self.resetIntegration()
+
+    def setStopConditions(self,conditions=None):
+        '''
+        conditions - list of StopCondition instances or definitions (see thermoregulation.StopConditions), for instance
+                     [{'type':'rectalTemperature','threshold':39.0},{'type':'pmv','threshold':3.0}]
+        The integrator checks the conditions as events, solve ends at the first crossing and records stopTime and stopReason
+        '''
+        if conditions is None:
+            conditions = []
+        self.stopConditions = [createStopCondition(c) for c in conditions]
+        self.clearStop()
+        self.resetIntegration()
         
-        def dTbydt(time,temp,obj):
-            return obj.dTbydt(temp)
+    def getStopConditions(self):
+        return self.stopConditions
         
-        def JacdTbydt(time,temp,obj):
-            #The argument is passed to jac function too 
-            return self.dt2bydt2(temp)
+    def clearStop(self):
+        self.stopTime = None
+        self.stopReason = None
+        
+    def isStopped(self):
+        return self.stopTime is not None
+        
+    def getStopConditionDirections(self):
+        '''
+        Crossing direction of each event returned by evaluateStopConditions
+        '''
+        return [c.direction for c in self.stopConditions]
+        
+    def stopAtEvent(self,index,t,state):
+        '''
+        Called by solve when the integrator reaches event index at time t, returns True to end the integration there
+        '''
+        self.stopTime = t
+        self.stopReason = self.stopConditions[index].getReason()
+        return True
+        
+    def evaluateStopConditions(self,t,state):
+        '''
+        Event function for the integrator, the stop condition values (negative before the crossing) at time t and state
+        '''
+        self.updateBoundaryConditions(t)
+        self.setState(state)
+        if any(c.requiresDerivedQuantities for c in self.stopConditions):
+            self.updateDerivedQuantities()
+        return np.array([c(self) for c in self.stopConditions],dtype=np.float64)
+
+    def checkStopConditionCrossing(self,previousValues):
+        '''
+        Stop at the current time if a condition crossed its threshold between previousValues (evaluateStopConditions
+        before the state was changed without integration, e.g. by solveSteadyState) and the current state
+        Returns True if the model was stopped
+        '''
+        if len(self.stopConditions) == 0:
+            return False
+        state = self.getState()
+        values = self.evaluateStopConditions(self.simulationTime,state)
+        for index,condition in enumerate(self.stopConditions):
+            before,after = previousValues[index],values[index]
+            if (condition.direction >= 0 and before < 0 <= after) or (condition.direction <= 0 and before > 0 >= after):
+                return self.stopAtEvent(index,self.simulationTime,state)
+        return False
+
+    def parametersChanged(self):
+        '''
+        Mark the activity invariant terms as stale and restart the integration, called by the boundary condition setters
+        '''
+        self.parameterEpoch += 1
+        self.resetIntegration()
+
+    def updateInvariantTerms(self):
+        '''
+        Compute the terms of dTbydt that only depend on the boundary conditions (ambient vapour pressure, respiratory factor)
+        '''
+        if self.invariantTermsEpoch == self.parameterEpoch and self.workspaceSize == self.nDofs:
+            return
+        if self.workspaceSize != self.nDofs:
+            self.allocateWorkspace()
+        Pa = self.ambientVapourPressure
+        np.multiply(17.625,self.Ta,out=Pa)
+        np.divide(Pa,self.Ta+237.3,out=Pa)
+        np.exp(Pa,out=Pa)
+        np.multiply(self.relativeHumdity*0.61078,Pa,out=Pa) #Units kpa 
+        self.resFactor = self.getRESFactor()
+        self.invariantTermsEpoch = self.parameterEpoch
+
+    def resetIntegration(self):
+        '''
+        Discard the integrator history, the next call to solve restarts the integrator from the current state
+        '''
+        self.integrationState = None
+
+    def advanceTime(self,dt):
+        '''
+        Move the simulation time on by dt without integrating, e.g. while the model is held at a steady state
+        The boundary conditions are updated to the new time and the integrator history is discarded
+        '''
+        self.simulationTime += dt
+        self.updateBoundaryConditions(self.simulationTime)
+        self.resetIntegration()
+
+    def getIntegrator(self):
+        '''
+        Returns the integrator backend, creating it from integratorName and integratorOptions if required
+        '''
+        if getattr(self,'integrator',None) is None:
+            options = {'rtol':self.rtol,'atol':self.atol}
+            options.update(self.integratorOptions)
+            self.integrator = createIntegrator(self.integratorName,self.getState().shape[0],**options)
+        return self.integrator
+
+    def getIntegratorStatistics(self):
+        '''
+        Steps, rhs and jacobian evaluation counts of the integrator backend, accumulated over solve calls
+        '''
+        return self.getIntegrator().getStatistics()
+
+    def solve(self,targetT,storeIntermediateStates=False):
+        '''
+        Integrate the model from its current state
+        targetT - duration in seconds, or a list/array of times [t0, t1, ..., tn] relative to t0 at which the state is required
+        storeIntermediateStates - return the states at t1..tn as an array of shape (n, nDofs*4+1)
+        The integrator chooses its own internal steps, the model temperatures are set to the state at the final time
+        If a stop condition is crossed the integration ends there, stopTime and stopReason are set and only the states
+        up to the crossing are returned (the last row being the state at the crossing)
+        '''
+        temperature = self.getState()
         
         tl = [0, targetT]
         if isinstance(targetT,np.ndarray):
@@ -336,22 +803,52 @@ class Tanabe65MNModel(object):
         elif isinstance(targetT,list):
             tl = targetT
 
-        r = ode(dTbydt).set_integrator('vode',method='bdf')
-        #r = ode(dTbydt).set_integrator('dopri5')
-        r.set_initial_value(temperature, tl[0]).set_f_params(self).set_jac_params(self)
-        ts = 1
-        if tl[-1]>1:
-            ts = np.ceil(tl[-1]/1)
-
-        dt = float(tl[-1])/ts
-        while r.successful() and r.t < tl[-1]:
-            temperature = r.integrate(r.t+dt)                
-            self.temperature = np.reshape(temperature[:-1], (-1,4))
-            self.cbcTemp = temperature[-1]
-        if r.t < tl[-1]:
-            temperature = r.integrate(tl[-1])                
-            self.temperature = np.reshape(temperature[:-1], (-1,4))
-            self.cbcTemp = temperature[-1]
+        #Times are relative to the end of the previous solve
+        offset = self.simulationTime - tl[0]
+        integrator = self.getIntegrator()
+        restart = True
+        if not self.continuousIntegration:
+            integrator.initialize(self,self.simulationTime,temperature,offset+tl[-1])
+        elif self.integrationState is None or not np.array_equal(self.integrationState,temperature):
+            #Restart if the state was changed since the last solve
+            integrator.initialize(self,self.simulationTime,temperature,np.inf)
+        else:
+            restart = False
+        if restart:
+            if len(self.stopConditions) > 0:
+                integrator.setEvents(self.evaluateStopConditions,self.getStopConditionDirections())
+            else:
+                integrator.setEvents(None)
+        states = None
+        if storeIntermediateStates:
+            states = np.zeros((len(tl)-1,temperature.shape[0]))
+        endTime = offset + tl[-1]
+        for i,tv in enumerate(tl[1:]):
+            temperature = integrator.integrate(offset+tv)
+            event = integrator.getEvent()
+            #Events that do not end the integration (see stopAtEvent) continue from the event state
+            while event is not None and not self.stopAtEvent(event[0],event[1],temperature):
+                temperature = integrator.integrate(offset+tv)
+                event = integrator.getEvent()
+            if storeIntermediateStates:
+                states[i] = temperature
+            if event is not None:
+                endTime = event[1]
+                if storeIntermediateStates:
+                    states = states[:i+1]
+                break
+        self.setState(temperature)
+        self.simulationTime = endTime
+        self.updateBoundaryConditions(endTime)
+        self.integrationState = temperature
+        self.updateDerivedQuantities()
+        return states
+
+    def updateDerivedQuantities(self):
+        '''
+        Update the rates, control signals and skin wettedness at the current state
+        '''
+        self.dTbydt(self.getState())
                     
         #Compute the wettedness based on the final value
         Emax = self.getEmax(self.temperature)
@@ -359,7 +856,58 @@ class Tanabe65MNModel(object):
         Esw = self.Esw
         Esw[Esw<0] = 0.0        
         self.wettedness = 0.06 + 0.94*Esw/Emax #Using formula 14 of Journal of Atmaca and Yigit, Thermal Biology 31 (2006) 442-452 
-        
+
+    def solveSteadyState(self,initialState=None,tolerance=1e-8,initialTimeStep=10.0,maxTimeStep=1e12,maxIterations=50):
+        '''
+        Find the equilibrium dTbydt = 0 for the current boundary conditions by pseudo transient continuation,
+        (I/tau - J) dy = dTbydt(y), with the pseudo time step tau increased as the residual decreases (switched
+        evolution relaxation), so the iteration turns into Newton's method near the solution
+        A step whose residual exceeds the largest of the last few accepted residuals is rejected and retried from
+        the previous state with a smaller tau, rejected steps count as iterations
+        initialState - starting guess, defaults to the current state (e.g. a previous steady state)
+        tolerance - convergence threshold on max |dT/dt| (C/s)
+        On success the model temperatures, wettedness etc are set as after solve and the state vector is returned
+        '''
+        if initialState is None:
+            y = self.getState()
+        else:
+            y = np.array(initialState,dtype=np.float64)
+        n = y.shape[0]
+        identity = sparse.identity(n,format='csc')
+        tau = initialTimeStep
+        F = np.array(self.dTbydt(y))
+        residual = np.max(np.abs(F))
+        #max |dT/dt| is not monotone along the physical transient, steps are compared with a window of accepted residuals
+        history = [residual]
+        factors = None
+        self.steadyStateIterations = 0
+        for it in range(maxIterations+1):
+            if not np.isfinite(residual):
+                break
+            if residual < tolerance:
+                self.steadyStateIterations = it
+                self.setState(y)
+                self.resetIntegration()
+                self.updateDerivedQuantities()
+                return y
+            if it == maxIterations:
+                break
+            if factors is None:
+                factors = self.dTbydtJacobianFactors(y)
+            L,U,G = factors
+            LU = LowRankUpdateLU(identity/tau - L,U,G,1.0,self.jacobianBlockSize)
+            yn = y + LU.solve(F)
+            Fn = np.array(self.dTbydt(yn))
+            norm = np.max(np.abs(Fn))
+            if not np.isfinite(norm) or norm > max(history[-5:]):
+                #Reject the step, the Jacobian at y is reused with a smaller pseudo time step
+                tau *= 0.25
+                continue
+            tau = min(tau*residual/norm,maxTimeStep)
+            y,F,residual = yn,Fn,norm
+            history.append(residual)
+            factors = None
+        raise RuntimeError('Steady state iteration did not converge, max |dT/dt| %s after %d iterations'%('%g'%residual if np.isfinite(residual) else residual,maxIterations))
 
     def getSkinWettedness(self):
         return self.wettedness
@@ -373,11 +921,7 @@ class Tanabe65MNModel(object):
         return np.sum(tcr)/np.sum(self.bodySurfaceArea)    
     
     def printSegmentTemperatures(self):
-        self.segmentTemp = np.zeros((16,4))
-        wTemps = self.temperature*self.humanModel.surfaceFactors[:,np.newaxis]
-        for i in range(16):
-            indexes = self.humanModel.dofIndexes[i]
-            self.segmentTemp[i,:] = np.sum(wTemps[indexes,:],axis=0)
+        self.segmentTemp = self.segmentAggregator.sum(self.temperature,self.humanModel.surfaceFactors)
         
         def getSegmentTemperatures(j):
             stemp = self.segmentTemp[:,j] 
@@ -405,29 +949,26 @@ class Tanabe65MNModel(object):
         print(getCoreTemperatures())
         print(self.cbcTemp)
 
+    def getMeanSegmentCoreTemperatures(self):
+        return self.segmentAggregator.mean(self.temperature[:,0],self.bodySurfaceArea)
+
+    def getMeanSegmentSkinTemperatures(self):
+        return self.segmentAggregator.mean(self.temperature[:,3],self.bodySurfaceArea)
+
     def getMeanSegmentCoreTemperature(self,i):
-        indexes = self.humanModel.dofIndexes[i]
-        psa = self.bodySurfaceArea[indexes]
-        tcr = self.temperature[indexes,0]*psa
-        return np.sum(tcr)/np.sum(psa)
+        return self.getMeanSegmentCoreTemperatures()[i]
     
     def getMeanSegmentSkinTemperature(self,i):
-        indexes = self.humanModel.dofIndexes[i]
-        psa = self.bodySurfaceArea[indexes]
-        tcr = self.temperature[indexes,3]*psa
-        return np.sum(tcr)/np.sum(psa)
+        return self.getMeanSegmentSkinTemperatures()[i]
 
     def getSegmentCoreTemperature(self,i):
-        indexes = self.humanModel.dofIndexes[i]
-        return self.temperature[indexes,0]
+        return self.temperature[self.segmentAggregator.getFaces(i),0]
     
     def getSegmentSkinTemperature(self,i):
-        indexes = self.humanModel.dofIndexes[i]
-        return self.temperature[indexes,3]
+        return self.temperature[self.segmentAggregator.getFaces(i),3]
     
     def getSegmentSkinWettedness(self,i):    
-        indexes = self.humanModel.dofIndexes[i]
-        return self.wettedness[indexes]
+        return self.wettedness[self.segmentAggregator.getFaces(i)]
     
     def getTemperature(self):
         return self.temperature
@@ -448,100 +989,41 @@ class Tanabe65MNModel(object):
     def getRectalTemperature(self):
         #Defined as i=4,j=1 by X. Wan, J.Fan
         #Here we use pelvis core
-        psa = self.bodySurfaceArea[self.humanModel.dofIndexes[3]]
-        tcr = self.temperature[self.humanModel.dofIndexes[3],0]*psa
-        return np.sum(tcr)/np.sum(psa)    
+        return self.getMeanSegmentCoreTemperatures()[3]
 
 
     def FangerPMV(self,vel = 0.0,wme=0):
-        pa = self.relativeHumdity * 10 * np.exp(16.6536 - 4030.183 / (self.Ta[0] + 235));
+        '''
+        Returns the Fanger pmv and ppd, both nan if the clothing surface temperature iteration does not converge
+        '''
         #icl = np.sum(self.hc*self.bodySurfaceArea)/np.sum(self.bodySurfaceArea) #thermal insulation of the clothing in M2K/W
         icl = 0.10
-        m = self.met * 58.15 #metabolic rate in W/M2
-        w = wme * 58.15 #external work in W/M2
-        mw = m - w #internal heat production in the human body
-        if icl <= 0.078:
-            fcl = 1 + (1.29 * icl)
-        else:
-            fcl = 1.05 + (0.645 * icl)
-
-        #heat transf. coeff. by forced convection
-        hcf = 12.1 * np.sqrt(vel)
-        taa = self.Ta[0] + 273
-        tra = np.mean(self.Tr) + 273
-        tcla = taa + (35.5 - self.Ta[0]) / (3.5 * icl + 0.1)
-
-        p1 = icl * fcl
-        p2 = p1 * 3.96
-        p3 = p1 * 100
-        p4 = p1 * taa
-        p5 = 308.7 - 0.028 * mw + p2 * pow(tra / 100, 4)
-        xn = tcla / 100
-        xf = tcla / 50
-        eps = 0.00015
-
-        n = 0
-        while (abs(xn - xf) > eps) :
-            xf = (xf + xn) / 2
-            hcn = 2.38 * pow(abs(100.0 * xf - taa), 0.25);
-            if (hcf > hcn):
-                hc = hcf
-            else:
-                hc = hcn
-            xn = (p5 + p4 * hc - p2 * pow(xf, 4)) / (100 + p3 * hc)
-            n = n + 1
-            if (n > 150) :
-                print('Max iterations exceeded')
-                return 1
-
-        tcl = 100 * xn - 273
-
-        #heat loss diff. through skin
-        hl1 = 3.05 * 0.001 * (5733 - (6.99 * mw) - pa);
-        #heat loss by sweating
-        if (mw > 58.15):
-            hl2 = 0.42 * (mw - 58.15)
-        else:
-            hl2 = 0
-        #latent respiration heat loss
-        hl3 = 1.7 * 0.00001 * m * (5867 - pa)
-        #dry respiration heat loss
-        hl4 = 0.0014 * m * (34 - self.Ta[0])
-        #heat loss by radiation
-        hl5 = 3.96 * fcl * (pow(xn, 4) - pow(tra / 100, 4))
-        #heat loss by convection
-        hl6 = fcl * hc * (tcl - self.Ta[0])
-
-        ts = 0.303 * np.exp(-0.036 * m) + 0.028;
-        pmv = ts * (mw - hl1 - hl2 - hl3 - hl4 - hl5 - hl6)
-        ppd = 100.0 - 95.0 * np.exp(-0.03353 * pow(pmv, 4.0) - 0.2179 * pow(pmv, 2.0))
-
-        return pmv,ppd
+        pmv,ppd = self.fangerComfortModel.computePMVArrays(self.Ta[0],np.mean(self.Tr),vel,self.relativeHumdity,self.met,wme,icl)
+        if np.isnan(pmv):
+            logging.warning('Fanger PMV: clothing surface temperature did not converge within %d iterations'%self.fangerComfortModel.maxIterations)
+        return pmv[()],ppd[()]
     
     def save(self,filename):
         with open(filename,'w') as ser:
             pickle.dump([self.temperature,self.dT,self.humanModel.dofIndexes],ser)
            
             
+    def getZhangComfortInputs(self):
+        '''
+        Segment mean skin temperature, skin rate, core temperature, core rate and skin set point temperature
+        (16 values each), as expected by ZhangModel.computePMVArrays
+        '''
+        segmentMean = self.segmentAggregator.mean
+        return segmentMean(self.temperature[:,3]),segmentMean(self.dT[:,3]/self.heatCapacity[:,3]),\
+               segmentMean(self.temperature[:,0]),segmentMean(self.dT[:,0]/self.heatCapacity[:,0]),\
+               self.segmentAggregator.first(self.setPointTemperature[:,3])
+            
     def ZhangPMVPPD(self):
         '''
         Based on A human thermal model for improved thermal comfort, PhD Thesis
         '''        
-        keys = ['Head','Chest','Back','Pelvis','L-shoulder','R-shoulder','L-arm','R-arm','L-hand','R-hand','L-thigh','R-thigh','L-leg','R-leg','L-foot','R-foot']
-        
-        sixteenSegmentSkinTempAndDt = dict()
-        sixteenSegmentCoreTempAndDt = dict()
-        setPointTemperature = dict()
-        for i in range(16):
-            ast = np.mean(self.temperature[self.humanModel.dofIndexes[i],3])
-            asdt =np.mean(self.dT[self.humanModel.dofIndexes[i],3]/self.heatCapacity[self.humanModel.dofIndexes[i],3])
-            act = np.mean(self.temperature[self.humanModel.dofIndexes[i],0])
-            acdt =np.mean(self.dT[self.humanModel.dofIndexes[i],0]/self.heatCapacity[self.humanModel.dofIndexes[i],0])
-            sixteenSegmentSkinTempAndDt[keys[i]] = [ast,asdt]
-            sixteenSegmentCoreTempAndDt[keys[i]] = [act,acdt]
-            setPointTemperature[keys[i]] = self.setPointTemperature[self.humanModel.dofIndexes[i]][0,3]
-
-        return self.zhangComfortModel.computePMV(sixteenSegmentSkinTempAndDt,sixteenSegmentCoreTempAndDt,setPointTemperature)
+        pmv,ppd,sensation = self.zhangComfortModel.computePMVArrays(*self.getZhangComfortInputs())
+        return pmv[0],ppd[0],self.zhangComfortModel.getSensationLabel(sensation[0])
         
 
 class Tanabe65MNProjectedToStandard16(Tanabe65MNModel):
@@ -565,6 +1047,8 @@ class Tanabe65MNProjectedToStandard16(Tanabe65MNModel):
         #humanParam.updateToParameterModel(humanModel.bodyDataModel)
         super(Tanabe65MNProjectedToStandard16, self).__init__(humanParam)
         self.myDofIndexes = humanModel.dofIndexes
+        self.mySegmentLabels = getSegmentLabels(humanModel)
+        self.mySegmentAggregator = SegmentAggregator(self.mySegmentLabels)
         self.mySurfaceFaceAreas = humanModel.surfaceFaceAreas
         self.myDofs = humanModel.numberOfFaces
         self.projectTemperature = np.zeros((self.myDofs,4))
@@ -572,46 +1056,32 @@ class Tanabe65MNProjectedToStandard16(Tanabe65MNModel):
     def getDofIndexes(self):
         return self.myDofIndexes
 
+    def getSegmentLabels(self):
+        return self.mySegmentLabels
+
     def getNumberOfDofs(self):
         return self.myDofs
     
     def getBodySurfaceArea(self):
-        rvals = np.zeros(self.myDofs)
-        for i in range(16):
-            rvals[self.myDofIndexes[i]] = self.bodySurfaceArea[i]
-        return rvals            
+        return self.mySegmentAggregator.scatter(self.bodySurfaceArea)
         
     def getSegmentCoreTemperature(self,i):
-        indexes = self.myDofIndexes[i]
-        return self.temperature[i,0]*np.ones(indexes.shape[0])
+        return self.temperature[i,0]*np.ones(self.mySegmentAggregator.counts[i])
     
     def getSegmentSkinTemperature(self,i):
-        indexes = self.myDofIndexes[i]
-        return self.temperature[i,3]*np.ones(indexes.shape[0])
+        return self.temperature[i,3]*np.ones(self.mySegmentAggregator.counts[i])
     
     def getSegmentSkinWettedness(self,i):    
-        indexes = self.myDofIndexes[i]
-        return self.wettedness[i]*np.ones(indexes.shape[0])
+        return self.wettedness[i]*np.ones(self.mySegmentAggregator.counts[i])
     
     def getSkinWettedness(self):
-        rvals = np.zeros(self.myDofs)
-        for i in range(16):
-            rvals[self.myDofIndexes[i]] = self.wettedness[i]
-        return rvals
+        return self.mySegmentAggregator.scatter(self.wettedness)
         
     def getTemperature(self):
-        for i in range(16):
-            self.projectTemperature[self.myDofIndexes[i],:] = self.temperature[i,:]
-        return self.projectTemperature
+        return self.mySegmentAggregator.scatter(self.temperature,out=self.projectTemperature)
     
     def getEffectiveThermalResistance(self):
-        rvals = np.zeros(self.myDofs)
-        for i in range(16):
-            rvals[self.myDofIndexes[i]] = self.hc[i]
-        return rvals
+        return self.mySegmentAggregator.scatter(self.hc)
             
     def getEffectiveEvaporativeResistance(self):
-        rvals = np.zeros(self.myDofs)
-        for i in range(16):
-            rvals[self.myDofIndexes[i]] = self.lhm[i]
-        return rvals
\ No newline at end of file
+        return self.mySegmentAggregator.scatter(self.lhm)
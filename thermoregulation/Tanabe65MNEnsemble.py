@@ -0,0 +1,561 @@
+'''
+   Version: Apache License  Version 2.0
+ 
+   The contents of this file are subject to the Apache License Version 2.0 ; 
+   you may not use this file except in
+   compliance with the License. You may obtain a copy of the License at
+   http://www.apache.org/licenses/
+ 
+   Software distributed under the License is distributed on an "AS IS"
+   basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+   License for the specific language governing rights and limitations
+   under the License.
+ 
+   The Original Code is ABI Comfort Simulator
+ 
+   The Initial Developer of the Original Code is University of Auckland,
+   Auckland, New Zealand.
+   Copyright (C) 2007-2018 by the University of Auckland.
+   All Rights Reserved.
+ 
+   Contributor(s): Jagir R. Hussan
+ 
+   Alternatively, the contents of this file may be used under the terms of
+   either the GNU General Public License Version 2 or later (the "GPL"), or
+   the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+   in which case the provisions of the GPL or the LGPL are applicable instead
+   of those above. If you wish to allow use of your version of this file only
+   under the terms of either the GPL or the LGPL, and not to allow others to
+   use your version of this file under the terms of the MPL, indicate your
+   decision by deleting the provisions above and replace them with the notice
+   and other provisions required by the GPL or the LGPL. If you do not delete
+   the provisions above, a recipient may use your version of this file under
+   the terms of any one of the MPL, the GPL or the LGPL.
+ 
+  "2019"
+ '''
+from __future__ import unicode_literals,print_function
+import copy
+import pickle
+import numpy as np
+from scipy import sparse
+from thermoregulation.Tanabe65MN import Tanabe65MNModel
+
+
+class Tanabe65MNEnsemble(Tanabe65MNModel):
+    '''
+    K independent Tanabe65MN models (subjects and/or environments) advanced together as one system
+    Temperatures are stacked as (K, nDofs, 4) arrays, the state vector holds the members one after the other
+    ([temperature_k (row major), cbcTemp_k] for k=0..K-1) so that the jacobian is block diagonal
+    The members should share the mesh (number of faces and segment labels), parameters may differ
+    Boundary conditions are set through the members (so clothing, radiation and projection logic is shared with
+    Tanabe65MNModel) and gathered into stacked arrays, the rhs and jacobian are evaluated for all members at once
+    Stop conditions are checked for every member, the crossing time and reason of each member are recorded in
+    memberStopTimes and memberStopReasons. A member that has crossed keeps being integrated with its conditions disabled,
+    solve ends when all members have crossed
+    '''
+    
+    def __init__(self,models,numberOfMembers=None):
+        '''
+        models - a list of configured Tanabe65MNModel (or Tanabe65MNProjectedToStandard16) instances, or a single
+                 instance that is replicated numberOfMembers times
+        '''
+        if isinstance(models,Tanabe65MNModel):
+            if numberOfMembers is None:
+                numberOfMembers = 1
+            models = [models] + [self.replicate(models) for _ in range(numberOfMembers-1)]
+        self.members = list(models)
+        self.numberOfMembers = len(self.members)
+        template = self.members[0]
+        for m in self.members[1:]:
+            if m.nDofs != template.nDofs or not np.array_equal(m.headDofs,template.headDofs) \
+               or not np.array_equal(m.chestDofs,template.chestDofs):
+                raise ValueError("Ensemble members should have the same number of faces and segment labels")
+        self.humanModel = template.humanModel
+        self.nDofs = template.nDofs
+        self.headDofs = template.headDofs
+        self.chestDofs = template.chestDofs
+        self.segmentLabels = template.segmentLabels
+        self.segmentAggregator = template.segmentAggregator
+        self.faceIndexes = template.faceIndexes
+        for name in ['heatCapacity','metabolicRate','setPointTemperature','basalBloodFlow','thermalConductance',\
+                     'chit','metf','SKINC','SKINR_norm','SKINS','SKINV','bodySurfaceArea','headSurfaceFactors',\
+                     'cbcSetPointTemperature','cbcheatCapacity','Qb',\
+                     'Cch','Sch','Pch','Csw','Ssw','Psw','Cdl','Sdl','Pdl','Cst','Sst','Pst']:
+            setattr(self,name,np.array([np.copy(getattr(m,name)) for m in self.members],dtype=np.float64))
+        self.temperature = np.array([m.temperature for m in self.members],dtype=np.float64)
+        self.cbcTemp = np.array([m.cbcTemp for m in self.members],dtype=np.float64)
+        self.Ch = np.zeros(self.temperature.shape)
+        self.Qij = np.zeros(self.temperature.shape)
+        self.dT = np.zeros(self.temperature.shape)
+        self.dtc = np.zeros((self.numberOfMembers,self.nDofs*4+1))
+        self.headIndexes = np.flatnonzero(self.headDofs)
+        self.chestIndexes = np.flatnonzero(self.chestDofs)
+        self.jacobianPattern = None
+        self.jacobianBlockSize = self.nDofs*4+1
+        self.clearStop()
+        self.gatherBoundaryConditions()
+        
+    @staticmethod
+    def replicate(model):
+        #Share the mesh and clothing definitions, copy everything else
+        memo = {id(model.humanModel):model.humanModel}
+        for name in ['clothingModel','integrator']:
+            if hasattr(model,name):
+                memo[id(getattr(model,name))] = None if name == 'integrator' else getattr(model,name)
+        return copy.deepcopy(model,memo)
+    
+    def clearStop(self):
+        super(Tanabe65MNEnsemble,self).clearStop()
+        self.memberStopTimes = np.full(self.numberOfMembers,np.nan)
+        self.memberStopReasons = [None]*self.numberOfMembers
+        
+    def getStopConditionDirections(self):
+        #One event per member and condition, ordered by member
+        return np.tile([c.direction for c in self.stopConditions],self.numberOfMembers)
+    
+    def evaluateStopConditions(self,t,state):
+        '''
+        Event function values of every member and condition, constant for members that have already crossed
+        '''
+        self.updateBoundaryConditions(t)
+        self.setState(state)
+        if any(c.requiresDerivedQuantities for c in self.stopConditions):
+            self.updateDerivedQuantities()
+        values = np.full((self.numberOfMembers,len(self.stopConditions)),-1.0)
+        for k in np.flatnonzero(np.isnan(self.memberStopTimes)):
+            member = self.getMember(k)
+            values[k] = [c(member) for c in self.stopConditions]
+        return np.reshape(values,(-1))
+        
+    def stopAtEvent(self,index,t,state):
+        '''
+        Record the crossing of a member and of the members whose conditions are as close to their thresholds at t
+        The integration continues with the crossed members' events disabled until all members have crossed
+        '''
+        numberOfConditions = len(self.stopConditions)
+        values = np.abs(np.reshape(self.evaluateStopConditions(t,state),(self.numberOfMembers,numberOfConditions)))
+        values[~np.isnan(self.memberStopTimes)] = np.inf
+        #The located root is only accurate to the event tolerance, members that cross at the same time (e.g. identical
+        #members) would otherwise be on the far side of their thresholds when the detection restarts
+        tolerance = values.flat[index]
+        values.flat[index] = 0.0
+        for i in np.flatnonzero(np.ravel(values) <= tolerance):
+            k,c = divmod(i,numberOfConditions)
+            if np.isnan(self.memberStopTimes[k]):
+                self.memberStopTimes[k] = t
+                self.memberStopReasons[k] = self.stopConditions[c].getReason()
+        if np.all(~np.isnan(self.memberStopTimes)):
+            self.stopTime = t
+            self.stopReason = 'All %d members stopped'%self.numberOfMembers
+            return True
+        #Restart the event detection from t with the crossed members disabled
+        self.getIntegrator().setEvents(self.evaluateStopConditions,self.getStopConditionDirections())
+        return False
+        
+    def setBoundaryConditionSchedule(self,schedule=None):
+        '''
+        schedule - BoundaryConditionSchedule shared by all members (see Tanabe65MNModel.setBoundaryConditionSchedule)
+        Each member interpolates the series with its own clothing model, the results are gathered into the stacked arrays
+        '''
+        for m in self.members:
+            m.simulationTime = self.simulationTime
+            m.setBoundaryConditionSchedule(schedule)
+        self.boundaryConditionSchedule = schedule
+        self.boundaryConditionTime = self.simulationTime
+        self.scheduleOrigin = self.simulationTime
+        self.collectBoundaryConditions()
+        self.parametersChanged()
+        
+    def updateBoundaryConditions(self,t):
+        schedule = self.boundaryConditionSchedule
+        if schedule is None or t is None or t == self.boundaryConditionTime:
+            return
+        self.boundaryConditionTime = t
+        for m in self.members:
+            m.updateBoundaryConditions(t)
+        self.collectBoundaryConditions()
+        #Invariant terms are recomputed on the next evaluation, the integration itself continues
+        self.parameterEpoch += 1
+        
+    def getNumberOfMembers(self):
+        return self.numberOfMembers
+    
+    def getMember(self,k):
+        '''
+        Returns member k with its state, rates and wettedness updated from the ensemble, so that the
+        single model getters (segment temperatures, ZhangPMVPPD, projection to the mesh...) can be used
+        '''
+        m = self.members[k]
+        m.temperature = np.array(self.temperature[k])
+        m.cbcTemp = self.cbcTemp[k]
+        m.dT = np.array(self.dT[k])
+        if hasattr(self,'wettedness'):
+            m.wettedness = np.array(self.wettedness[k])
+            m.Esw = np.array(self.Esw[k])
+        return m
+    
+    def forEachMember(self,values,setter):
+        '''
+        Call setter(member,value) for each member, values is either a single value or one value per member
+        '''
+        if isinstance(values,(list,tuple,np.ndarray)):
+            if len(values) != self.numberOfMembers:
+                raise ValueError("Expected %d values, one per ensemble member, got %d"%(self.numberOfMembers,len(values)))
+            for m,v in zip(self.members,values):
+                setter(m,v)
+        else:
+            for m in self.members:
+                setter(m,values)
+    
+    def gatherBoundaryConditions(self):
+        '''
+        Collect the boundary conditions of the members into stacked arrays
+        '''
+        self.collectBoundaryConditions()
+        self.parametersChanged()
+        
+    def collectBoundaryConditions(self):
+        members = self.members
+        self.Ta = np.array([m.Ta for m in members])
+        self.hc = np.array([m.hc for m in members])
+        self.lhm = np.array([m.lhm for m in members])
+        self.radiationHeatFlux = np.array([m.radiationHeatFlux[:,0] for m in members])
+        self.To = np.array([getattr(m,'To',m.Ta) for m in members])*np.ones(self.Ta.shape)
+        self.relativeHumdity = np.array([m.relativeHumdity for m in members])
+        self.met = np.array([m.met for m in members])
+        self.W = np.array([m.W for m in members])
+    
+    def setTa(self,Ta):
+        '''
+        Ambient air temperature, a single value or one per member
+        '''
+        self.forEachMember(Ta,lambda m,v: m.setTa(v))
+        self.gatherBoundaryConditions()
+    
+    def setRadiationFlux(self,radiationFluxModel):
+        self.forEachMember(radiationFluxModel,lambda m,v: m.setRadiationFlux(v))
+        self.gatherBoundaryConditions()
+        
+    def setClothingModel(self,clothingModel):
+        '''
+        clothingModel - a ClothingResistanceModel or one per member (for instance to vary the velocity of air)
+        '''
+        self.forEachMember(clothingModel,lambda m,v: m.setClothingModel(v))
+        self.gatherBoundaryConditions()
+        
+    def setRelativeHumidity(self,rh):
+        self.forEachMember(rh,lambda m,v: m.setRelativeHumidity(v))
+        self.gatherBoundaryConditions()
+        
+    def setMet(self,m):
+        self.forEachMember(m,lambda member,v: member.setMet(v))
+        self.gatherBoundaryConditions()
+        
+    def getW(self):
+        for m in self.members:
+            m.getW()
+        self.W = np.array([m.W for m in self.members])
+        
+    def getQ(self):
+        np.add(self.metabolicRate,self.W,out=self.Qij)
+        np.add(self.Qij,self.Ch,out=self.Qij)
+        return self.Qij
+    
+    def getInitialConditions(self):
+        ic = np.zeros(self.dtc.shape)
+        ic[:,0:-1] = np.reshape(self.setPointTemperature,(self.numberOfMembers,-1))
+        ic[:,-1] = self.cbcSetPointTemperature
+        return np.reshape(ic,(-1))
+    
+    def getState(self):
+        state = np.zeros(self.dtc.shape)
+        state[:,0:-1] = np.reshape(self.temperature,(self.numberOfMembers,-1))
+        state[:,-1] = self.cbcTemp
+        return np.reshape(state,(-1))
+    
+    def setState(self,state):
+        '''
+        state - ensemble state vector, or the state of a single model which is used for all members
+        '''
+        state = np.asarray(state)
+        if state.shape[0] == self.nDofs*4+1:
+            state = np.tile(state,self.numberOfMembers)
+        state = np.reshape(state,self.dtc.shape)
+        self.temperature = np.reshape(state[:,0:-1],self.temperature.shape).copy()
+        self.cbcTemp = state[:,-1].copy()
+        
+    def updateInvariantTerms(self):
+        if self.invariantTermsEpoch == self.parameterEpoch:
+            return
+        for m in self.members:
+            m.updateInvariantTerms()
+        self.ambientVapourPressure = np.array([m.ambientVapourPressure for m in self.members])
+        self.resFactor = np.array([m.resFactor for m in self.members])
+        self.invariantTermsEpoch = self.parameterEpoch
+        
+    def computeErrCldsWrms(self,temperature):
+        self.Err = temperature - self.setPointTemperature
+        Err3 = self.Err[:,:,3]
+        self.Wrms = np.sum(self.SKINR_norm*np.where(Err3<0,0.0,Err3),axis=1)
+        self.Clds = np.sum(self.SKINR_norm*np.where(Err3>0,0.0,-Err3),axis=1)
+        
+        e11 = np.sum(self.Err[:,self.headIndexes,0]*self.headSurfaceFactors,axis=1)
+        self.Err11 = e11
+        Wrm11 = np.maximum(e11,0)
+        Cld11 = np.maximum(-e11,0)
+        Ch1 = ((-self.Cch*e11-self.Sch*(self.Wrms-self.Clds) + self.Pch*Cld11*self.Clds)[:,np.newaxis])*self.chit
+        Ch1[Ch1<0] = 0
+        self.Ch[:,:,1] = Ch1
+        
+        self.DL = self.Cdl*e11+self.Sdl*(self.Wrms-self.Clds) + self.Pdl*Wrm11*self.Wrms
+        self.DL[self.DL<0] = 0
+        self.ST = -self.Cst*e11-self.Sst*(self.Wrms-self.Clds) + self.Pst*Cld11*self.Clds
+        self.ST[self.ST<0] = 0
+        self.km = np.power(2.0,Err3/10)
+        self.Esw = ((self.Csw*e11 + self.Ssw*(self.Wrms-self.Clds) + self.Psw*Wrm11*self.Wrms)[:,np.newaxis])*self.SKINS*self.km
+    
+    def getEmax(self,temperature,out=None):
+        self.updateInvariantTerms()
+        T3 = temperature[:,:,3]
+        Psk = 0.61078*np.exp(17.625*T3/(T3+237.3))
+        v = self.emaxFactor*(Psk-self.ambientVapourPressure)*self.bodySurfaceArea/self.lhm
+        v[v<0] = 0.0
+        if out is not None:
+            out[:] = v
+            return out
+        return v
+    
+    def getQti(self,temperature,out=None):
+        return (temperature[:,:,3]-self.To)*self.hc*self.bodySurfaceArea
+    
+    def RES(self):
+        self.updateInvariantTerms()
+        return self.resFactor*np.sum(self.Qij,axis=(1,2))
+    
+    def dTbydt(self,temp):
+        K = self.numberOfMembers
+        state = np.reshape(temp,self.dtc.shape)
+        temperature = np.reshape(state[:,0:-1],(K,self.nDofs,4))
+        cbcTemp = state[:,-1]
+        self.updateInvariantTerms()
+        self.computeErrCldsWrms(temperature)
+        Qij = self.getQ()
+        
+        BFS = self.basalBloodFlow + (self.W + self.Ch)/1.16
+        #Compute BF For skin
+        BFS[:,:,3] = self.km*(self.basalBloodFlow[:,:,3] + self.SKINV*self.DL[:,np.newaxis])/(1.0+self.SKINC*self.ST[:,np.newaxis])
+        BF = self.alpha*self.rhoC*BFS*(temperature - cbcTemp[:,np.newaxis,np.newaxis])
+        D  = self.thermalConductance*(temperature[:,:,0:3]-temperature[:,:,1:])
+
+        Qt = self.getQti(temperature)
+        Emax  = self.getEmax(temperature)
+        Esw = self.Esw
+        Esw[Esw<0] = 0.0
+        E = self.eswScaleFactor*(Emax-Esw) + Esw
+        ix = E>Esw
+        E[ix] = Esw[ix]
+        dT = self.dT
+        dT[:,:,0] = Qij[:,:,0] - BF[:,:,0] - D[:,:,0]
+        dT[:,:,1] = Qij[:,:,1] - BF[:,:,1] + D[:,:,0] - D[:,:,1]
+        dT[:,:,2] = Qij[:,:,2] - BF[:,:,2] + D[:,:,1] - D[:,:,2]
+        dT[:,:,3] = Qij[:,:,3] - BF[:,:,3] + D[:,:,2] - Qt - E + self.radiationHeatFlux
+        #Do RES for chest
+        dT[:,self.chestIndexes,0] -= self.RES()[:,np.newaxis]
+        
+        self.dtc[:,0:-1] = np.reshape(dT/self.heatCapacity,(K,-1))
+        self.dtc[:,-1] = np.sum(BF,axis=(1,2))/self.cbcheatCapacity
+        return np.reshape(self.dtc,(-1))
+    
+    def getMemberJacobianPattern(self):
+        '''
+        Row and column indices (within a member block) of the local jacobian entries in the order their values are computed,
+        and the rows and columns coupled through Err11, Wrms and Clds
+        '''
+        if self.jacobianPattern is None:
+            nDofs = self.nDofs
+            n = nDofs*4+1
+            dofs = np.arange(nDofs)
+            rows = [np.ravel(4*dofs[:,np.newaxis]+np.arange(4))]
+            cols = [rows[0]]
+            for j in range(3):
+                rows.extend([4*dofs+j,4*dofs+j+1])
+                cols.extend([4*dofs+j+1,4*dofs+j])
+            rows.extend([np.arange(n-1),np.full(n-1,n-1),np.array([n-1])])
+            cols.extend([np.full(n-1,n-1),np.arange(n-1),np.array([n-1])])
+            coupledRows = np.concatenate([4*dofs+1,4*dofs+3,4*self.chestIndexes,[n-1]])
+            coupledCols = np.concatenate([4*self.headIndexes,4*dofs+3])
+            self.jacobianPattern = (np.concatenate(rows),np.concatenate(cols),coupledRows,coupledCols)
+        return self.jacobianPattern
+    
+    def assembleBlockDiagonal(self,values,rows,cols):
+        K = self.numberOfMembers
+        n = self.nDofs*4+1
+        offsets = (n*np.arange(K))[:,np.newaxis]
+        return sparse.coo_matrix((np.ravel(values),(np.ravel(offsets+rows),np.ravel(offsets+cols))),shape=(K*n,K*n)).tocsc()
+    
+    def computeJacobianBlocks(self,temp):
+        '''
+        Returns the local jacobian values of each member (K x number of local entries) and the per member factors
+        of the global coupling, U (K x coupled rows x 3) and G (K x 3 x coupled columns)
+        '''
+        self.dTbydt(temp)
+        K = self.numberOfMembers
+        nDofs = self.nDofs
+        state = np.reshape(temp,self.dtc.shape)
+        temperature = np.reshape(state[:,0:-1],(K,nDofs,4))
+        cbcTemp = state[:,-1]
+        ln2by10 = np.log(2.0)/10.0
+        cr = self.alpha*self.rhoC
+        Kc = self.thermalConductance
+        heatCapacity = self.heatCapacity
+        cbcheatCapacity = self.cbcheatCapacity[:,np.newaxis]
+        dTs = temperature - cbcTemp[:,np.newaxis,np.newaxis]
+        
+        BFS = self.basalBloodFlow + (self.W + self.Ch)/1.16
+        stf = 1.0+self.SKINC*self.ST[:,np.newaxis]
+        BFS[:,:,3] = self.km*(self.basalBloodFlow[:,:,3] + self.SKINV*self.DL[:,np.newaxis])/stf
+        #Evaporative loss, E = Esw when Emax > Esw else Esw + eswScaleFactor*(Emax-Esw)
+        T3 = temperature[:,:,3]
+        Psk = 0.61078*np.exp(17.625*T3/(T3+237.3))
+        Emax = self.getEmax(temperature)
+        dEmax = self.emaxFactor*Psk*17.625*237.3/np.square(T3+237.3)*self.bodySurfaceArea/self.lhm
+        dEmax[Emax<=0] = 0.0
+        Esw = self.Esw
+        saturated = Emax > Esw
+        dEdEsw = np.where(saturated,1.0,1.0-self.eswScaleFactor)
+        dEdEmax = np.where(saturated,0.0,self.eswScaleFactor)
+        dE = dEdEsw*np.where(Esw>0,Esw*ln2by10,0.0) + dEdEmax*dEmax
+        
+        diag = np.zeros((K,nDofs,4))
+        diag[:,:,0] = -cr*BFS[:,:,0] - Kc[:,:,0]
+        diag[:,:,1] = -cr*BFS[:,:,1] - Kc[:,:,0] - Kc[:,:,1]
+        diag[:,:,2] = -cr*BFS[:,:,2] - Kc[:,:,1] - Kc[:,:,2]
+        diag[:,:,3] = -cr*BFS[:,:,3]*(1.0+ln2by10*dTs[:,:,3]) - Kc[:,:,2] - self.hc*self.bodySurfaceArea - dE
+        dBF = cr*BFS
+        dBF[:,:,3] *= (1.0+ln2by10*dTs[:,:,3])
+        
+        vals = [np.reshape(diag/heatCapacity,(K,-1))]
+        for j in range(3):
+            vals.append(Kc[:,:,j]/heatCapacity[:,:,j])
+            vals.append(Kc[:,:,j]/heatCapacity[:,:,j+1])
+        vals.append(np.reshape(cr*BFS/heatCapacity,(K,-1)))
+        vals.append(np.reshape(dBF,(K,-1))/cbcheatCapacity)
+        vals.append(-cr*np.sum(BFS,axis=(1,2))[:,np.newaxis]/cbcheatCapacity)
+        
+        #Gradients of Err11, Wrms and Clds with respect to the coupled columns (head core, skin)
+        nHead = self.headIndexes.shape[0]
+        G = np.zeros((K,3,nHead+nDofs))
+        G[:,0,0:nHead] = self.headSurfaceFactors
+        G[:,1,nHead:] = self.SKINR_norm*(self.Err[:,:,3] > 0)
+        G[:,2,nHead:] = -self.SKINR_norm*(self.Err[:,:,3] < 0)
+        
+        e11 = self.Err11
+        Wrm11 = np.maximum(e11,0.0)
+        Cld11 = np.maximum(-e11,0.0)
+        ones = np.ones(K)
+        da = np.stack([-self.Cch - self.Pch*self.Clds*(e11<0), -self.Sch*ones, self.Sch + self.Pch*Cld11],axis=1)
+        db = np.stack([self.Cdl + self.Pdl*self.Wrms*(e11>0), self.Sdl + self.Pdl*Wrm11, -self.Sdl*ones],axis=1)*(self.DL>0)[:,np.newaxis]
+        dd = np.stack([-self.Cst - self.Pst*self.Clds*(e11<0), -self.Sst*ones, self.Sst + self.Pst*Cld11],axis=1)*(self.ST>0)[:,np.newaxis]
+        df = np.stack([self.Csw + self.Psw*self.Wrms*(e11>0), self.Ssw + self.Psw*Wrm11, -self.Ssw*ones],axis=1)
+        
+        dCh = ((self.Ch[:,:,1] > 0)*self.chit)[:,:,np.newaxis]*da[:,np.newaxis,:]
+        dBFS3 = self.km[:,:,np.newaxis]*((self.SKINV/stf)[:,:,np.newaxis]*db[:,np.newaxis,:] \
+                                         - ((self.basalBloodFlow[:,:,3] + self.SKINV*self.DL[:,np.newaxis])*self.SKINC/np.square(stf))[:,:,np.newaxis]*dd[:,np.newaxis,:])
+        dEsw = ((Esw>0)*self.SKINS*self.km)[:,:,np.newaxis]*df[:,np.newaxis,:]
+        Uf = np.zeros((K,nDofs,4,3))
+        Uf[:,:,1,:] = dCh - cr*(dCh/1.16)*dTs[:,:,1,np.newaxis]
+        Uf[:,:,3,:] = -cr*dBFS3*dTs[:,:,3,np.newaxis] - dEdEsw[:,:,np.newaxis]*dEsw
+        Uf[:,self.chestIndexes,0,:] -= (self.resFactor[:,np.newaxis]*np.sum(dCh,axis=1))[:,np.newaxis,:]
+        Uf /= heatCapacity[:,:,:,np.newaxis]
+        Ucbc = cr*np.sum((dCh/1.16)*dTs[:,:,1,np.newaxis] + dBFS3*dTs[:,:,3,np.newaxis],axis=1)/cbcheatCapacity
+        U = np.concatenate([Uf[:,:,1,:],Uf[:,:,3,:],Uf[:,self.chestIndexes,0,:],Ucbc[:,np.newaxis,:]],axis=1)
+        return np.concatenate(vals,axis=1),U,G
+    
+    def dTbydtJacobian(self,temp,includeGlobalCoupling=None):
+        '''
+        Block diagonal jacobian of dTbydt, one block (including the global coupling) per member
+        '''
+        rows,cols,coupledRows,coupledCols = self.getMemberJacobianPattern()
+        local,U,G = self.computeJacobianBlocks(temp)
+        coupled = np.reshape(np.matmul(U,G),(self.numberOfMembers,-1))
+        return self.assembleBlockDiagonal(np.concatenate([local,coupled],axis=1),\
+                                          np.concatenate([rows,np.repeat(coupledRows,coupledCols.shape[0])]),\
+                                          np.concatenate([cols,np.tile(coupledCols,coupledRows.shape[0])]))
+    
+    def dTbydtJacobianFactors(self,temp):
+        '''
+        Jacobian split as J = L + U*G with block diagonal L, the coupling is low rank within each block
+        U - (K*(nDofs*4+1) x 3) and G - (K x 3 x nDofs*4+1), see LowRankUpdateLU with blockSize
+        '''
+        rows,cols,coupledRows,coupledCols = self.getMemberJacobianPattern()
+        local,Uc,Gc = self.computeJacobianBlocks(temp)
+        K = self.numberOfMembers
+        n = self.jacobianBlockSize
+        U = np.zeros((K,n,3))
+        U[:,coupledRows,:] = Uc
+        G = np.zeros((K,3,n))
+        G[:,:,coupledCols] = Gc
+        return self.assembleBlockDiagonal(local,rows,cols),np.reshape(U,(K*n,3)),G
+    
+    def getJacobianSparsity(self,includeGlobalCoupling=None):
+        rows,cols,coupledRows,coupledCols = self.getMemberJacobianPattern()
+        rows = np.concatenate([rows,np.repeat(coupledRows,coupledCols.shape[0])])
+        cols = np.concatenate([cols,np.tile(coupledCols,coupledRows.shape[0])])
+        pattern = self.assembleBlockDiagonal(np.ones((self.numberOfMembers,rows.shape[0])),rows,cols)
+        pattern.data[:] = 1.0
+        return pattern
+        
+    def updateDerivedQuantities(self):
+        self.dTbydt(self.getState())
+        Emax = self.getEmax(self.temperature)
+        Emax[Emax==0] = 1.0 #Avoid divide by zero
+        Esw = self.Esw
+        Esw[Esw<0] = 0.0        
+        self.wettedness = 0.06 + 0.94*Esw/Emax #Using formula 14 of Journal of Atmaca and Yigit, Thermal Biology 31 (2006) 442-452 
+        
+    def getMeanSkinTemperature(self):
+        return np.sum(self.temperature[:,:,3]*self.bodySurfaceArea,axis=1)/np.sum(self.bodySurfaceArea,axis=1)
+
+    def getMeanCoreTemperature(self):
+        return np.sum(self.temperature[:,:,0]*self.bodySurfaceArea,axis=1)/np.sum(self.bodySurfaceArea,axis=1)
+    
+    def getRectalTemperature(self):
+        pelvis = self.segmentAggregator.getFaces(3)
+        psa = self.bodySurfaceArea[:,pelvis]
+        return np.sum(self.temperature[:,pelvis,0]*psa,axis=1)/np.sum(psa,axis=1)
+    
+    def getMeanThermalResistance(self):
+        return np.mean(self.hc,axis=1)
+    
+    def getMeanEvaporativelResistance(self):
+        return np.mean(self.lhm,axis=1)
+    
+    def FangerPMV(self,vel = 0.0,wme=0):
+        '''
+        Returns arrays of the pmv and ppd of each member (nan where the clothing temperature iteration failed)
+        '''
+        tr = np.array([np.mean(m.Tr) for m in self.members])
+        return self.fangerComfortModel.computePMVArrays(self.Ta[:,0],tr,vel,self.relativeHumdity,self.met,wme,0.10)
+    
+    def getZhangComfortInputs(self):
+        '''
+        (K,16) arrays of the segment values used by ZhangModel.computePMVArrays
+        '''
+        segmentMean = self.segmentAggregator.mean
+        def memberMeans(values):
+            return segmentMean(values.T).T
+        return memberMeans(self.temperature[:,:,3]),memberMeans(self.dT[:,:,3]/self.heatCapacity[:,:,3]),\
+               memberMeans(self.temperature[:,:,0]),memberMeans(self.dT[:,:,0]/self.heatCapacity[:,:,0]),\
+               self.segmentAggregator.first(self.setPointTemperature[:,:,3].T).T
+    
+    def ZhangPMVPPD(self):
+        '''
+        Returns lists of the overall pmv, ppd and sensation of each member
+        '''
+        pmv,ppd,sensation = self.zhangComfortModel.computePMVArrays(*self.getZhangComfortInputs())
+        return list(pmv),list(ppd),[self.zhangComfortModel.getSensationLabel(s) for s in sensation]
+    
+    def save(self,filename):
+        with open(filename,'wb') as ser:
+            pickle.dump([self.temperature,self.cbcTemp,self.dT,self.humanModel.dofIndexes],ser)
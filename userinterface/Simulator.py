@@ -60,10 +60,12 @@ import pickle
 import traceback
 import tempfile
 from userinterface.ActivityWizard import ActivityDefinitionWidget
-from bodymodels.LoadOBJHumanModel import HumanModel
+from bodymodels.LoadOBJHumanModel import HumanModel, zincFieldNames
 from support.ZincGraphicsElements import GenerateZincGraphicsElements,\
     createZincTitleBar
-from support.Simulations import SimulationProcessManager, Simulator
+from support.Simulations import SimulationProcessManager, Simulator, SimulationData
+from support.ProjectFiles import saveProjectFile, loadProjectFile
+from support.ResultFiles import isResultFile
 from copy import deepcopy
 from PyQt5.Qt import QApplication, QTimer, QColorDialog, QStyle, QMessageBox,\
     qApp, QFileDialog
@@ -313,6 +315,10 @@ class SimulationMainWindow(base, form):
     currentSimulationData = None
     currentMeshData = None
     projectMetaData = ''
+    #Results shown on the mesh one field sample at a time, see showTimeSlice
+    timeSliceData = None
+    renderedTimeSlice = None
+    availableFieldSamples = 0
     anatomyKeys = ['Head','Chest','Back','Pelvis','L-shoulder','R-shoulder','L-arm','R-arm','L-hand','R-hand','L-thigh','R-thigh','L-leg','R-leg','L-foot','R-foot']
     def __init__(self,title='ABI comfort simulator',parent=None):
         super(base,self).__init__(parent)
@@ -495,9 +501,40 @@ class SimulationMainWindow(base, form):
             ind.setValue(value)
         try:
             self.zincGraphics.setTime(int(value*self.simulationTimeConversionFactor))
+            self.showTimeSlice(int(value*self.simulationTimeConversionFactor))
         except:
             pass
 
+    def showTimeSlice(self,timeIndex):
+        '''
+        Assign field sample timeIndex of the results to the mesh, only the sample being viewed is loaded
+        '''
+        if self.timeSliceData is None or self.availableFieldSamples < 1:
+            return
+        timeIndex = min(max(timeIndex,0),self.availableFieldSamples-1)
+        if timeIndex != self.renderedTimeSlice:
+            self.humanParam.assignTimeSlice(self.zincContext,self.timeSliceData,timeIndex)
+            self.renderedTimeSlice = timeIndex
+    
+    def getPotentialRanges(self,simulationData,start=0,stop=None):
+        '''
+        Returns the maximum and minimum of each mesh field over field samples start..stop-1
+        Disk backed results are reduced a chunk at a time
+        '''
+        maxPotentials = dict()
+        minPotentials = dict()
+        for name,attribute in zincFieldNames:
+            level = simulationData.getRecordingLevel(attribute)
+            if level == 'face' and start == 0 and stop is None:
+                values = getattr(simulationData,attribute)
+            elif level is None:
+                values = np.zeros(1)
+            else:
+                values = simulationData.getFaceField(attribute,start,stop)
+            maxPotentials[name] = values.max()
+            minPotentials[name] = values.min()
+        return maxPotentials, minPotentials
+
         
     def changeBodyPlotColor(self):
         color = QColorDialog.getColor(self.plotColor.palette().color(1))
@@ -1160,6 +1197,7 @@ class SimulationMainWindow(base, form):
                 
                 self.showProgress(25)
                 self.humanParam.generateMesh(self.zincContext,None) #Re-create with more time values when the simulation is completed
+                self.timeSliceData = None
                 self.showProgress(50)
                 self.renderMesh()
                 self.setZincTitleBarString("Skin Temperature")
@@ -1215,7 +1253,7 @@ class SimulationMainWindow(base, form):
     def saveProject(self):
         if self.currentMeshFile is not None or len(self.activities)>0:
             direc = WorkspaceCache.cache.get('LASTSUCCESSFULWORKSPACE',default='.')
-            filename = QFileDialog.getSaveFileName(None, tr('Save project file'),direc,"Pickle (*.pkl)")
+            filename = QFileDialog.getSaveFileName(None, tr('Save project file'),direc,"Project (*.abp)")
             if not filename is None and len(filename[0].strip())>0:
                 try:
                     if self.currentMeshFile is not None:
@@ -1226,9 +1264,8 @@ class SimulationMainWindow(base, form):
                     else:
                         mshData = None
                         
-                    with open(filename[0],'wb+') as ser:
-                        pickle.dump([mshData,self.humanBodyParameters, self.currentSimulationData,\
-                                      self.activities,self.computeUsingProjection, self.numberOfSubSteps,self.projectMetaData],ser)
+                    saveProjectFile(filename[0],mshData,self.humanBodyParameters, self.currentSimulationData,\
+                                    self.activities,self.computeUsingProjection, self.numberOfSubSteps,self.projectMetaData)
                     QtWidgets.QMessageBox.information(None, "Success", "Project successfully saved")
                 except:
                     traceback.print_exc(file=sys.stdout)
@@ -1239,24 +1276,23 @@ class SimulationMainWindow(base, form):
     
     def openProject(self):
         direc = WorkspaceCache.cache.get('LASTSUCCESSFULWORKSPACE',default='.')
-        filename = QFileDialog.getOpenFileName(None, tr('Open project file'),direc,"Pickle (*.pkl)")
+        filename = QFileDialog.getOpenFileName(None, tr('Open project file'),direc,"Project (*.abp *.pkl)")
         self.openProjectFromFile(filename)
     
     def openProjectFromFile(self,filename):
         if not filename is None and len(filename[0].strip())>0:
             try:
                 QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-                with open(filename[0],'rb+') as ser:
-                    try:
-                        mshData, self.humanBodyParameters, self.currentSimulationData,\
-                                self.activities,self.computeUsingProjection, \
-                                self.numberOfSubSteps, self.projectMetaData = pickle.load(ser)
-                    except UnicodeDecodeError:
-                        QtWidgets.QMessageBox.critical(None,tr("Unsupported pickle format"),tr("The project was saved using python 2 and cannot be loaded in a simulator instance running on python 3"))
-                        return
+                try:
+                    mshData, self.humanBodyParameters, self.currentSimulationData,\
+                            self.activities,self.computeUsingProjection, \
+                            self.numberOfSubSteps, self.projectMetaData = loadProjectFile(filename[0])
+                except UnicodeDecodeError:
+                    QtWidgets.QMessageBox.critical(None,tr("Unsupported pickle format"),tr("The project was saved using python 2 and cannot be loaded in a simulator instance running on python 3"))
+                    return
 
                 tfile = tempfile.NamedTemporaryFile(suffix=".obj",delete=False)
-                with open(tfile.name,'w') as ser:
+                with open(tfile.name,'wb' if isinstance(mshData,bytes) else 'w') as ser:
                     ser.write(mshData)
 
                 self.currentMeshData = mshData
@@ -1334,6 +1370,9 @@ class SimulationMainWindow(base, form):
                     self.simulationThread.setup(self.activities,self.humanParam,self.computeUsingProjection,self.numberOfSubSteps)
                 self.simulationThread.progress.connect(self.showProgress)
                 self.simulationThread.finished.connect(self.simulationCompleted)
+                #Show the results of each activity as they arrive
+                self.renderedFieldSamples = None
+                self.simulationThread.samplesReceived.connect(self.showPartialResults)
                 if self.debugMode:
                     self.simulationThread.run()
                     self.simulationCompleted() #As event will not be triggered
@@ -1381,6 +1420,42 @@ class SimulationMainWindow(base, form):
         else:
             QMessageBox.information(self, tr("Missing information"), tr("Activity description and target mesh should be provided."))
         
+    def showPartialResults(self,numberOfSamples):
+        '''
+        Render the first numberOfSamples samples of the running simulation
+        The mesh is created on the first call, the sample at the time slider is shown once it has been computed
+        '''
+        simulationData = self.simulationThread.getSimulationResults()
+        numberOfFieldSamples = simulationData.getNumberOfFieldSamples(numberOfSamples)
+        if numberOfSamples < 1 or numberOfFieldSamples == self.renderedFieldSamples:
+            return
+        startTime = 0
+        if self.renderedFieldSamples is None:
+            self.humanParam.generateMesh(self.zincContext)
+            self.partialMaxPotentials = dict()
+            self.partialMinPotentials = dict()
+        else:
+            startTime = self.renderedFieldSamples
+        maxPotentials,minPotentials = self.getPotentialRanges(simulationData,startTime,numberOfFieldSamples)
+        for name,_ in zincFieldNames:
+            self.partialMaxPotentials[name] = max(maxPotentials[name],self.partialMaxPotentials.get(name,maxPotentials[name]))
+            self.partialMinPotentials[name] = min(minPotentials[name],self.partialMinPotentials.get(name,minPotentials[name]))
+        self.simulationTimeConversionFactor = float(simulationData.getNumberOfFieldSamples())/self.maxTime
+        #The sample at the slider may not have been available before
+        self.timeSliceData = simulationData
+        self.availableFieldSamples = numberOfFieldSamples
+        self.renderedTimeSlice = None
+        self.showTimeSlice(int(self.timeSlider.value()*self.simulationTimeConversionFactor))
+        if self.renderedFieldSamples is None:
+            self.zincGraphics.createGraphicsElements(self.partialMaxPotentials, self.partialMinPotentials)
+        else:
+            self.zincGraphics.setSpectrumRanges(self.partialMaxPotentials, self.partialMinPotentials)
+        self.renderedFieldSamples = numberOfFieldSamples
+        self.plotSimulationData(simulationData,numberOfSamples,(min(self.partialMinPotentials['Tskin'],self.partialMinPotentials['Tcore']),\
+                                                                 max(self.partialMaxPotentials['Tskin'],self.partialMaxPotentials['Tcore'])))
+        #Only the completed part of the simulation can be viewed
+        self.timeSlider.setMaximum(int(simulationData.timeValue[numberOfSamples-1]))
+
     def simulationCompleted(self):
         self.showProgress(50) #Start loading
         simulationData = self.simulationThread.getSimulationResults()
@@ -1401,7 +1476,7 @@ class SimulationMainWindow(base, form):
     
     def loadSimulationResultsAskFile(self):
         direc = WorkspaceCache.cache.get('LASTSUCCESSFULWORKSPACE',default='.')
-        filename = QFileDialog.getOpenFileName(None, tr('Load Activity file'),direc,"Pickle (*.pkl);; All (*.*)")
+        filename = QFileDialog.getOpenFileName(None, tr('Load Activity file'),direc,"Simulation results (*.abr *.pkl);; All (*.*)")
         if not filename is None:
             QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
             self.loadSimulationResultsFromFile(filename[0])
@@ -1412,6 +1487,9 @@ class SimulationMainWindow(base, form):
         if not filename is None and len(filename.strip()) > 0:
             self.showProgress(0)
             try:
+                if isResultFile(filename):
+                    self.renderSimulationData(SimulationData.load(filename))
+                    return
                 with open(filename,'rb') as ser:
                     simulationData = pickle.load(ser)
                     if isinstance(simulationData,dict):
@@ -1426,49 +1504,72 @@ class SimulationMainWindow(base, form):
 
             
     def renderSimulationData(self,simulationData):        
-        self.humanParam.generateMesh(self.zincContext,simulationData)
+        #Only the sample at the time slider is loaded into the mesh, see showTimeSlice
+        self.humanParam.generateMesh(self.zincContext)
+        self.timeSliceData = simulationData
+        self.availableFieldSamples = simulationData.getNumberOfFieldSamples()
+        self.renderedTimeSlice = None
+        self.showTimeSlice(0)
         self.showProgress(60)
-        maxPotentials = dict()
-        minPotentials = dict()
-        maxPotentials['Tskin'] = simulationData.skinTemperature.max()
-        minPotentials['Tskin'] = simulationData.skinTemperature.min()
-        maxPotentials['Tcore'] = simulationData.coreTemperature.max()
-        minPotentials['Tcore'] = simulationData.coreTemperature.min()
-        maxPotentials['SkinWettedness'] = simulationData.skinWettedness.max()
-        minPotentials['SkinWettedness'] = simulationData.skinWettedness.min()
-        maxPotentials['ThermalResistance'] = simulationData.thermalResistance.max()
-        minPotentials['ThermalResistance'] = simulationData.thermalResistance.min()
-        maxPotentials['EvaporativeResistance'] = simulationData.evaporativeResistance.max()
-        minPotentials['EvaporativeResistance'] = simulationData.evaporativeResistance.min()
+        maxPotentials,minPotentials = self.getPotentialRanges(simulationData)
 
         self.showProgress(75) #Start loading
-        self.simulationTimeConversionFactor = float(simulationData.numberOfTimeSamples)/self.maxTime
+        self.simulationTimeConversionFactor = float(simulationData.getNumberOfFieldSamples())/self.maxTime
+        if getattr(simulationData,'stopTime',None) is not None:
+            #Simulations ended by a stop condition only have samples up to the stop time
+            self.simulationTimeConversionFactor = float(simulationData.getNumberOfFieldSamples())/(simulationData.stopTime + 1)
+            logging.info("Simulation stopped at %g s: %s"%(simulationData.stopTime,simulationData.stopReason))
         self.zincGraphics.createGraphicsElements(maxPotentials, minPotentials)
-        #update graph items
-        tvals = simulationData.timeValue
+        self.timeSlider.setMaximum(self.maxTime-1)
+        self.plotSimulationData(simulationData,simulationData.numberOfTimeSamples,(min(minPotentials['Tskin'],minPotentials['Tcore']),\
+                                                                                  max(maxPotentials['Tskin'],maxPotentials['Tcore'])))
+        self.showProgress(90) #
+        
+        #Show mean temperature so that the axis and graph location is shown
+        self.meanSkinTemperature.setChecked(True)
+        self.alltemperaturesPlotHandle.show()
+        self.actionPause.setEnabled(False)
+        self.actionStop.setEnabled(False)
+        self.showProgress(0,True)                
+        self.currentSimulationData = simulationData
+        #Resize temperature plot viewport else it is minimized until the window is changed
+        gscene = self.temperatureGLW.scene() 
+        tp = gscene.sceneRect()
+        self.temperatureGLW.viewport().resize(tp.width(),tp.height())
+
+    def plotSimulationData(self,simulationData,numberOfSamples,temperatureRange):
+        '''
+        Update the graphs with the first numberOfSamples samples of simulationData
+        temperatureRange - (min,max) of the skin and core temperatures
+        '''
+        tvals = simulationData.timeValue[:numberOfSamples]
+        numberOfFieldSamples = simulationData.getNumberOfFieldSamples(numberOfSamples)
 
-        self.meanThermalResistancePlotItemHandle.setData(tvals,simulationData.meanThermalResistance)
+        self.meanThermalResistancePlotItemHandle.setData(tvals,simulationData.meanThermalResistance[:numberOfSamples])
         #self.meanThermalResistancePlotHandle.setXRange(0,tvals[-1])
-        self.meanEvaporativeResistancePlotItemHandle.setData(tvals,simulationData.meanEvaporativeResistance)
+        self.meanEvaporativeResistancePlotItemHandle.setData(tvals,simulationData.meanEvaporativeResistance[:numberOfSamples])
         #self.meanEvaporativeResistancePlotHandle.setXRange(0,tvals[-1])
  
         for plt in list(self.bodyTemperaturePlotHandles.values()):
             plt.clear()
 
+        ftvals = simulationData.getFieldTimeValues()[:numberOfFieldSamples]
+        segmentSkinTemperatures = simulationData.getMeanSegmentSkinTemperatures(numberOfFieldSamples)
+        segmentCoreTemperatures = simulationData.getMeanSegmentCoreTemperatures(numberOfFieldSamples)
         for i,an in enumerate(self.anatomyKeys):
-            self.bodyTemperaturePlotHandles['%s_Skin'%an].setData(tvals,simulationData.getMeanSegmentSkinTemperature(i))
-            self.bodyTemperaturePlotHandles['%s_Core'%an].setData(tvals,simulationData.getMeanSegmentCoreTemperature(i))
+            self.bodyTemperaturePlotHandles['%s_Skin'%an].setData(ftvals,segmentSkinTemperatures[i])
+            self.bodyTemperaturePlotHandles['%s_Core'%an].setData(ftvals,segmentCoreTemperatures[i])
 
-        self.alltemperaturesPlotHandle.setYRange(min(minPotentials['Tskin'],minPotentials['Tcore'],simulationData.rectalTemperature.min())-1,\
-                                                 max(maxPotentials['Tskin'],maxPotentials['Tcore'],simulationData.rectalTemperature.max())+1)
-        self.showProgress(90) #
-        self.bodyTemperaturePlotHandles['MeanSkin'].setData(tvals,simulationData.meanSkinTemperature)
-        self.bodyTemperaturePlotHandles['MeanCore'].setData(tvals,simulationData.meanCoreTemperature)
-        self.bodyTemperaturePlotHandles['Rectal'].setData(tvals,simulationData.rectalTemperature)
+        rectalTemperature = simulationData.rectalTemperature[:numberOfSamples]
+        self.alltemperaturesPlotHandle.setYRange(min(temperatureRange[0],rectalTemperature.min())-1,\
+                                                 max(temperatureRange[1],rectalTemperature.max())+1)
+        self.bodyTemperaturePlotHandles['MeanSkin'].setData(tvals,simulationData.meanSkinTemperature[:numberOfSamples])
+        self.bodyTemperaturePlotHandles['MeanCore'].setData(tvals,simulationData.meanCoreTemperature[:numberOfSamples])
+        self.bodyTemperaturePlotHandles['Rectal'].setData(tvals,rectalTemperature)
 
         #Comfort levels
-        self.pmvPlotItemHandle.setData(tvals,simulationData.pmv)
-        self.ppdPlotItemHandle.setData(tvals,simulationData.ppd)
+        self.pmvPlotItemHandle.setData(tvals,simulationData.pmv[:numberOfSamples])
+        self.ppdPlotItemHandle.setData(tvals,simulationData.ppd[:numberOfSamples])
         self.pmvPlotItemHandle.show()
         self.ppdPlotItemHandle.show()
         self.comfortLevelsPlotHandle.showAxis('left')
@@ -1476,27 +1577,14 @@ class SimulationMainWindow(base, form):
         self.comfortLevelsPlotHandle.show()
         self.updateComfortLevelsViews()
         
-        #Show mean temperature so that the axis and graph location is shown
-        self.meanSkinTemperature.setChecked(True)
-        self.alltemperaturesPlotHandle.show()
-        self.actionPause.setEnabled(False)
-        self.actionStop.setEnabled(False)
-        self.showProgress(0,True)                
-        self.currentSimulationData = simulationData
-        #Resize temperature plot viewport else it is minimized until the window is changed
-        gscene = self.temperatureGLW.scene() 
-        tp = gscene.sceneRect()
-        self.temperatureGLW.viewport().resize(tp.width(),tp.height())
-        
     def saveSimulationData(self):
         if hasattr(self,'currentSimulationData'):            
             direc = WorkspaceCache.cache.get('LASTSUCCESSFULWORKSPACE',default='.')
-            filename = QtWidgets.QFileDialog.getSaveFileName(None, 'Simulation filename',direc,"Pickle (*.pkl);; All Files (*,*)")
+            filename = QtWidgets.QFileDialog.getSaveFileName(None, 'Simulation filename',direc,"Simulation results (*.abr);; All Files (*,*)")
             if not filename is None and len(filename[0].strip()) > 0:
                 QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
                 try:
-                    with open(filename[0],'wb+') as ser:
-                        pickle.dump(self.currentSimulationData,ser)
+                    self.currentSimulationData.save(filename[0])
                     WorkspaceCache.cache.set('LASTSUCCESSFULWORKSPACE',os.path.dirname(filename[0]))
                     QtWidgets.QMessageBox.information(None, "Success","Simulation data saved successfully!")
                 except Exception as e:
@@ -1507,7 +1595,11 @@ class SimulationMainWindow(base, form):
         useServer = WorkspaceCache.cache.get('useServer')
         if not useServer:
             try:
-                self.simulationThread.pause()
+                #Pause toggles between pausing and resuming the simulation
+                if self.simulationThread.isPaused():
+                    self.simulationThread.resume()
+                else:
+                    self.simulationThread.pause()
             except:
                 pass
     